@@ -204,3 +204,37 @@ def test_cifti_alff(data_dir, tmp_path_factory):
     # Now let's make sure ALFF has increased, as we added
     # to the amplitude of the lower frequencies in a voxel
     assert new_alff_data_mean > original_alff_data_mean
+
+
+def test_compute_alff():
+    """Check the blockwise ALFF kernel against a voxel-wise periodogram."""
+    import numpy as np
+    from scipy import signal
+
+    from xcp_d.utils.fcon import compute_alff
+
+    TR, lowpass, highpass = 0.8, 0.08, 0.009
+    rng = np.random.default_rng(0)
+    for n_timepoints in (120, 121):
+        data_matrix = rng.standard_normal((20, n_timepoints)) + 10
+
+        expected = np.zeros((20, 1))
+        for i_voxel, voxel_data in enumerate(data_matrix):
+            freqs, power_spec_density = signal.periodogram(
+                voxel_data,
+                1 / TR,
+                scaling="spectrum",
+            )
+            band = slice(
+                np.argmin(np.abs(freqs - highpass)),
+                np.argmin(np.abs(freqs - lowpass)),
+            )
+            expected[i_voxel] = 2 * np.mean(np.sqrt(power_spec_density)[band])
+
+        alff = compute_alff(data_matrix, lowpass, highpass, TR, block_size=7)
+        assert alff.shape == (20, 1)
+        assert np.allclose(alff, expected)
+
+        alff = compute_alff(data_matrix, lowpass, highpass, TR, dtype=np.float32)
+        assert alff.dtype == np.float32
+        assert np.allclose(alff, expected, rtol=1e-4)
@@ -110,3 +110,116 @@ def test_Reg_Cifti(data_dir):
         regressed_correlations.append(abs(r))
     # The strongest correlation should be less than 0.01
     assert (max(regressed_correlations)) < 0.01
+
+
+def test_projection_regression():
+    """Check that the projection engine matches sklearn's linear regression."""
+    from xcp_d.utils.utils import linear_regression, projection_regression
+
+    rng = np.random.default_rng(0)
+    confound = rng.standard_normal((6, 200))
+    data = rng.standard_normal((50, 6)) @ confound + rng.standard_normal((50, 200)) + 10
+
+    sklearn_residuals = linear_regression(data=data, confound=confound)
+    residuals = projection_regression(data=data, confound=confound, block_size=7)
+    assert residuals.dtype == np.float64
+    assert np.allclose(residuals, sklearn_residuals)
+
+    float32_residuals = projection_regression(data=data, confound=confound, dtype=np.float32)
+    assert float32_residuals.dtype == np.float32
+    assert np.allclose(float32_residuals, sklearn_residuals, atol=1e-4)
+
+    # A duplicated regressor makes the design rank deficient,
+    # but the residuals are unchanged.
+    redundant_confound = np.vstack((confound, confound[0, :] * 2))
+    redundant_residuals = projection_regression(data=data, confound=redundant_confound)
+    assert np.allclose(redundant_residuals, sklearn_residuals)
+
+
+def test_denoise_nifti(data_dir, tmp_path_factory, monkeypatch):
+    """Check that the fused denoising interface matches the separate interfaces."""
+    from xcp_d.interfaces.filtering import FilteringData
+    from xcp_d.interfaces.prepostcleaning import Interpolate
+    from xcp_d.interfaces.regression import Denoise
+
+    in_file = (
+        data_dir + "/fmriprep/sub-colornest001/ses-1/func/"
+        "sub-colornest001_ses-1_task-rest_run-1_space-MNI152NLin2009cAsym_desc-preproc_bold.nii.gz"
+    )
+    confounds = (
+        data_dir + "/fmriprep/sub-colornest001/ses-1/func/"
+        "sub-colornest001_ses-1_task-rest_run-1_desc-confounds_timeseries.tsv"
+    )
+    mask = (
+        data_dir + "/fmriprep/sub-colornest001/ses-1/func/"
+        "sub-colornest001_ses-1_task-rest_run-1_space-MNI152NLin2009cAsym_desc-brain_mask.nii.gz"
+    )
+    TR = 0.5
+    n_volumes = read_ndata(in_file, mask).shape[1]
+
+    # Flag a few volumes, without removing them from the BOLD data
+    tmpdir = tmp_path_factory.mktemp("test_denoise_nifti")
+    tmask_file = str(tmpdir / "tmask.tsv")
+    tmask = np.zeros(n_volumes)
+    tmask[[10, 11, 30]] = 1
+    pd.DataFrame({"framewise_displacement": tmask}).to_csv(tmask_file, sep="\t", index=False)
+
+    filter_kwargs = dict(TR=TR, lowpass=0.08, highpass=0.01, filter_order=2, bandpass_filter=True)
+
+    # Run each interface in its own directory, since they share output names
+    (tmpdir / "regression").mkdir()
+    monkeypatch.chdir(tmpdir / "regression")
+    regression = Regress(
+        mask=mask,
+        in_file=in_file,
+        original_file=in_file,
+        confounds=confounds,
+        TR=TR,
+        params="36P",
+    ).run()
+    (tmpdir / "interpolation").mkdir()
+    monkeypatch.chdir(tmpdir / "interpolation")
+    interpolation = Interpolate(
+        in_file=regression.outputs.res_file,
+        bold_file=in_file,
+        tmask=tmask_file,
+        mask_file=mask,
+        TR=TR,
+    ).run()
+    (tmpdir / "filtering").mkdir()
+    monkeypatch.chdir(tmpdir / "filtering")
+    filtering = FilteringData(
+        in_file=interpolation.outputs.bold_interpolated,
+        mask=mask,
+        **filter_kwargs,
+    ).run()
+
+    (tmpdir / "fused").mkdir()
+    monkeypatch.chdir(tmpdir / "fused")
+    denoise = Denoise(
+        in_file=in_file,
+        bold_file=in_file,
+        original_file=in_file,
+        confounds=confounds,
+        params="36P",
+        tmask=tmask_file,
+        mask=mask,
+        debug_intermediates=True,
+        **filter_kwargs,
+    ).run()
+
+    assert np.allclose(
+        read_ndata(denoise.outputs.res_file, mask),
+        read_ndata(regression.outputs.res_file, mask),
+        atol=1e-4,
+    )
+    assert np.allclose(
+        read_ndata(denoise.outputs.interpolated_file, mask),
+        read_ndata(interpolation.outputs.bold_interpolated, mask),
+        atol=1e-4,
+    )
+    assert np.allclose(
+        read_ndata(denoise.outputs.filtered_file, mask),
+        read_ndata(filtering.outputs.filtered_file, mask),
+        atol=1e-4,
+    )
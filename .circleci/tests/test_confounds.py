@@ -0,0 +1,156 @@
+"""Tests for loading and selecting confounds."""
+import numpy as np
+import pandas as pd
+
+from xcp_d.utils.confounds import load_confounds_table
+
+
+def test_load_confounds_table(tmp_path, monkeypatch):
+    """Check that confounds files are parsed once and served from the working cache."""
+    monkeypatch.setenv("XCPD_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("XCPD_WORK_CACHE_DIR", str(tmp_path / "work_cache"))
+    rng = np.random.default_rng(0)
+    columns = ["trans_x", "trans_y", "global_signal", "a_comp_cor_00"]
+    confounds_df = pd.DataFrame(rng.standard_normal((50, 4)), columns=columns)
+    confounds_df.loc[0, "trans_x"] = np.nan  # n/a in the first row of derivatives
+    confounds_df["motion_outlier00"] = np.eye(50, dtype=int)[3]
+    confounds_df["label"] = "volume"  # non-numeric columns are read from the TSV
+    confounds_file = str(tmp_path / "desc-confounds_timeseries.tsv")
+    confounds_df.to_csv(confounds_file, sep="\t", index=False, na_rep="n/a")
+
+    expected = pd.read_table(confounds_file)
+    loaded_df = load_confounds_table(confounds_file)
+    pd.testing.assert_frame_equal(loaded_df, expected)
+    assert loaded_df["motion_outlier00"].dtype == np.int64
+    assert len(list((tmp_path / "work_cache" / "confounds").iterdir())) == 2
+    pd.testing.assert_frame_equal(load_confounds_table(confounds_file), expected)
+
+    # Column subsets are read from the cache, in the requested order
+    subset_df = load_confounds_table(confounds_file, columns=["global_signal", "trans_x"])
+    pd.testing.assert_frame_equal(subset_df, expected[["global_signal", "trans_x"]])
+    assert len(list((tmp_path / "work_cache" / "confounds").iterdir())) == 2
+
+    # Modified files get their own entry
+    confounds_df.iloc[:10].to_csv(confounds_file, sep="\t", index=False, na_rep="n/a")
+    assert load_confounds_table(confounds_file).shape == (10, 6)
+    assert len(list((tmp_path / "work_cache" / "confounds").iterdir())) == 4
+    assert not (tmp_path / "cache" / "confounds").exists()
+
+
+def test_load_confounds_metadata(tmp_path, monkeypatch):
+    """Check that confounds JSON files are parsed once and served from the working cache."""
+    import json
+
+    from xcp_d.utils.confounds import load_confounds_metadata
+
+    monkeypatch.setenv("XCPD_WORK_CACHE_DIR", str(tmp_path / "work_cache"))
+    metadata = {"a_comp_cor_00": {"Mask": "WM", "Retained": True}}
+    confounds_json = str(tmp_path / "desc-confounds_timeseries.json")
+    with open(confounds_json, "w") as fo:
+        json.dump(metadata, fo)
+
+    assert load_confounds_metadata(confounds_json) == metadata
+    cache_files = list((tmp_path / "work_cache" / "confounds").iterdir())
+    assert [cache_file.suffix for cache_file in cache_files] == [".pkl"]
+    assert load_confounds_metadata(confounds_json) == metadata
+
+    # Modified files get their own entry
+    metadata["a_comp_cor_00"]["Retained"] = False
+    with open(confounds_json, "w") as fo:
+        json.dump(metadata, fo, indent=2)
+
+    assert load_confounds_metadata(confounds_json) == metadata
+    assert len(list((tmp_path / "work_cache" / "confounds").iterdir())) == 2
+
+
+def test_load_confound_matrix(tmp_path, monkeypatch):
+    """Check the expansions and column names of the registered confound models."""
+    import json
+
+    from xcp_d.utils.confounds import (
+        CONFOUND_MODELS,
+        MOTION_COLUMNS,
+        load_confound_matrix,
+    )
+
+    monkeypatch.setenv("XCPD_CACHE_DIR", str(tmp_path / "cache"))
+    rng = np.random.default_rng(0)
+    columns = MOTION_COLUMNS + ["global_signal", "csf", "white_matter", "cosine00"]
+    columns += [f"a_comp_cor_{i_comp:02d}" for i_comp in range(6)]
+    confounds_df = pd.DataFrame(rng.standard_normal((40, len(columns))), columns=columns)
+    bold_file = str(tmp_path / "sub-01_task-rest_space-MNI_desc-preproc_bold.nii.gz")
+    confounds_file = str(tmp_path / "sub-01_task-rest_desc-confounds_timeseries.tsv")
+    confounds_df.to_csv(confounds_file, sep="\t", index=False)
+    metadata = {
+        f"a_comp_cor_{i_comp:02d}": {"Mask": ["WM", "CSF"][i_comp % 2], "Retained": True}
+        for i_comp in range(6)
+    }
+    with open(confounds_file.replace(".tsv", ".json"), "w") as fo:
+        json.dump(metadata, fo)
+
+    confound = load_confound_matrix(bold_file, "36P", confound_tsv=confounds_file)
+    assert confound.shape == (40, 36)
+    motion = confounds_df[MOTION_COLUMNS].to_numpy()
+    motion_derivative = np.vstack((np.zeros((1, 6)), np.diff(motion, axis=0)))
+    assert np.allclose(confound[MOTION_COLUMNS], motion)
+    derivative_columns = [f"{column}_derivative1" for column in MOTION_COLUMNS]
+    assert np.allclose(confound[derivative_columns], motion_derivative)
+    square_columns = [f"{column}_derivative1_power2" for column in MOTION_COLUMNS]
+    assert np.allclose(confound[square_columns], motion_derivative ** 2)
+    assert np.allclose(confound["global_signal_power2"], confounds_df["global_signal"] ** 2)
+
+    confound = load_confound_matrix(bold_file, "acompcor_gsr", confound_tsv=confounds_file)
+    assert list(confound.columns[12:]) == [
+        "a_comp_cor_00",
+        "a_comp_cor_02",
+        "a_comp_cor_04",
+        "a_comp_cor_01",
+        "a_comp_cor_03",
+        "a_comp_cor_05",
+        "global_signal",
+        "cosine00",
+    ]
+
+    # custom confounds are appended to every model
+    custom_file = str(tmp_path / "custom.tsv")
+    pd.DataFrame(rng.standard_normal((40, 2))).to_csv(
+        custom_file, sep="\t", header=False, index=False
+    )
+    for params in ("24P", "27P", "custom"):
+        confound = load_confound_matrix(
+            bold_file, params, custom_confounds=custom_file, confound_tsv=confounds_file
+        )
+        n_model_columns = {"24P": 24, "27P": 27, "custom": 0}[params]
+        assert confound.shape == (40, n_model_columns + 2)
+        assert list(confound.columns[-2:]) == ["custom_0", "custom_1"]
+
+    assert set(CONFOUND_MODELS) == {
+        "24P", "27P", "36P", "acompcor", "acompcor_gsr", "aroma", "aroma_gsr", "custom"
+    }
+
+
+def test_confound_derivatives(tmp_path, monkeypatch):
+    """Check that derivatives are backward differences over volumes, not across columns."""
+    from xcp_d.utils.confounds import MOTION_COLUMNS, load_confound_matrix
+
+    monkeypatch.setenv("XCPD_WORK_CACHE_DIR", str(tmp_path / "work_cache"))
+    confounds_df = pd.DataFrame(0.0, index=range(4), columns=MOTION_COLUMNS)
+    confounds_df["rot_x"] = [0.0, 1.0, 3.0, 2.0]
+    confounds_df["rot_y"] = [5.0, 5.0, 5.0, 5.0]
+    confounds_df["csf"] = [1.0, 2.0, 4.0, 8.0]
+    confounds_df["white_matter"] = [2.0, 2.0, 1.0, 1.0]
+    confounds_df["global_signal"] = [10.0, 8.0, 8.0, 9.0]
+    bold_file = str(tmp_path / "sub-01_task-rest_space-MNI_desc-preproc_bold.nii.gz")
+    confounds_file = str(tmp_path / "sub-01_task-rest_desc-confounds_timeseries.tsv")
+    confounds_df.to_csv(confounds_file, sep="\t", index=False)
+    with open(confounds_file.replace(".tsv", ".json"), "w") as fo:
+        fo.write("{}")
+
+    confound = load_confound_matrix(bold_file, "36P", confound_tsv=confounds_file)
+    assert np.array_equal(confound["rot_x_derivative1"], [0, 1, 2, -1])
+    assert np.array_equal(confound["rot_y_derivative1"], [0, 0, 0, 0])
+    assert np.array_equal(confound["rot_x_derivative1_power2"], [0, 1, 4, 1])
+    assert np.array_equal(confound["csf_derivative1"], [0, 1, 2, 4])
+    assert np.array_equal(confound["white_matter_derivative1"], [0, 0, -1, 0])
+    assert np.array_equal(confound["global_signal_derivative1"], [0, -2, 0, 1])
+    assert np.array_equal(confound["global_signal_derivative1_power2"], [0, 4, 0, 1])
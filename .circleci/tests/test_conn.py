@@ -10,6 +10,7 @@ import numpy as np
 import pandas as pd
 from nilearn.input_data import NiftiLabelsMasker
 
+from xcp_d.utils.atlas import get_atlas_names
 from xcp_d.utils.concantenation import _t12native
 from xcp_d.utils.plot import _get_tr
 from xcp_d.utils.write_save import read_ndata, write_ndata
@@ -88,12 +89,11 @@ def test_nifti_conn(data_dir, tmp_path_factory):
     fcon_ts_wf.run()
 
     # Let's find the correct FCON matrix file
-    for file in os.listdir(os.path.join(
-            fcon_ts_wf.base_dir, "fcons_ts_wf/nifti_connect/mapflow/_nifti_connect3")):
-        if fnmatch.fnmatch(file, "*matrix*"):
+    atlas_name = get_atlas_names()[3]
+    for file in os.listdir(os.path.join(fcon_ts_wf.base_dir, "fcons_ts_wf/nifti_connect")):
+        if fnmatch.fnmatch(file, f"*atlas-{atlas_name}_*matrix*"):
             out_file = file
-    out_file = os.path.join(fcon_ts_wf.base_dir,
-                            "fcons_ts_wf/nifti_connect/mapflow/_nifti_connect3", out_file)
+    out_file = os.path.join(fcon_ts_wf.base_dir, "fcons_ts_wf/nifti_connect", out_file)
 
     # Read that into a df
     df = pd.read_table(out_file, header=None)
@@ -154,32 +154,223 @@ def test_cifti_conn(data_dir, tmp_path_factory):
     # Create the node and a tempdir to write its results out to
     tmpdir = tmp_path_factory.mktemp("fcon_cifti_test_2")
     cifti_conts_wf = init_cifti_functional_connectivity_wf(
-        mem_gb=4, name="cifti_ts_con_wf", omp_nthreads=2
+        mem_gb=4, name="cifti_ts_con_wf"
     )
     cifti_conts_wf.base_dir = tmpdir
     # Run the node
     cifti_conts_wf.inputs.inputnode.clean_bold = fake_bold_file
     cifti_conts_wf.run()
     # Let's find the correct parcellated file
-    for file in os.listdir(os.path.join(
-            cifti_conts_wf.base_dir, "cifti_ts_con_wf/parcellate_data/mapflow/_parcellate_data3")):
-        if fnmatch.fnmatch(file, "*dtseries*"):
+    atlas_name = get_atlas_names()[3]
+    out_dir = os.path.join(cifti_conts_wf.base_dir, "cifti_ts_con_wf/cifti_connect")
+    for file in os.listdir(out_dir):
+        if fnmatch.fnmatch(file, f"*atlas-{atlas_name}.ptseries.nii"):
             out_file = file
-    out_file = os.path.join(cifti_conts_wf.base_dir,
-                            "cifti_ts_con_wf/parcellate_data/mapflow/_parcellate_data3", out_file)
+    out_file = os.path.join(out_dir, out_file)
     # Let's read out the parcellated time series and get its corr coeff
     data = read_ndata(out_file)
     ground_truth = np.corrcoef(data)
     # Let's find the conn matt generated by XCP
-    for file in os.listdir(os.path.join(
-            cifti_conts_wf.base_dir, "cifti_ts_con_wf/correlate_data/mapflow/_correlate_data3")):
-        if fnmatch.fnmatch(file, "*matrix*"):
+    for file in os.listdir(out_dir):
+        if fnmatch.fnmatch(file, f"*atlas-{atlas_name}.pconn.nii"):
             out_file = file
-    out_file = os.path.join(cifti_conts_wf.base_dir,
-                            "cifti_ts_con_wf/correlate_data/mapflow/_correlate_data3", out_file)
+    out_file = os.path.join(out_dir, out_file)
 
     # Read it out
-    data = read_ndata(out_file)
+    data = nb.load(out_file).get_fdata()
 
     # Do the two match up?
     assert np.allclose(data, ground_truth, atol=0.01)
+
+
+def test_extract_timeseries_funct(tmp_path):
+    """Check that multi-atlas extraction matches NiftiLabelsMasker for each atlas."""
+    from xcp_d.utils.fcon import extract_timeseries_funct
+
+    rng = np.random.default_rng(0)
+    affine = np.diag([2, 2, 2, 1])
+    bold_file = str(tmp_path / "bold.nii.gz")
+    nb.Nifti1Image(rng.standard_normal((8, 9, 7, 30)), affine).to_filename(bold_file)
+
+    atlases = []
+    for i_atlas, n_labels in enumerate([5, 12]):
+        labels = rng.integers(0, n_labels + 1, size=(8, 9, 7)).astype(np.int16)
+        labels[labels == 2] = 0  # a label missing from the atlas
+        atlases.append(str(tmp_path / f"atlas{i_atlas}.nii.gz"))
+        nb.Nifti1Image(labels, affine).to_filename(atlases[-1])
+
+    # an atlas on a different grid is resampled to the BOLD data
+    labels = rng.integers(0, 4, size=(4, 5, 4)).astype(np.int16)
+    atlases.append(str(tmp_path / "atlas_lowres.nii.gz"))
+    nb.Nifti1Image(labels, np.diag([4, 4, 4, 1])).to_filename(atlases[-1])
+
+    timeseries = [str(tmp_path / f"ts{i_atlas}.tsv") for i_atlas in range(len(atlases))]
+    fconmatrices = [str(tmp_path / f"fc{i_atlas}.tsv") for i_atlas in range(len(atlases))]
+    extract_timeseries_funct(bold_file, atlases, timeseries, fconmatrices)
+
+    for i_atlas, atlas in enumerate(atlases):
+        masker = NiftiLabelsMasker(atlas, standardize=False)
+        signals = masker.fit_transform(bold_file)
+        assert np.allclose(np.loadtxt(timeseries[i_atlas], delimiter="\t"), signals)
+        assert np.allclose(
+            np.loadtxt(fconmatrices[i_atlas], delimiter="\t"),
+            np.corrcoef(signals.T),
+        )
+
+
+def test_extract_timeseries_cifti(tmp_path, monkeypatch):
+    """Check CIFTI parcellation against the mean of each parcel's grayordinates."""
+    from xcp_d.utils.atlas import get_atlas_cifti
+    from xcp_d.utils.fcon import extract_timeseries_cifti
+
+    monkeypatch.setenv("XCPD_CACHE_DIR", str(tmp_path / "cache"))
+    rng = np.random.default_rng(0)
+
+    # The subcortical atlas has the 91k grayordinates of the BOLD data
+    atlases = [get_atlas_cifti("subcortical"), get_atlas_cifti("Schaefer117")]
+    subcortical_img = nb.load(atlases[0])
+    brain_model_axis = subcortical_img.header.get_axis(1)
+    series_axis = nb.cifti2.SeriesAxis(start=0, step=2, size=20)
+    dense_data = rng.standard_normal((20, len(brain_model_axis))).astype(np.float32)
+    bold_file = str(tmp_path / "bold.dtseries.nii")
+    nb.Cifti2Image(
+        dense_data, nb.cifti2.Cifti2Header.from_axes((series_axis, brain_model_axis))
+    ).to_filename(bold_file)
+
+    # The Schaefer atlas covers all 32k vertices of each hemisphere, including the medial wall
+    schaefer_img = nb.load(atlases[1])
+    schaefer_axis = schaefer_img.header.get_axis(1)
+    schaefer_labels = np.zeros(len(brain_model_axis))
+    for name, dense_slice, dense_models in brain_model_axis.iter_structures():
+        for atlas_name, atlas_slice, atlas_models in schaefer_axis.iter_structures():
+            if atlas_name == name:
+                labels = schaefer_img.get_fdata()[0, atlas_slice]
+                schaefer_labels[dense_slice] = labels[dense_models.vertex]
+    dense_labels = [subcortical_img.get_fdata()[0], schaefer_labels]
+
+    timeseries = [str(tmp_path / f"atlas{i}.ptseries.nii") for i in range(2)]
+    correlations = [str(tmp_path / f"atlas{i}.pconn.nii") for i in range(2)]
+    for _ in range(2):  # the second run uses the cached operators
+        extract_timeseries_cifti(bold_file, atlases, timeseries, correlations)
+        for i_atlas, labels in enumerate(dense_labels):
+            label_keys = np.unique(labels[labels > 0])
+            expected = np.column_stack(
+                [dense_data[:, labels == key].mean(axis=1) for key in label_keys]
+            )
+            ptseries_img = nb.load(timeseries[i_atlas])
+            assert np.allclose(ptseries_img.get_fdata(), expected, atol=1e-5)
+            parcels_axis = ptseries_img.header.get_axis(1)
+            assert len(parcels_axis) == label_keys.size
+            assert np.allclose(
+                nb.load(correlations[i_atlas]).get_fdata(),
+                np.corrcoef(expected.T),
+                atol=1e-5,
+            )
+
+    assert len(list((tmp_path / "cache" / "cifti_parcellation").iterdir())) == 4
+
+
+def test_apply_transforms_cache(tmp_path, monkeypatch):
+    """Check that cached warped images are reused without calling ANTs."""
+    from xcp_d.interfaces.connectivity import ApplyTransformsx
+
+    monkeypatch.setenv("XCPD_CACHE_DIR", str(tmp_path / "cache"))
+    atlas_file = str(tmp_path / "atlas.nii.gz")
+    nb.Nifti1Image(np.arange(60, dtype=np.int16).reshape((3, 4, 5)), np.eye(4)).to_filename(
+        atlas_file
+    )
+    reference_file = str(tmp_path / "reference.nii.gz")
+    nb.Nifti1Image(np.zeros((3, 4, 5, 2)), np.eye(4)).to_filename(reference_file)
+
+    def _transform(reference_image):
+        return ApplyTransformsx(
+            input_image=atlas_file,
+            reference_image=reference_image,
+            transforms=["identity"],
+            interpolation="MultiLabel",
+            input_image_type=3,
+            dimension=3,
+            cache_output=True,
+        )
+
+    # populate the cache entry, as a previous call would have done
+    interface = _transform(reference_file)
+    cache_file = tmp_path / "cache" / "warped" / f"{interface._get_cache_key()}.nii.gz"
+    cache_file.parent.mkdir(parents=True)
+    nb.Nifti1Image(np.ones((3, 4, 5), dtype=np.int16), np.eye(4)).to_filename(str(cache_file))
+
+    monkeypatch.chdir(tmp_path)
+    results = interface.run()
+    assert np.array_equal(nb.load(results.outputs.output_image).get_fdata(), np.ones((3, 4, 5)))
+
+    # the key only depends on the grid of the reference image, not on its data
+    other_reference = str(tmp_path / "other_reference.nii.gz")
+    nb.Nifti1Image(np.ones((3, 4, 5)), np.eye(4)).to_filename(other_reference)
+    assert _transform(other_reference)._get_cache_key() == interface._get_cache_key()
+    nb.Nifti1Image(np.ones((3, 4, 5)), np.diag([2, 2, 2, 1])).to_filename(other_reference)
+    assert _transform(other_reference)._get_cache_key() != interface._get_cache_key()
+
+
+def test_stack_atlases(tmp_path):
+    """Check that stacking and splitting the atlases preserves their labels and order."""
+    from xcp_d.utils.atlas import get_atlas_nifti, split_atlases, stack_atlases
+
+    atlases = [get_atlas_nifti(atlas_name) for atlas_name in get_atlas_names()]
+    stacked_files, atlas_index = stack_atlases(atlases, out_dir=str(tmp_path))
+    # the 2mm Schaefer and Tian atlases only differ by a flip, and share a stack
+    assert len(stacked_files) == 2
+    assert len(atlas_index) == len(atlases)
+
+    out_files = [str(tmp_path / f"atlas{i_atlas}.nii.gz") for i_atlas in range(len(atlases))]
+    split_atlases(stacked_files, atlas_index, out_files)
+    for atlas, out_file in zip(atlases, out_files):
+        atlas_img = nb.as_closest_canonical(nb.load(atlas))
+        out_img = nb.as_closest_canonical(nb.load(out_file))
+        assert np.allclose(out_img.affine, atlas_img.affine)
+        assert np.array_equal(out_img.get_fdata(), atlas_img.get_fdata())
+
+
+def test_compose_transforms_cache(tmp_path, monkeypatch):
+    """Check that composed transforms are shared by runs with the same reference grid."""
+    from pkg_resources import resource_filename as pkgrf
+
+    from xcp_d.interfaces.connectivity import ComposeTransforms
+
+    monkeypatch.setenv("XCPD_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("XCPD_WORK_CACHE_DIR", str(tmp_path / "work_cache"))
+    monkeypatch.chdir(tmp_path)
+    transform_file = str(tmp_path / "from-T1w_to-MNI_xfm.txt")
+    with open(transform_file, "w") as fo:
+        fo.write("#Insight Transform File V1.0\n")
+
+    reference_files = []
+    for i_run in range(2):
+        reference_files.append(str(tmp_path / f"run-{i_run}_boldref.nii.gz"))
+        reference_data = np.full((3, 4, 5), i_run, dtype=np.int16)
+        nb.Nifti1Image(reference_data, np.eye(4)).to_filename(reference_files[-1])
+
+    # populate the cache entry, as the first run would have done
+    interface = ComposeTransforms(
+        dimension=3,
+        reference_image=reference_files[0],
+        transforms=[transform_file],
+    )
+    interface.inputs.print_out_composite_warp_file = True
+    # the subject's transform is composed in the working directory's cache
+    cache_file = tmp_path / "work_cache" / "transforms" / f"{interface._get_cache_key()}.nii.gz"
+    cache_file.parent.mkdir(parents=True)
+    nb.Nifti1Image(np.zeros((3, 4, 5, 1, 3), dtype=np.float32), np.eye(4)).to_filename(
+        str(cache_file)
+    )
+
+    # the second run uses the cache entry itself, without calling ANTs
+    results = ComposeTransforms(
+        dimension=3,
+        reference_image=reference_files[1],
+        transforms=[transform_file],
+    ).run()
+    assert results.outputs.output_image == str(cache_file)
+
+    # chains of template transforms are shared across subjects
+    interface.inputs.transforms = [pkgrf("xcp_d", "data/transform/oneratiotransform.txt")]
+    assert interface._get_cache_dir() == str(tmp_path / "cache" / "transforms")
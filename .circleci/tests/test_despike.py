@@ -10,10 +10,9 @@ import os
 
 import nibabel as nb
 import numpy as np
-from nipype.interfaces.afni import Despike
 from nipype.pipeline import engine as pe
 
-from xcp_d.interfaces.regression import CiftiDespike
+from xcp_d.interfaces.regression import Despike
 from xcp_d.utils.plot import _get_tr
 from xcp_d.utils.write_save import read_ndata, write_ndata
 
@@ -58,7 +57,6 @@ def test_nifti_despike(data_dir, tmp_path_factory):
     # Let's write this temp file out for despiking
     file_data[2, :] = voxel_data
     spikedfile = os.path.join(tempdir, "spikedfile.nii.gz")
-    despiked_file = os.path.join(tempdir, "despikedfile.nii.gz")
     write_ndata(
         data_matrix=file_data,
         mask=maskfile,
@@ -68,14 +66,15 @@ def test_nifti_despike(data_dir, tmp_path_factory):
     )
 
     # Let's despike the image and write it out to a temp file
-    despike_nifti = pe.Node(Despike(outputtype="NIFTI_GZ", args="-NEW"), name="Despike")
+    despike_nifti = pe.Node(Despike(TR=0.8), name="Despike", base_dir=tempdir)
     despike_nifti.inputs.in_file = spikedfile
-    despike_nifti.inputs.out_file = despiked_file
+    despike_nifti.inputs.mask = maskfile
     res = despike_nifti.run()
 
+    despiked_file = res.outputs.des_file
     assert os.path.isfile(despiked_file)
 
-    file_data = read_ndata(res.outputs.out_file, maskfile)
+    file_data = read_ndata(despiked_file, maskfile)
     voxel_data = file_data[2, :]
 
     # What's the min and max of the despiked file?
@@ -131,7 +130,7 @@ def test_cifti_despike(data_dir, tmp_path_factory):
     # Run the node the same way it's run in XCP
     in_file = filename
     TR = _get_tr(nb.load(filename))
-    despike3d = pe.Node(CiftiDespike(TR=TR), name="cifti_despike", mem_gb=4, n_procs=2)
+    despike3d = pe.Node(Despike(TR=TR), name="cifti_despike", mem_gb=4, n_procs=2)
     despike3d.inputs.in_file = in_file
     results = despike3d.run()
 
@@ -152,3 +151,26 @@ def test_cifti_despike(data_dir, tmp_path_factory):
     despiked_intent = nb.load(despiked_file).nifti_header.get_intent()
     original_intent = nb.load(boldfile).nifti_header.get_intent()
     assert despiked_intent[0] == original_intent[0]
+
+
+def test_despike_data():
+    """Check that spikes are truncated and that blocks and threads do not change results."""
+    from xcp_d.utils.utils import despike_data
+
+    rng = np.random.default_rng(0)
+    n_timepoints = 120
+    time = np.arange(n_timepoints)
+    data = np.sin(2 * np.pi * time / 40) + 0.1 * rng.standard_normal((30, n_timepoints))
+    data[3, 50] += 5
+    data[7, 80] -= 5
+    data[10, :] = 1  # constant time series are returned unchanged
+
+    despiked = despike_data(data)
+    assert np.abs(despiked[3, 50] - 1) < np.abs(data[3, 50] - 1)
+    assert np.abs(despiked[7, 80] + 1) < np.abs(data[7, 80] + 1)
+    assert np.array_equal(despiked[10], data[10])
+
+    # most values are not spikes, and are not modified
+    assert np.mean(despiked == data) > 0.9
+
+    assert np.allclose(despike_data(data, block_size=7, n_threads=3), despiked)
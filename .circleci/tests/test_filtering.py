@@ -4,8 +4,8 @@ import os.path as op
 import numpy as np
 import pytest
 
-from xcp_d.interfaces.filtering import butter_bandpass
 from xcp_d.utils.confounds import motion_regression_filter
+from xcp_d.utils.utils import butter_bandpass
 
 
 @pytest.fixture(scope="module")
@@ -93,3 +93,160 @@ def test_bandpass_filtering(data_files):
         order=2,
     )
     assert np.allclose(butterworth_data_test, butterworth_data_true, atol=1e-4)
+
+
+def test_bandpass_filtering_blocks():
+    """Check that block-wise filtering matches filtering each row separately."""
+    from scipy.signal import butter, filtfilt
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((23, 200))
+    fs, highpass, lowpass, order = 1 / 0.8, 0.009, 0.080, 2
+
+    nyq = 0.5 * fs
+    b, a = butter(order / 2, [highpass / nyq, lowpass / nyq], btype="band")
+    padlen = 3 * (max(len(b), len(a)) - 1)
+    rowwise_data = np.vstack(
+        [filtfilt(b, a, row, padtype="odd", padlen=padlen) for row in data]
+    )
+
+    for block_size in (1, 5, 23, None):
+        blockwise_data = butter_bandpass(
+            data,
+            fs=fs,
+            highpass=highpass,
+            lowpass=lowpass,
+            order=order,
+            block_size=block_size,
+        )
+        assert blockwise_data.dtype == np.float64
+        assert np.allclose(blockwise_data, rowwise_data)
+
+    float32_data = butter_bandpass(
+        data.astype(np.float32),
+        fs=fs,
+        highpass=highpass,
+        lowpass=lowpass,
+        order=order,
+        block_size=7,
+        dtype=np.float32,
+    )
+    assert float32_data.dtype == np.float32
+    assert np.allclose(float32_data, rowwise_data, atol=1e-5)
+
+
+def test_fft_bandpass_filtering():
+    """Check that the FFT engine reproduces the Butterworth filter away from the edges."""
+    from xcp_d.utils.utils import fft_bandpass
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((10, 1000)).cumsum(axis=1)
+    fs, highpass, lowpass = 1 / 0.8, 0.009, 0.080
+
+    butterworth_data = butter_bandpass(data, fs=fs, highpass=highpass, lowpass=lowpass)
+    fft_data = fft_bandpass(data, fs=fs, highpass=highpass, lowpass=lowpass, block_size=3)
+    center = slice(200, 800)
+    assert np.corrcoef(
+        butterworth_data[:, center].ravel(),
+        fft_data[:, center].ravel(),
+    )[0, 1] > 0.999
+
+    # An ideal mask removes everything outside of the band
+    ideal_data = fft_bandpass(
+        data,
+        fs=fs,
+        highpass=highpass,
+        lowpass=lowpass,
+        response="ideal",
+    )
+    freqs = np.fft.rfftfreq(data.shape[1], d=1 / fs)
+    spectrum = np.abs(np.fft.rfft(ideal_data, axis=1))
+    outside_band = (freqs < highpass) | (freqs > lowpass)
+    assert np.allclose(spectrum[:, outside_band], 0)
+
+
+def test_filter_design_registry():
+    """Check that filter designs are built once and shared across calls."""
+    from xcp_d.utils.filter_design import get_bandpass_design, get_motion_filter_design
+
+    design = get_bandpass_design(TR=0.8, lowpass=0.08, highpass=0.009, order=2)
+    # Equivalent parameters resolve to the same cached design
+    assert get_bandpass_design(TR=0.8, lowpass=0.08, highpass=0.009, order=2.0) is design
+    assert not design.b.flags.writeable
+
+    other_design = get_bandpass_design(TR=2.0, lowpass=0.08, highpass=0.009, order=2)
+    assert other_design.param_hash != design.param_hash
+
+    # The low-pass motion filter does not depend on band_stop_max
+    lp_design = get_motion_filter_design(0.8, "lp", 6, 10, 4)
+    assert get_motion_filter_design(0.8, "lp", 6, None, 4) is lp_design
+
+    with pytest.raises(ValueError, match="Unknown motion filter type"):
+        get_motion_filter_design(0.8, "bandpass", 6, 10, 4)
+
+
+def test_bandpass_filter_data_design():
+    """Check that the logged filter design is the one applied to the data."""
+    from xcp_d.utils import filter_design
+    from xcp_d.utils.utils import bandpass_filter_data
+
+    # 1 / (1 / 0.38) != 0.38, so looking the design up again from fs would add an entry
+    TR = 0.38
+    data = np.random.default_rng(0).standard_normal((4, 200))
+    filter_design._get_bandpass_design.cache_clear()
+    filter_design._get_bandpass_response.cache_clear()
+    bandpass_filter_data(data, TR=TR, lowpass=0.08, highpass=0.009, filter_engine="filtfilt")
+    bandpass_filter_data(data, TR=TR, lowpass=0.08, highpass=0.009, filter_engine="fft")
+    assert filter_design._get_bandpass_design.cache_info().currsize == 1
+    assert filter_design._get_bandpass_response.cache_info().currsize == 1
+
+
+@pytest.mark.parametrize("filter_engine", ["filtfilt", "fft"])
+def test_get_bandpass_filter(filter_engine):
+    """Check that a filter looked up once gives the same results block by block."""
+    from xcp_d.utils.utils import bandpass_filter_data, get_bandpass_filter
+
+    data = np.random.default_rng(0).standard_normal((10, 200))
+    filter_kwargs = dict(TR=2, lowpass=0.08, highpass=0.009, filter_engine=filter_engine)
+    filter_function = get_bandpass_filter(n_timepoints=200, **filter_kwargs)
+    blockwise_data = np.vstack([filter_function(data[:4]), filter_function(data[4:])])
+    assert np.allclose(blockwise_data, bandpass_filter_data(data, **filter_kwargs))
+
+    with pytest.raises(ValueError, match="Unknown filter engine"):
+        get_bandpass_filter(n_timepoints=200, TR=2, lowpass=0.08, highpass=0.009,
+                            filter_engine="iir")
+
+
+def test_load_filtered_motion(tmp_path, monkeypatch):
+    """Check that filtered motion parameters are cached per file and filter."""
+    import pandas as pd
+
+    from xcp_d.utils.confounds import load_filtered_motion, load_motion
+
+    monkeypatch.setenv("XCPD_WORK_CACHE_DIR", str(tmp_path / "work_cache"))
+    rng = np.random.default_rng(0)
+    columns = ["rot_x", "rot_y", "rot_z", "trans_x", "trans_y", "trans_z"]
+    confounds_df = pd.DataFrame(rng.standard_normal((100, 6)), columns=columns)
+    confounds_file = str(tmp_path / "desc-confounds_timeseries.tsv")
+    confounds_df.to_csv(confounds_file, sep="\t", index=False)
+
+    filter_kwargs = dict(
+        TR=0.8,
+        motion_filter_type="notch",
+        band_stop_min=12,
+        band_stop_max=18,
+        motion_filter_order=4,
+    )
+    expected = load_motion(confounds_df.copy(), **filter_kwargs)
+    motion_df = load_filtered_motion(confounds_file, **filter_kwargs)
+    assert np.allclose(motion_df.to_numpy(), expected.to_numpy())
+    assert len(list((tmp_path / "work_cache" / "motion").iterdir())) == 1
+
+    # The second call reads the cached frame
+    cached_motion_df = load_filtered_motion(confounds_file, **filter_kwargs)
+    assert np.array_equal(cached_motion_df.to_numpy(), motion_df.to_numpy())
+    assert list(cached_motion_df.columns) == list(expected.columns)
+
+    # Different filter parameters get their own entry
+    load_filtered_motion(confounds_file, **{**filter_kwargs, "band_stop_max": 20})
+    assert len(list((tmp_path / "work_cache" / "motion").iterdir())) == 2
@@ -231,3 +231,70 @@ def test_interpolate_nifti(data_dir):
     diff1 = sum(abs(fft_interpolated - fft_original))
     diff2 = sum(abs(fft_interpolated - fft_spike))
     assert diff1 < diff2
+
+
+def test_interpolate_masked_data():
+    """Check the batched interpolation against a voxel-wise interp1d."""
+    from scipy.interpolate import interp1d
+
+    from xcp_d.utils.modified_data import interpolate_masked_data
+
+    rng = np.random.default_rng(0)
+    bold_data = rng.standard_normal((20, 60))
+    tmask = np.zeros(60)
+    tmask[[3, 4, 5, 20, 58, 59]] = 1
+
+    slice_times = np.arange(60)
+    anchors = np.append(slice_times[tmask == 0], slice_times[-1])
+    expected = bold_data.copy()
+    for voxel in range(bold_data.shape[0]):
+        interpolation_function = interp1d(anchors, bold_data[voxel, anchors])
+        expected[voxel, tmask == 1] = interpolation_function(slice_times)[tmask == 1]
+
+    interpolated_data = interpolate_masked_data(bold_data, tmask)
+    assert interpolated_data is bold_data
+    assert np.allclose(interpolated_data, expected)
+
+    # Flagged volumes at the beginning of the run take the first unflagged value
+    tmask = np.zeros(10)
+    tmask[:2] = 1
+    bold_data = np.arange(10, dtype=float)[None, :]
+    interpolated_data = interpolate_masked_data(bold_data, tmask)
+    assert np.array_equal(interpolated_data[0, :3], [2, 2, 2])
+
+    # No interpolation if more than half of the volumes are flagged
+    tmask[:6] = 1
+    bold_data = np.zeros((1, 10))
+    assert np.array_equal(interpolate_masked_data(bold_data.copy(), tmask), bold_data)
+
+
+def test_spectral_interpolation():
+    """Check that spectral interpolation recovers a censored oscillation."""
+    from xcp_d.utils.modified_data import interpolate_masked_data
+
+    TR = 0.8
+    times = TR * np.arange(400)
+    signal = np.sin(2 * np.pi * 0.05 * times) + 0.5 * np.cos(2 * np.pi * 0.02 * times + 1)
+    bold_data = np.vstack((signal, 2 * signal + 3))
+
+    rng = np.random.default_rng(0)
+    tmask = np.zeros(400)
+    tmask[rng.choice(400, 120, replace=False)] = 1
+    censored_data = bold_data.copy()
+    censored_data[:, tmask == 1] = 0
+
+    interpolated_data = interpolate_masked_data(
+        censored_data,
+        tmask,
+        TR=TR,
+        method="spectral",
+        block_size=1,
+    )
+    # Retained volumes are unchanged
+    assert np.array_equal(interpolated_data[:, tmask == 0], bold_data[:, tmask == 0])
+    # The reconstruction is linear in the data, apart from the mean
+    assert np.allclose(
+        interpolated_data[1, tmask == 1],
+        2 * interpolated_data[0, tmask == 1] + 3,
+    )
+    assert np.corrcoef(interpolated_data[0, tmask == 1], signal[tmask == 1])[0, 1] > 0.6
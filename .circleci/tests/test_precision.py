@@ -0,0 +1,112 @@
+"""Tests for processing BOLD data in single precision."""
+import nibabel as nb
+import numpy as np
+import pytest
+
+from xcp_d.utils.modified_data import interpolate_masked_data
+from xcp_d.utils.utils import (
+    bandpass_filter_data,
+    demean_detrend_data,
+    despike_data,
+    linear_regression,
+    projection_regression,
+)
+
+
+@pytest.fixture(scope="module")
+def bold_data():
+    """Simulate BOLD-like data with a mean, a trend, and confound-related signal."""
+    rng = np.random.default_rng(0)
+    n_voxels, n_volumes = 300, 120
+    time = np.arange(n_volumes)
+    confounds = rng.standard_normal((6, n_volumes))
+    data = (
+        1000
+        + 0.5 * time
+        + rng.standard_normal((n_voxels, 6)) @ confounds
+        + rng.standard_normal((n_voxels, n_volumes))
+    )
+    return data, confounds
+
+
+def test_float32_kernels(bold_data):
+    """Check that the denoising kernels keep float32 data in float32 and match float64."""
+    data, confounds = bold_data
+    data32 = data.astype(np.float32)
+
+    detrended = demean_detrend_data(data)
+    detrended32 = demean_detrend_data(data32)
+    assert detrended.dtype == np.float64
+    assert detrended32.dtype == np.float32
+    assert np.allclose(detrended32, detrended, atol=1e-3)
+
+    # the blockwise projection matches scipy's detrending
+    from scipy.signal import detrend
+
+    expected = detrend(detrend(data, type="constant"), type="linear")
+    assert np.allclose(demean_detrend_data(data, block_size=7), expected)
+
+    residuals = projection_regression(detrended, confounds)
+    residuals32 = projection_regression(detrended32, confounds)
+    assert residuals32.dtype == np.float32
+    assert np.allclose(residuals32, residuals, atol=1e-3)
+
+    sklearn_residuals32 = linear_regression(detrended32, confounds)
+    assert sklearn_residuals32.dtype == np.float32
+    assert np.allclose(sklearn_residuals32, residuals, atol=1e-3)
+
+    for filter_engine in ("filtfilt", "fft"):
+        filtered = bandpass_filter_data(
+            residuals, TR=2, lowpass=0.08, highpass=0.01, filter_engine=filter_engine
+        )
+        filtered32 = bandpass_filter_data(
+            residuals32, TR=2, lowpass=0.08, highpass=0.01, filter_engine=filter_engine
+        )
+        assert filtered32.dtype == np.float32
+        assert np.allclose(filtered32, filtered, atol=1e-3)
+
+    despiked32 = despike_data(data32)
+    assert despiked32.dtype == np.float32
+    assert np.allclose(despiked32, despike_data(data), rtol=1e-5, atol=1e-2)
+
+
+@pytest.mark.parametrize("method", ["linear", "spectral"])
+def test_float32_interpolation(bold_data, method):
+    """Check that interpolation keeps float32 data in float32 and matches float64."""
+    data, _ = bold_data
+    data = data - data.mean(axis=1, keepdims=True)
+    tmask = np.zeros(data.shape[1], dtype=int)
+    tmask[[10, 11, 12, 50, 90, 119]] = 1
+
+    interpolated = interpolate_masked_data(data.copy(), tmask, TR=2, method=method)
+    interpolated32 = interpolate_masked_data(
+        data.astype(np.float32), tmask, TR=2, method=method
+    )
+    assert interpolated32.dtype == np.float32
+    assert np.allclose(interpolated32, interpolated, atol=1e-3)
+
+
+def test_read_ndata_precision(tmp_path):
+    """Check that the requested precision controls the type of the data read."""
+    from xcp_d.utils.write_save import read_ndata, write_ndata
+
+    rng = np.random.default_rng(0)
+    mask = np.zeros((4, 5, 6), dtype=np.uint8)
+    mask[1:3, 1:4, 1:5] = 1
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nb.Nifti1Image(mask, np.eye(4)).to_filename(mask_file)
+    bold = rng.standard_normal(mask.shape + (20,)) * 100 + 1000
+    bold_file = str(tmp_path / "bold.nii.gz")
+    nb.Nifti1Image(bold, np.eye(4)).to_filename(bold_file)
+
+    data = read_ndata(bold_file, mask_file)
+    assert data.dtype == np.float64
+
+    data32 = read_ndata(bold_file, mask_file, dtype="float32")
+    assert data32.dtype == np.float32
+    assert np.allclose(data32, data, rtol=1e-6)
+
+    # single-precision matrices are written as single-precision images
+    out_file = write_ndata(data32, bold_file, str(tmp_path / "out.nii.gz"), mask=mask_file)
+    assert nb.load(out_file).get_data_dtype() == np.float32
+    assert np.array_equal(read_ndata(out_file, mask_file, dtype="float32"), data32)
@@ -0,0 +1,39 @@
+"""Tests for quality control metrics."""
+import numpy as np
+
+from xcp_d.utils.qcmetrics import compute_dvars, compute_qc_statistics
+
+
+def test_compute_qc_statistics():
+    """Check the one-pass statistics against direct computations on the full matrix."""
+    rng = np.random.default_rng(0)
+    data = 10 + 3 * rng.standard_normal((1000, 50))
+
+    stats = compute_qc_statistics(data, block_size=77)
+    expected_dvars = np.sqrt(
+        np.sum(np.hstack((np.zeros((1000, 1)), np.diff(data))) ** 2, axis=0) / 1000
+    )
+    assert np.allclose(stats.dvars, expected_dvars)
+    assert np.allclose(compute_dvars(data), expected_dvars)
+    assert np.allclose(stats.mean, data.mean(axis=0))
+    assert np.allclose(stats.std, data.std(axis=0))
+    assert stats.min == data.min()
+    assert stats.max == data.max()
+
+    # Concatenated runs get the DVARS of each run, as separately-processed runs do
+    run_dvars = []
+    for run_data in (data[:, :20], data[:, 20:]):
+        dvars = compute_dvars(run_data)
+        dvars[0] = np.mean(dvars)
+        run_dvars.append(dvars)
+
+    stats = compute_qc_statistics(data, block_size=77, run_lengths=[20, 30])
+    assert np.allclose(stats.dvars, np.concatenate(run_dvars))
+
+    # NaNs are ignored in the mean, std, and range
+    data[3, 7] = np.nan
+    stats = compute_qc_statistics(data, block_size=77)
+    assert np.allclose(stats.mean, np.nanmean(data, axis=0))
+    assert np.allclose(stats.std, np.nanstd(data, axis=0))
+    assert stats.min == np.nanmin(data)
+    assert stats.max == np.nanmax(data)
@@ -136,3 +136,91 @@ def test_cifti_reho(data_dir, tmp_path_factory):
     )
     new_reho_mean = nb.load(new_reho).agg_data().mean()
     assert new_reho_mean < original_reho_mean
+
+
+def test_faces_to_adjacency():
+    """Check that every edge of every triangle, and nothing else, is in the matrix."""
+    from xcp_d.utils.fcon import faces_to_adjacency
+
+    # a strip of three triangles, and a vertex that is not in any triangle
+    faces = np.array([[0, 1, 2], [1, 2, 3], [2, 3, 4]])
+    adjacency_matrix = faces_to_adjacency(faces, n_vertices=6)
+    expected = np.array(
+        [
+            [0, 1, 1, 0, 0, 0],
+            [1, 0, 1, 1, 0, 0],
+            [1, 1, 0, 1, 1, 0],
+            [0, 1, 1, 0, 1, 0],
+            [0, 0, 1, 1, 0, 0],
+            [0, 0, 0, 0, 0, 0],
+        ]
+    )
+    assert adjacency_matrix.format == "csr"
+    assert np.array_equal(adjacency_matrix.toarray(), expected)
+
+
+def test_compute_2d_reho():
+    """Check the vectorized Kendall's W against a vertex-wise implementation."""
+    from scipy.stats import rankdata
+
+    from xcp_d.utils.fcon import compute_2d_reho, faces_to_adjacency
+
+    rng = np.random.default_rng(0)
+    n_vertices, n_timepoints = 50, 30
+    faces = rng.integers(0, n_vertices, (120, 3))
+    adjacency_matrix = faces_to_adjacency(faces, n_vertices=n_vertices)
+    data = rng.standard_normal((n_vertices, n_timepoints))
+    data[:, 5] = data[:, 6]  # add ties
+
+    expected = np.zeros(n_vertices)
+    for i_vertex in range(n_vertices):
+        neighborhood = np.append(adjacency_matrix[[i_vertex], :].nonzero()[1], i_vertex)
+        rank_sums = np.sum([rankdata(data[j_vertex]) for j_vertex in neighborhood], axis=0)
+        KC = np.sum(rank_sums ** 2) - n_timepoints * np.mean(rank_sums) ** 2
+        expected[i_vertex] = (
+            12 * KC / (neighborhood.size ** 2 * (n_timepoints ** 3 - n_timepoints))
+        )
+
+    reho = compute_2d_reho(data, adjacency_matrix, block_size=7)
+    assert np.allclose(reho, expected)
+
+
+def test_nifti_reho_interface(tmp_path):
+    """Check the native volumetric ReHo against a voxel-wise implementation."""
+    from scipy.stats import rankdata
+
+    from xcp_d.interfaces.resting_state import NiftiReHo
+
+    rng = np.random.default_rng(0)
+    n_timepoints = 20
+    mask = rng.random((5, 6, 4)) > 0.3
+    bold_data = rng.standard_normal(mask.shape + (n_timepoints,))
+    bold_file = os.path.join(tmp_path, "bold.nii.gz")
+    mask_file = os.path.join(tmp_path, "mask.nii.gz")
+    nb.Nifti1Image(bold_data, np.eye(4)).to_filename(bold_file)
+    nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)).to_filename(mask_file)
+
+    for neighborhood, max_distance in (("faces", 1), ("edges", 2), ("vertices", 3)):
+        expected = np.zeros(mask.shape)
+        for voxel in np.argwhere(mask):
+            ranks = []
+            for offset in np.ndindex(3, 3, 3):
+                neighbor = voxel + np.array(offset) - 1
+                if np.abs(neighbor - voxel).sum() > max_distance:
+                    continue
+                if np.any(neighbor < 0) or np.any(neighbor >= mask.shape):
+                    continue
+                if mask[tuple(neighbor)]:
+                    ranks.append(rankdata(bold_data[tuple(neighbor)]))
+
+            rank_sums = np.sum(ranks, axis=0)
+            KC = np.sum(rank_sums ** 2) - n_timepoints * np.mean(rank_sums) ** 2
+            denom = len(ranks) ** 2 * (n_timepoints ** 3 - n_timepoints)
+            expected[tuple(voxel)] = 12 * KC / denom
+
+        out_dir = tmp_path / neighborhood
+        out_dir.mkdir()
+        reho = NiftiReHo(in_file=bold_file, mask_file=mask_file, neighborhood=neighborhood)
+        results = reho.run(cwd=str(out_dir))
+        reho_data = nb.load(results.outputs.out_file).get_fdata()
+        assert np.allclose(reho_data, expected)
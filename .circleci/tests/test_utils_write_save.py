@@ -92,3 +92,125 @@ def test_write_ndata(data_dir, tmp_path_factory):
     assert cifti_data_loaded.shape == (91282,)
     # It won't equal exactly 1000
     assert (cifti_data_loaded[1000] - 1000) < 1
+
+
+def test_uncompressed_nifti(tmp_path):
+    """Check that uncompressed NIfTI intermediates round-trip like gzipped ones."""
+    import nibabel as nb
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    mask = (rng.random((5, 6, 4)) > 0.3).astype(np.uint8)
+    bold_data = rng.standard_normal((5, 6, 4, 10))
+    bold_file = str(tmp_path / "bold.nii.gz")
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nb.Nifti1Image(bold_data, np.eye(4)).to_filename(bold_file)
+    nb.Nifti1Image(mask, np.eye(4)).to_filename(mask_file)
+
+    assert write_save.get_work_extension(bold_file) == ".nii.gz"
+    assert write_save.get_work_extension("bold.dtseries.nii") == ".dtseries.nii"
+    assert write_save.get_work_extension(bold_file, "nii") == ".nii"
+    assert write_save.get_work_extension("bold.dtseries.nii", "nii") == ".dtseries.nii"
+
+    data = write_save.read_ndata(bold_file, maskfile=mask_file)
+    uncompressed_file = str(tmp_path / "bold.nii")
+    write_save.write_ndata(data, template=bold_file, filename=uncompressed_file, mask=mask_file)
+    assert np.array_equal(write_save.read_ndata(uncompressed_file, maskfile=mask_file), data)
+    assert np.allclose(data, bold_data[mask.astype(bool)])
+
+
+@pytest.mark.parametrize("extension", [".nii.gz", ".nii", ".dtseries.nii"])
+def test_block_iteration(tmp_path, extension):
+    """Check that streamed blocks match whole-image reads and writes."""
+    import nibabel as nb
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    mask = (rng.random((7, 6, 5)) > 0.3).astype(np.uint8)
+    mask[3] = 0  # a slab without any in-mask voxels
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nb.Nifti1Image(mask, np.eye(4)).to_filename(mask_file)
+    if extension == ".dtseries.nii":
+        n_vertices = 23
+        brain_model_axis = nb.cifti2.BrainModelAxis.from_mask(np.ones(n_vertices), "cortex_left")
+        series_axis = nb.cifti2.SeriesAxis(start=0, step=2, size=12)
+        header = nb.cifti2.Cifti2Header.from_axes((series_axis, brain_model_axis))
+        img = nb.Cifti2Image(rng.standard_normal((12, n_vertices)).astype(np.float32), header)
+        mask_file = None
+    else:
+        img = nb.Nifti1Image(rng.standard_normal(mask.shape + (12,)), np.eye(4))
+    bold_file = str(tmp_path / f"bold{extension}")
+    img.to_filename(bold_file)
+
+    data = write_save.read_ndata(bold_file, maskfile=mask_file)
+    assert write_save.get_n_volumes(bold_file) == 12
+    blocks = list(write_save.iter_ndata_blocks(bold_file, mask_file, block_size=10))
+    assert len(blocks) > 1
+    assert all(block.shape[1] == 12 for block in blocks)
+    assert np.array_equal(np.vstack(blocks), data)
+
+    out_file = str(tmp_path / f"out{extension}")
+    with write_save.NdataWriter(bold_file, out_file, 12, mask=mask_file, TR=2) as writer:
+        for block in blocks:
+            writer.write(block * 2)
+
+    if extension == ".nii.gz":
+        # the uncompressed file is removed once it has been compressed
+        assert not os.path.exists(str(tmp_path / "out.nii"))
+    assert np.array_equal(write_save.read_ndata(out_file, maskfile=mask_file), data * 2)
+    if extension != ".dtseries.nii":
+        out_img = nb.load(out_file)
+        assert out_img.header.get_zooms()[3] == 2
+        # voxels outside the mask are zero
+        assert not np.any(out_img.get_fdata()[mask == 0])
+
+    with pytest.raises(ValueError, match="rows were written"):
+        write_save.NdataWriter(bold_file, out_file, 12, mask=mask_file).close()
+
+
+def test_matrix_cache(tmp_path, monkeypatch):
+    """Check that read_ndata serves repeated reads from the masked-matrix cache."""
+    import nibabel as nb
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    mask = (rng.random((5, 6, 4)) > 0.3).astype(np.uint8)
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nb.Nifti1Image(mask, np.eye(4)).to_filename(mask_file)
+    bold_files = []
+    for i_run in range(3):
+        bold_files.append(str(tmp_path / f"run-{i_run}_bold.nii.gz"))
+        nb.Nifti1Image(rng.standard_normal(mask.shape + (10,)), np.eye(4)).to_filename(
+            bold_files[-1]
+        )
+
+    expected = write_save.read_ndata(bold_files[0], maskfile=mask_file)
+
+    cache_dir = tmp_path / "matrix_cache"
+    monkeypatch.setenv(write_save.MATRIX_CACHE_DIR_ENV, str(cache_dir))
+    data = write_save.read_ndata(bold_files[0], maskfile=mask_file)
+    assert np.array_equal(data, expected)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # cached matrices can be modified without changing the cache
+    cached_data = write_save.read_ndata(bold_files[0], maskfile=mask_file)
+    assert np.array_equal(cached_data, expected)
+    cached_data[:] = 0
+    assert np.array_equal(write_save.read_ndata(bold_files[0], maskfile=mask_file), expected)
+
+    # other data types get their own entry
+    data32 = write_save.read_ndata(bold_files[0], maskfile=mask_file, dtype=np.float32)
+    assert data32.dtype == np.float32
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # the least recently used entries are evicted once the cache is full
+    monkeypatch.setenv(write_save.MATRIX_CACHE_SIZE_ENV, str(2.5 * expected.nbytes / 1024**3))
+    write_save.read_ndata(bold_files[0], maskfile=mask_file)
+    write_save.read_ndata(bold_files[1], maskfile=mask_file)
+    write_save.read_ndata(bold_files[2], maskfile=mask_file)
+    assert len(list(cache_dir.iterdir())) == 2
+    entries = sorted(cache_dir.iterdir(), key=lambda entry: entry.stat().st_mtime_ns)
+    assert np.array_equal(
+        np.load(entries[-1]),
+        write_save._read_ndata(bold_files[2], mask_file, np.dtype(np.float64)),
+    )
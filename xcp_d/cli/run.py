@@ -298,6 +298,29 @@ def get_parser():
         type=int,
         help="number of filter coefficients for butterworth bandpass filter",
     )
+    g_filter.add_argument(
+        "--filter-engine",
+        action="store",
+        default="filtfilt",
+        choices=["filtfilt", "fft"],
+        help=(
+            "how to apply the bandpass filter. 'filtfilt' runs the butterworth filter "
+            "forward and backward over each time series. 'fft' multiplies the Fourier "
+            "transform of all time series by a zero-phase frequency response, which is "
+            "faster for long runs and has no padding artifacts"
+        ),
+    )
+    g_filter.add_argument(
+        "--fft-response",
+        action="store",
+        default="butterworth",
+        choices=["butterworth", "ideal"],
+        help=(
+            "frequency response used by the 'fft' filter engine. 'butterworth' uses the "
+            "magnitude response of the butterworth filter, with a roll-off set by "
+            "--bpf-order. 'ideal' uses a rectangular band-pass mask"
+        ),
+    )
     g_filter.add_argument(
         "--motion-filter-type",
         action="store",
@@ -414,6 +437,18 @@ This parameter is used in conjunction with ``motion-filter-order`` and ``band-st
         type=float,
         help="framewise displacement threshold for censoring, default is 0.2mm",
     )
+    g_censor.add_argument(
+        "--interpolation",
+        action="store",
+        default="linear",
+        choices=["linear", "spectral"],
+        help=(
+            "how to interpolate censored volumes after nuisance regression. "
+            "'linear' interpolates from the nearest retained volumes. "
+            "'spectral' uses a Lomb-Scargle reconstruction of the retained volumes, "
+            "as in the DCAN Labs pipelines"
+        ),
+    )
 
     g_other = parser.add_argument_group("Other options")
     g_other.add_argument(
@@ -433,6 +468,53 @@ This parameter is used in conjunction with ``motion-filter-order`` and ``band-st
             "recommended when running concurrent processes of xcp_d."
         ),
     )
+    g_other.add_argument(
+        "--cache-dir",
+        action="store",
+        type=Path,
+        default=None,
+        help=(
+            "path where results derived from the files that ship with xcp_d or TemplateFlow "
+            "(e.g., warped atlases) are cached, to be shared across subjects and xcp_d calls. "
+            "Results derived from each run's own files are cached in the working directory. "
+            "Defaults to the XCPD_CACHE_DIR environment variable, "
+            "or ~/.cache/xcp_d if it is not set"
+        ),
+    )
+    g_other.add_argument(
+        "--work-format",
+        action="store",
+        choices=["nii.gz", "nii"],
+        default="nii.gz",
+        help=(
+            "file format of intermediate NIfTI images in the working directory. "
+            "Uncompressed (nii) images use more disk space, but are memory-mapped instead of "
+            "decompressed on every read. Derivatives are always compressed"
+        ),
+    )
+    g_other.add_argument(
+        "--matrix-cache-gb",
+        action="store",
+        type=float,
+        default=10,
+        help=(
+            "maximum size, in GB, of the cache of masked BOLD data matrices in the working "
+            "directory. Nodes that read the same file memory-map the cached matrix instead "
+            "of decoding the image again. The least recently used matrices are deleted "
+            "when the cache is full. Set to 0 to disable the cache"
+        ),
+    )
+    g_other.add_argument(
+        "--precision",
+        action="store",
+        choices=["float64", "float32"],
+        default="float64",
+        help=(
+            "floating-point precision of the BOLD data in memory. "
+            "With float32, data are read, processed, and written in single precision, "
+            "which halves the memory used by each postprocessing step"
+        ),
+    )
     g_other.add_argument(
         "--resource-monitor",
         action="store_true",
@@ -489,6 +571,16 @@ By default, this workflow is disabled.
         This file is only created if the input type is "fmriprep" or "nibabies".
 """
     )
+    g_experimental.add_argument(
+        "--stack-atlases",
+        action="store_true",
+        default=False,
+        help=(
+            "warp the NIfTI atlases to the BOLD data with one ANTs call per atlas voxel grid, "
+            "by stacking them into 4D label images, instead of one call per atlas. "
+            "Stacked atlases are warped with GenericLabel rather than MultiLabel interpolation"
+        ),
+    )
 
     return parser
 
@@ -499,10 +591,25 @@ def main():
 
     from nipype import logging as nlogging
 
+    from xcp_d.utils.cache import CACHE_DIR_ENV, WORK_CACHE_DIR_ENV
+    from xcp_d.utils.write_save import (
+        MATRIX_CACHE_DIR_ENV,
+        MATRIX_CACHE_SIZE_ENV,
+    )
+
     set_start_method("forkserver")
     warnings.showwarning = _warn_redirect
     opts = get_parser().parse_args()
 
+    if opts.cache_dir:
+        # Nipype's worker processes inherit the environment
+        os.environ[CACHE_DIR_ENV] = str(opts.cache_dir.resolve())
+
+    os.environ[WORK_CACHE_DIR_ENV] = str(opts.work_dir.resolve() / "cache")
+    if opts.matrix_cache_gb > 0:
+        os.environ[MATRIX_CACHE_DIR_ENV] = str(opts.work_dir.resolve() / "matrix_cache")
+        os.environ[MATRIX_CACHE_SIZE_ENV] = str(opts.matrix_cache_gb)
+
     exec_env = os.name
 
     sentry_sdk = None
@@ -935,6 +1042,12 @@ Running xcp_d version {__version__}:
         custom_confounds=opts.custom_confounds,
         dummytime=opts.dummytime,
         fd_thresh=opts.fd_thresh,
+        filter_engine=opts.filter_engine,
+        fft_response=opts.fft_response,
+        interpolation=opts.interpolation,
+        stack_atlases=opts.stack_atlases,
+        work_format=opts.work_format,
+        precision=opts.precision,
         process_surfaces=opts.process_surfaces,
         input_type=opts.input_type,
         name="xcpd_wf",
@@ -63,7 +63,8 @@ class _DerivativesDataSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
         traits.Either(None, traits.Bool),
         usedefault=True,
         desc="whether ``in_file`` should be compressed (True), uncompressed (False) "
-        "or left unmodified (None, default).",
+        "or left unmodified (None, default). Uncompressed NIfTI intermediates "
+        "are compressed unless this is False.",
     )
     data_dtype = Str(
         desc="NumPy datatype to coerce NIfTI data to, or `source` to"
@@ -170,10 +171,14 @@ class BaseDerivativesDataSink(SimpleInterface):
             for orig_file in in_file
         ]
 
-        compress = listify(self.inputs.compress) or [None]
+        compress = list(listify(self.inputs.compress) or [None])
         if len(compress) == 1:
             compress = compress * len(in_file)
         for i, ext in enumerate(out_entities["extension"]):
+            if compress[i] is None and ext == "nii":
+                # uncompressed NIfTIs are working-directory intermediates
+                compress[i] = True
+
             if compress[i] is not None:
                 ext = regz.sub("", ext)
                 out_entities["extension"][i] = f"{ext}.gz" if compress[i] else ext
@@ -5,6 +5,9 @@
 .. testsetup::
 # will comeback
 """
+import os
+import shutil
+
 import matplotlib.pyplot as plt
 import nibabel as nb
 import numpy as np
@@ -17,10 +20,20 @@ from nipype.interfaces.base import (
     InputMultiObject,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
 
-from xcp_d.utils.fcon import extract_timeseries_funct
+from xcp_d.utils.atlas import split_atlases, stack_atlases
+from xcp_d.utils.cache import (
+    atomic_write,
+    cache_key,
+    file_signature,
+    get_cache_dir,
+    get_work_cache_dir,
+    is_shared_file,
+)
+from xcp_d.utils.fcon import extract_timeseries_cifti, extract_timeseries_funct
 from xcp_d.utils.filemanip import fname_presuffix
 
 LOGGER = logging.getLogger('nipype.interface')
@@ -29,45 +42,219 @@ LOGGER = logging.getLogger('nipype.interface')
 
 class _NiftiConnectInputSpec(BaseInterfaceInputSpec):
     filtered_file = File(exists=True, mandatory=True, desc="filtered file")
-    atlas = File(exists=True, mandatory=True, desc="atlas file")
+    atlases = InputMultiObject(
+        File(exists=True),
+        mandatory=True,
+        desc="atlas files, in the same space as the filtered file",
+    )
+    atlas_names = InputMultiObject(
+        traits.Str,
+        mandatory=True,
+        desc="names of the atlases, used for the output filenames. Aligned with atlases.",
+    )
 
 
 class _NiftiConnectOutputSpec(TraitedSpec):
-    time_series_tsv = File(exists=True,
-                           mandatory=True,
-                           desc=" time series file")
-    fcon_matrix_tsv = File(exists=True,
-                           mandatory=True,
-                           desc=" time series file")
+    time_series_tsv = traits.List(
+        File(exists=True),
+        mandatory=True,
+        desc="time series files. Aligned with atlases.",
+    )
+    fcon_matrix_tsv = traits.List(
+        File(exists=True),
+        mandatory=True,
+        desc="correlation matrix files. Aligned with atlases.",
+    )
 
 
 class NiftiConnect(SimpleInterface):
-    """Extract timeseries and compute connectivity matrices."""
+    """Extract timeseries and compute connectivity matrices for several atlases.
+
+    The filtered file is read once for all of the atlases.
+    """
 
     input_spec = _NiftiConnectInputSpec
     output_spec = _NiftiConnectOutputSpec
 
     def _run_interface(self, runtime):
-        # Write out time series using Nilearn's NiftiLabelMasker
-        # Then write out functional correlation matrix of
-        # timeseries using numpy.
-        self._results['time_series_tsv'] = fname_presuffix(
-            self.inputs.filtered_file,
-            suffix='time_series.tsv',
-            newpath=runtime.cwd,
-            use_ext=False)
-        self._results['fcon_matrix_tsv'] = fname_presuffix(
-            self.inputs.filtered_file,
-            suffix='fcon_matrix.tsv',
-            newpath=runtime.cwd,
-            use_ext=False)
+        if len(self.inputs.atlases) != len(self.inputs.atlas_names):
+            raise ValueError(
+                f"{len(self.inputs.atlases)} atlases were provided, "
+                f"but {len(self.inputs.atlas_names)} atlas names."
+            )
+
+        # Write out the parcel time series and the functional correlation matrix
+        # of each atlas.
+        time_series_tsvs, fcon_matrix_tsvs = [], []
+        for atlas_name in self.inputs.atlas_names:
+            time_series_tsvs.append(fname_presuffix(
+                self.inputs.filtered_file,
+                suffix=f'_atlas-{atlas_name}_time_series.tsv',
+                newpath=runtime.cwd,
+                use_ext=False))
+            fcon_matrix_tsvs.append(fname_presuffix(
+                self.inputs.filtered_file,
+                suffix=f'_atlas-{atlas_name}_fcon_matrix.tsv',
+                newpath=runtime.cwd,
+                use_ext=False))
 
         self._results['time_series_tsv'], self._results['fcon_matrix_tsv'] = \
             extract_timeseries_funct(
                 in_file=self.inputs.filtered_file,
-                atlas=self.inputs.atlas,
-                timeseries=self._results['time_series_tsv'],
-                fconmatrix=self._results['fcon_matrix_tsv'])
+                atlases=self.inputs.atlases,
+                timeseries=time_series_tsvs,
+                fconmatrices=fcon_matrix_tsvs)
+        return runtime
+
+
+class _StackAtlasesInputSpec(BaseInterfaceInputSpec):
+    atlases = InputMultiObject(File(exists=True), mandatory=True, desc="NIfTI atlas files")
+
+
+class _StackAtlasesOutputSpec(TraitedSpec):
+    stacked_atlases = traits.List(
+        File(exists=True),
+        desc="4D stacked atlases, one for each distinct voxel grid",
+    )
+    atlas_index = traits.List(
+        traits.List(traits.Int),
+        desc="index of the stacked atlas and volume of each atlas. Aligned with atlases.",
+    )
+
+
+class StackAtlases(SimpleInterface):
+    """Stack atlases into 4D label images, so they can be warped with one ANTs call per grid.
+
+    Use :class:`SplitAtlases` to recover one file per atlas.
+    """
+
+    input_spec = _StackAtlasesInputSpec
+    output_spec = _StackAtlasesOutputSpec
+
+    def _run_interface(self, runtime):
+        self._results['stacked_atlases'], self._results['atlas_index'] = stack_atlases(
+            self.inputs.atlases,
+            out_dir=runtime.cwd,
+        )
+        return runtime
+
+
+class _SplitAtlasesInputSpec(BaseInterfaceInputSpec):
+    stacked_atlases = InputMultiObject(
+        File(exists=True),
+        mandatory=True,
+        desc="4D stacked atlases, e.g., after warping them",
+    )
+    atlas_index = traits.List(
+        traits.List(traits.Int),
+        mandatory=True,
+        desc="index of the stacked atlas and volume of each atlas, from StackAtlases",
+    )
+    atlases = InputMultiObject(
+        File(),
+        mandatory=True,
+        desc="original atlas files, used for the output filenames. Aligned with atlas_index.",
+    )
+
+
+class _SplitAtlasesOutputSpec(TraitedSpec):
+    atlases = traits.List(File(exists=True), desc="atlas files. Aligned with atlas_index.")
+
+
+class SplitAtlases(SimpleInterface):
+    """Split atlases stacked by :class:`StackAtlases` into one file per atlas."""
+
+    input_spec = _SplitAtlasesInputSpec
+    output_spec = _SplitAtlasesOutputSpec
+
+    def _run_interface(self, runtime):
+        out_files = [
+            fname_presuffix(
+                atlas,
+                suffix=f'_{i_atlas:02d}_trans.nii.gz',
+                newpath=runtime.cwd,
+                use_ext=False,
+            )
+            for i_atlas, atlas in enumerate(self.inputs.atlases)
+        ]
+        self._results['atlases'] = split_atlases(
+            self.inputs.stacked_atlases,
+            self.inputs.atlas_index,
+            out_files,
+        )
+        return runtime
+
+
+class _CiftiConnectInputSpec(BaseInterfaceInputSpec):
+    filtered_file = File(exists=True, mandatory=True, desc="filtered dense time series file")
+    atlases = InputMultiObject(
+        File(exists=True),
+        mandatory=True,
+        desc="dlabel atlas files, in the same space as the filtered file",
+    )
+    atlas_names = InputMultiObject(
+        traits.Str,
+        mandatory=True,
+        desc="names of the atlases, used for the output filenames. Aligned with atlases.",
+    )
+    precision = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="Floating-point precision of the BOLD data in memory",
+    )
+
+
+class _CiftiConnectOutputSpec(TraitedSpec):
+    timeseries = traits.List(
+        File(exists=True),
+        mandatory=True,
+        desc="parcellated time series (ptseries) files. Aligned with atlases.",
+    )
+    correlations = traits.List(
+        File(exists=True),
+        mandatory=True,
+        desc="parcellated connectivity (pconn) files. Aligned with atlases.",
+    )
+
+
+class CiftiConnect(SimpleInterface):
+    """Parcellate dense time series and compute connectivity matrices for several atlases.
+
+    This replaces ``wb_command -cifti-parcellate`` and ``wb_command -cifti-correlation``,
+    and reads the filtered file once for all of the atlases.
+    """
+
+    input_spec = _CiftiConnectInputSpec
+    output_spec = _CiftiConnectOutputSpec
+
+    def _run_interface(self, runtime):
+        if len(self.inputs.atlases) != len(self.inputs.atlas_names):
+            raise ValueError(
+                f"{len(self.inputs.atlases)} atlases were provided, "
+                f"but {len(self.inputs.atlas_names)} atlas names."
+            )
+
+        timeseries, correlations = [], []
+        for atlas_name in self.inputs.atlas_names:
+            timeseries.append(fname_presuffix(
+                self.inputs.filtered_file,
+                suffix=f'_atlas-{atlas_name}.ptseries.nii',
+                newpath=runtime.cwd,
+                use_ext=False))
+            correlations.append(fname_presuffix(
+                self.inputs.filtered_file,
+                suffix=f'_atlas-{atlas_name}.pconn.nii',
+                newpath=runtime.cwd,
+                use_ext=False))
+
+        self._results['timeseries'], self._results['correlations'] = extract_timeseries_cifti(
+            in_file=self.inputs.filtered_file,
+            atlases=self.inputs.atlases,
+            timeseries=timeseries,
+            correlations=correlations,
+            dtype=self.inputs.precision,
+        )
         return runtime
 
 
@@ -78,6 +265,13 @@ class _ApplyTransformsInputSpec(ApplyTransformsInputSpec):
         mandatory=True,
         desc="transform files",
     )
+    cache_output = traits.Bool(
+        False,
+        usedefault=True,
+        desc="Reuse the output of identical calls from the cache directory, and store new "
+             "outputs there. Outputs derived from template files alone are shared across "
+             "subjects and xcp_d calls, and the others are kept in the working directory.",
+    )
 
 
 class ApplyTransformsx(ApplyTransforms):
@@ -85,19 +279,148 @@ class ApplyTransformsx(ApplyTransforms):
 
     This is a modification of the ApplyTransforms interface,
     with an updated set of inputs and a different default output image name.
+
+    If ``cache_output`` is True, warped images are stored in the ``warped`` subdirectory of
+    the cache directory (see :func:`~xcp_d.utils.cache.get_cache_dir`) if the input image and
+    transforms ship with xcp_d or TemplateFlow, and of the working directory's cache
+    (see :func:`~xcp_d.utils.cache.get_work_cache_dir`) otherwise.
+    Entries are keyed on the signatures of the input image and transforms,
+    the transform and interpolation settings, and the grid (shape and affine)
+    of the reference image, so later calls with the same inputs skip ANTs entirely.
     """
 
     input_spec = _ApplyTransformsInputSpec
+    _out_suffix = '_trans.nii.gz'
+    _cache_subdir = "warped"
 
     def _run_interface(self, runtime):
         # Run normally
         self.inputs.output_image = fname_presuffix(self.inputs.input_image,
-                                                   suffix='_trans.nii.gz',
+                                                   suffix=self._out_suffix,
                                                    newpath=runtime.cwd,
                                                    use_ext=False)
+        if not self.inputs.cache_output:
+            return super(ApplyTransformsx, self)._run_interface(runtime)
+
+        cache_file = self._get_cache_file()
+        if os.path.isfile(cache_file):
+            LOGGER.info(f"Using cached warped image: {cache_file}")
+            self._use_cache_entry(cache_file)
+            runtime.returncode = 0
+            return runtime
+
         runtime = super(ApplyTransformsx, self)._run_interface(runtime)
+        atomic_write(
+            cache_file,
+            lambda filename: shutil.copyfile(self.inputs.output_image, filename),
+        )
         return runtime
 
+    def _use_cache_entry(self, cache_file):
+        """Make a cached image the output of the interface."""
+        shutil.copyfile(cache_file, self.inputs.output_image)
+
+    def _get_cache_file(self):
+        """Get the path of the cache entry for the current inputs."""
+        return os.path.join(
+            self._get_cache_dir(),
+            f"{self._get_cache_key()}.nii.gz",
+        )
+
+    def _get_cache_dir(self):
+        """Share outputs across subjects only if they are derived from shared files alone."""
+        files = [transform for transform in self.inputs.transforms if transform != "identity"]
+        if not self.inputs.print_out_composite_warp_file:
+            files.append(self.inputs.input_image)
+
+        if all(is_shared_file(filename) for filename in files):
+            return get_cache_dir(self._cache_subdir)
+
+        return get_work_cache_dir(self._cache_subdir)
+
+    def _get_cache_key(self):
+        """Hash the inputs that determine the warped image."""
+        reference_img = nb.load(self.inputs.reference_image)
+        reference_grid = [
+            list(reference_img.shape[:3]),
+            np.round(reference_img.affine, 6).tolist(),
+        ]
+        transforms = [
+            transform if transform == "identity" else file_signature(transform)
+            for transform in self.inputs.transforms
+        ]
+        settings = {
+            name: getattr(self.inputs, name)
+            for name in (
+                "dimension",
+                "input_image_type",
+                "interpolation",
+                "interpolation_parameters",
+                "invert_transform_flags",
+                "default_value",
+                "float",
+                "print_out_composite_warp_file",
+            )
+            if isdefined(getattr(self.inputs, name))
+        }
+        # The composite warp only depends on the transforms and the reference grid
+        input_image = None
+        if not self.inputs.print_out_composite_warp_file:
+            input_image = file_signature(self.inputs.input_image)
+
+        return cache_key(input_image, transforms, settings, reference_grid)
+
+
+class _ComposeTransformsInputSpec(_ApplyTransformsInputSpec):
+    input_image = File(
+        argstr="--input %s",
+        exists=True,
+        desc="image used to define the output. Defaults to the reference image.",
+    )
+    cache_output = traits.Bool(
+        True,
+        usedefault=True,
+        desc="Reuse the composite transform of identical calls from the cache directory, "
+             "and store new ones there. Transforms composed from template files alone are "
+             "shared across subjects and xcp_d calls, and the others are kept in the working "
+             "directory.",
+    )
+
+
+class ComposeTransforms(ApplyTransformsx):
+    """Compose a chain of transforms into a single displacement field on the reference grid.
+
+    ANTs parses composite (h5) transforms every time it applies them.
+    Warping images with the composed field instead skips that step,
+    and gives the same result for images that are warped to the same reference grid.
+
+    Composite transforms are cached in the ``transforms`` subdirectory of a cache directory,
+    keyed on the transforms and the reference grid, so each chain is only composed once
+    for all of the runs of a subject.
+    Chains of template-to-template transforms are cached in the shared cache directory,
+    and chains that include a subject's transforms in the working directory's cache.
+    The cache entry itself is returned as the output,
+    so warps that use it can be cached across runs as well (see :class:`ApplyTransformsx`).
+    """
+
+    input_spec = _ComposeTransformsInputSpec
+    _out_suffix = '_xfm.nii.gz'
+    _cache_subdir = "transforms"
+
+    def _run_interface(self, runtime):
+        if not isdefined(self.inputs.input_image):
+            self.inputs.input_image = self.inputs.reference_image
+
+        self.inputs.print_out_composite_warp_file = True
+        runtime = super(ComposeTransforms, self)._run_interface(runtime)
+        if self.inputs.cache_output:
+            self._use_cache_entry(self._get_cache_file())
+
+        return runtime
+
+    def _use_cache_entry(self, cache_file):
+        self.inputs.output_image = cache_file
+
 
 class _ConnectPlotInputSpec(BaseInterfaceInputSpec):
     in_file = File(exists=True, mandatory=True, desc="bold file")
@@ -15,8 +15,13 @@ from nipype.interfaces.base import (
 )
 
 from xcp_d.utils.filemanip import fname_presuffix
-from xcp_d.utils.utils import butter_bandpass
-from xcp_d.utils.write_save import read_ndata, write_ndata
+from xcp_d.utils.utils import get_bandpass_filter
+from xcp_d.utils.write_save import (
+    NdataWriter,
+    get_n_volumes,
+    get_work_extension,
+    iter_ndata_blocks,
+)
 
 LOGGER = logging.getLogger('nipype.interface')
 
@@ -44,6 +49,23 @@ class _FilteringDataInputSpec(BaseInterfaceInputSpec):
     bandpass_filter = traits.Bool(exists=False,
                                   mandatory=True,
                                   desc="To apply bandpass or not")
+    filter_engine = traits.Enum("filtfilt",
+                                "fft",
+                                usedefault=True,
+                                desc="Apply the Butterworth filter with filtfilt, "
+                                     "or a frequency response in the Fourier domain")
+    fft_response = traits.Enum("butterworth",
+                               "ideal",
+                               usedefault=True,
+                               desc="Frequency response for the fft filter engine")
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
+    precision = traits.Enum("float64",
+                            "float32",
+                            usedefault=True,
+                            desc="Floating-point precision of the BOLD data in memory")
 
 
 class _FilteringDataOutputSpec(TraitedSpec):
@@ -53,6 +75,11 @@ class _FilteringDataOutputSpec(TraitedSpec):
 class FilteringData(SimpleInterface):
     """Filter the data with scipy.signal.
 
+    The data are streamed through the filter one block of voxels/vertices at a time.
+    Memory use is only bounded by the block size for CIFTI files and uncompressed
+    (``--work-format nii``) NIfTI files. Gzipped NIfTI files are still read whole
+    (see :func:`~xcp_d.utils.write_save.iter_ndata_blocks`).
+
     .. testsetup::
     from tempfile import TemporaryDirectory
     tmpdir = TemporaryDirectory()
@@ -73,35 +100,45 @@ class FilteringData(SimpleInterface):
 
     def _run_interface(self, runtime):
 
-        # get the nifti/cifti into  matrix
-        data_matrix = read_ndata(datafile=self.inputs.in_file,
-                                 maskfile=self.inputs.mask)
-        # filter the data
-        if self.inputs.bandpass_filter:
-            filt_data = butter_bandpass(data=data_matrix,
-                                        fs=1 / self.inputs.TR,
-                                        lowpass=self.inputs.lowpass,
-                                        highpass=self.inputs.highpass,
-                                        order=self.inputs.filter_order)
-        else:
-            filt_data = data_matrix  # no filtering!
-
         # writeout the data
-        if self.inputs.in_file.endswith('.dtseries.nii'):
-            suffix = '_filtered.dtseries.nii'
-        elif self.inputs.in_file.endswith('.nii.gz'):
-            suffix = '_filtered.nii.gz'
-
-        # write the output out
+        extension = get_work_extension(self.inputs.in_file, self.inputs.work_format)
+        suffix = f'_filtered{extension}'
         self._results['filtered_file'] = fname_presuffix(
             self.inputs.in_file,
             suffix=suffix,
             newpath=runtime.cwd,
             use_ext=False,
         )
-        self._results['filtered_file'] = write_ndata(
-            data_matrix=filt_data,
+
+        # The filter is applied to each voxel/vertex separately,
+        # so the data are streamed through it one block at a time.
+        n_volumes = get_n_volumes(self.inputs.in_file)
+        writer = NdataWriter(
             template=self.inputs.in_file,
             filename=self._results['filtered_file'],
-            mask=self.inputs.mask)
+            n_volumes=n_volumes,
+            mask=self.inputs.mask,
+            TR=self.inputs.TR,
+            dtype=self.inputs.precision,
+        )
+        # the filter design is looked up (and logged) once, not once per block
+        if self.inputs.bandpass_filter:
+            filter_function = get_bandpass_filter(n_timepoints=n_volumes,
+                                                  TR=self.inputs.TR,
+                                                  lowpass=self.inputs.lowpass,
+                                                  highpass=self.inputs.highpass,
+                                                  order=self.inputs.filter_order,
+                                                  filter_engine=self.inputs.filter_engine,
+                                                  fft_response=self.inputs.fft_response)
+
+        with writer:
+            for data_block in iter_ndata_blocks(
+                self.inputs.in_file,
+                self.inputs.mask,
+                dtype=self.inputs.precision,
+            ):
+                if self.inputs.bandpass_filter:
+                    data_block = filter_function(data_block)
+                writer.write(data_block)
+
         return runtime
@@ -12,10 +12,10 @@ from nipype.interfaces.base import (
     traits,
 )
 
-from xcp_d.utils.confounds import load_motion
+from xcp_d.utils.confounds import load_confounds_table, load_filtered_motion
 from xcp_d.utils.filemanip import fname_presuffix
 from xcp_d.utils.modified_data import compute_fd, generate_mask, interpolate_masked_data
-from xcp_d.utils.write_save import read_ndata, write_ndata
+from xcp_d.utils.write_save import get_work_extension, read_ndata, write_ndata
 
 
 class _RemoveTRInputSpec(BaseInterfaceInputSpec):
@@ -34,6 +34,10 @@ class _RemoveTRInputSpec(BaseInterfaceInputSpec):
                                      desc="Name of custom confounds file, or True",
                                      exists=False,
                                      mandatory=False)
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
 
 
 class _RemoveTROutputSpec(TraitedSpec):
@@ -82,11 +86,12 @@ class RemoveTR(SimpleInterface):
             return runtime
 
         # get the file names to output to
+        extension = get_work_extension(self.inputs.bold_file, self.inputs.work_format)
         dropped_bold_file = fname_presuffix(
             self.inputs.bold_file,
             newpath=runtime.cwd,
-            suffix="_dropped",
-            use_ext=True)
+            suffix=f"_dropped{extension}",
+            use_ext=False)
         dropped_confounds_file = fname_presuffix(
             self.inputs.fmriprep_confounds_file,
             newpath=runtime.cwd,
@@ -123,7 +128,7 @@ class RemoveTR(SimpleInterface):
         dropped_image.to_filename(dropped_bold_file)
 
         # Drop the first N rows from the pandas dataframe
-        confounds_df = pd.read_csv(self.inputs.fmriprep_confounds_file, sep="\t")
+        confounds_df = load_confounds_table(self.inputs.fmriprep_confounds_file)
         dropped_confounds_df = confounds_df.drop(np.arange(volumes_to_drop))
 
         # Drop the first N rows from the custom confounds file, if provided:
@@ -208,6 +213,12 @@ class _CensorScrubInputSpec(BaseInterfaceInputSpec):
         mandatory=True,
         desc="Upper frequency for the band-stop motion filter, in breaths-per-minute (bpm).",
     )
+    work_format = traits.Enum(
+        "nii.gz",
+        "nii",
+        usedefault=True,
+        desc="Format of the NIfTI intermediates written by the interface",
+    )
 
 
 class _CensorScrubOutputSpec(TraitedSpec):
@@ -255,11 +266,11 @@ class CensorScrub(SimpleInterface):
     def _run_interface(self, runtime):
 
         # Read in fmriprep confounds tsv to calculate FD
-        fmriprep_confounds_tsv_uncensored = pd.read_table(
+        fmriprep_confounds_tsv_uncensored = load_confounds_table(
             self.inputs.fmriprep_confounds_file,
         )
-        motion_df = load_motion(
-            fmriprep_confounds_tsv_uncensored.copy(),
+        motion_df = load_filtered_motion(
+            self.inputs.fmriprep_confounds_file,
             TR=self.inputs.TR,
             motion_filter_type=self.inputs.motion_filter_type,
             motion_filter_order=self.inputs.motion_filter_order,
@@ -335,11 +346,12 @@ class CensorScrub(SimpleInterface):
             )
 
         # get the output
+        extension = get_work_extension(self.inputs.in_file, self.inputs.work_format)
         self._results["bold_censored"] = fname_presuffix(
             self.inputs.in_file,
-            suffix="_censored",
+            suffix=f"_censored{extension}",
             newpath=runtime.cwd,
-            use_ext=True,
+            use_ext=False,
         )
         self._results["fmriprep_confounds_censored"] = fname_presuffix(
             self.inputs.in_file,
@@ -412,6 +424,18 @@ class _InterpolateInputSpec(BaseInterfaceInputSpec):
     TR = traits.Float(exists=True,
                       mandatory=True,
                       desc="repetition time in TR")
+    interpolation = traits.Enum("linear",
+                                "spectral",
+                                usedefault=True,
+                                desc="Linear or Lomb-Scargle (spectral) interpolation")
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
+    precision = traits.Enum("float64",
+                            "float32",
+                            usedefault=True,
+                            desc="Floating-point precision of the BOLD data in memory")
 
 
 class _InterpolateOutputSpec(TraitedSpec):
@@ -424,8 +448,8 @@ class Interpolate(SimpleInterface):
     """Interpolates scrubbed/regressed BOLD data based on temporal mask.
 
     Interpolation takes in the scrubbed/regressed bold file and temporal mask,
-    subs in the scrubbed values with 0, and then uses scipy's
-    interpolate functionality to interpolate values into these 0s.
+    subs in the scrubbed values with 0, and then interpolates values into these 0s,
+    either linearly or with a Lomb-Scargle reconstruction.
     It outputs the interpolated file.
     """
 
@@ -436,7 +460,8 @@ class Interpolate(SimpleInterface):
         # Read in regressed bold data and temporal mask
         # from censorscrub
         bold_data = read_ndata(datafile=self.inputs.in_file,
-                               maskfile=self.inputs.mask_file)
+                               maskfile=self.inputs.mask_file,
+                               dtype=self.inputs.precision)
 
         tmask_df = pd.read_table(self.inputs.tmask)
         tmask_arr = tmask_df["framewise_displacement"].values
@@ -444,23 +469,28 @@ class Interpolate(SimpleInterface):
         # check if any volumes were censored - if they were,
         # put 0s in their place.
         if bold_data.shape[1] != len(tmask_arr):
-            data_with_zeros = np.zeros([bold_data.shape[0], len(tmask_arr)])
+            data_with_zeros = np.zeros(
+                [bold_data.shape[0], len(tmask_arr)],
+                dtype=bold_data.dtype,
+            )
             data_with_zeros[:, tmask_arr == 0] = bold_data
         else:
             data_with_zeros = bold_data
 
-        # interpolate the data using scipy's interpolation functionality
+        # interpolate over the flagged volumes
         interpolated_data = interpolate_masked_data(
             bold_data=data_with_zeros,
             tmask=tmask_arr,
             TR=self.inputs.TR,
+            method=self.inputs.interpolation,
         )
 
         # save out results
         self._results['bold_interpolated'] = fname_presuffix(
             self.inputs.in_file,
+            suffix=get_work_extension(self.inputs.in_file, self.inputs.work_format),
             newpath=os.getcwd(),
-            use_ext=True,
+            use_ext=False,
         )
 
         write_ndata(
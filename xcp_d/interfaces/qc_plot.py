@@ -16,12 +16,17 @@ from nipype.interfaces.base import (
     traits,
 )
 
-from xcp_d.utils.concantenation import compute_dvars
-from xcp_d.utils.confounds import load_confound, load_motion
+from xcp_d.utils.confounds import (
+    MOTION_COLUMNS,
+    get_confounds_tsv,
+    load_confounds_table,
+    load_filtered_motion,
+    load_motion,
+)
 from xcp_d.utils.filemanip import fname_presuffix
 from xcp_d.utils.modified_data import compute_fd
 from xcp_d.utils.plot import FMRIPlot
-from xcp_d.utils.qcmetrics import compute_registration_qc
+from xcp_d.utils.qcmetrics import compute_dvars, compute_registration_qc
 from xcp_d.utils.write_save import read_ndata, write_ndata
 
 LOGGER = logging.getLogger("nipype.interface")
@@ -92,12 +97,10 @@ class CensoringPlot(SimpleInterface):
     def _run_interface(self, runtime):
         palette = sns.color_palette("colorblind", 4)
 
-        # Load confound matrix and load motion with motion filtering
-        confound_matrix = load_confound(datafile=self.inputs.bold_file)[0]
-        preproc_motion_df = load_motion(
-            confound_matrix.copy(),
-            TR=self.inputs.TR,
-            motion_filter_type=None,
+        # Load the unfiltered motion parameters
+        preproc_motion_df = load_confounds_table(
+            get_confounds_tsv(self.inputs.bold_file),
+            columns=MOTION_COLUMNS,
         )
         preproc_fd_timeseries = compute_fd(
             confound=preproc_motion_df,
@@ -130,8 +133,8 @@ class CensoringPlot(SimpleInterface):
 
         # Compute filtered framewise displacement to plot censoring
         if self.inputs.motion_filter_type:
-            filtered_motion_df = load_motion(
-                confound_matrix.copy(),
+            filtered_motion_df = load_filtered_motion(
+                get_confounds_tsv(self.inputs.bold_file),
                 TR=self.inputs.TR,
                 motion_filter_type=self.inputs.motion_filter_type,
                 motion_filter_order=self.inputs.motion_filter_order,
@@ -220,6 +223,12 @@ class _QCPlotInputSpec(BaseInterfaceInputSpec):
     bold2temp_mask = File(exists=False, mandatory=False, desc="Bold mask in T1W")
     template_mask = File(exists=False, mandatory=False, desc="Template mask")
     t1w_mask = File(exists=False, mandatory=False, desc="Mask in T1W")
+    precision = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="Floating-point precision of the BOLD data in memory",
+    )
 
 
 class _QCPlotOutputSpec(TraitedSpec):
@@ -255,9 +264,12 @@ class QCPlot(SimpleInterface):
 
     def _run_interface(self, runtime):
         # Load confound matrix and load motion with motion filtering
-        confound_matrix = load_confound(datafile=self.inputs.bold_file)[0]
+        confound_matrix = load_confounds_table(
+            get_confounds_tsv(self.inputs.bold_file),
+            columns=MOTION_COLUMNS + ["rmsd"],
+        )
         preproc_motion_df = load_motion(
-            confound_matrix.copy(),
+            confound_matrix,
             TR=self.inputs.TR,
             motion_filter_type=None,
         )
@@ -288,19 +300,19 @@ class QCPlot(SimpleInterface):
         else:
             num_censored_volumes = 0
 
-        # Compute the DVARS for both bold files provided
-        dvars_before_processing = compute_dvars(
-            read_ndata(
-                datafile=self.inputs.bold_file,
-                maskfile=self.inputs.mask_file,
-            )[:, initial_volumes_to_drop:],
-        )
-        dvars_after_processing = compute_dvars(
-            read_ndata(
-                datafile=self.inputs.cleaned_file,
-                maskfile=self.inputs.mask_file,
-            ),
+        # Read both bold files once, and compute their DVARS
+        raw_data_removed_TR = read_ndata(
+            datafile=self.inputs.bold_file,
+            maskfile=self.inputs.mask_file,
+            dtype=self.inputs.precision,
+        )[:, initial_volumes_to_drop:]
+        cleaned_data = read_ndata(
+            datafile=self.inputs.cleaned_file,
+            maskfile=self.inputs.mask_file,
+            dtype=self.inputs.precision,
         )
+        dvars_before_processing = compute_dvars(raw_data_removed_TR)
+        dvars_after_processing = compute_dvars(cleaned_data)
 
         # get QC plot names
         self._results["raw_qcplot"] = fname_presuffix(
@@ -315,11 +327,6 @@ class QCPlot(SimpleInterface):
             newpath=runtime.cwd,
             use_ext=False,
         )
-        raw_data_removed_TR = read_ndata(
-            datafile=self.inputs.bold_file,
-            maskfile=self.inputs.mask_file,
-        )[:, initial_volumes_to_drop:]
-
         # Get file names to write out & write data out
         dropped_bold_file = fname_presuffix(
             self.inputs.bold_file,
@@ -367,11 +374,7 @@ class QCPlot(SimpleInterface):
             dvars_after_processing = dvars_after_processing[tmask_arr == 0]
 
             # Apply temporal mask to data
-            raw_data_removed_TR = read_ndata(
-                datafile=self.inputs.cleaned_file,
-                maskfile=self.inputs.mask_file,
-            )
-            raw_data_censored = raw_data_removed_TR[:, tmask_arr == 0]
+            raw_data_censored = cleaned_data[:, tmask_arr == 0]
 
             # Get temporary filename and write data out
             dropped_clean_file = fname_presuffix(
@@ -3,6 +3,7 @@
 """Regression interfaces."""
 from os.path import exists
 
+import numpy as np
 import pandas as pd
 from nipype import logging
 from nipype.interfaces.base import (
@@ -15,8 +16,21 @@ from nipype.interfaces.base import (
 
 from xcp_d.utils.confounds import load_confound_matrix
 from xcp_d.utils.filemanip import fname_presuffix
-from xcp_d.utils.utils import demean_detrend_data, linear_regression
-from xcp_d.utils.write_save import despikedatacifti, read_ndata, write_ndata
+from xcp_d.utils.modified_data import interpolate_masked_data
+from xcp_d.utils.utils import (
+    bandpass_filter_data,
+    demean_detrend_data,
+    despike_data,
+    projection_regression,
+)
+from xcp_d.utils.write_save import (
+    NdataWriter,
+    get_n_volumes,
+    get_work_extension,
+    iter_ndata_blocks,
+    read_ndata,
+    write_ndata,
+)
 
 LOGGER = logging.getLogger('nipype.interface')
 
@@ -41,6 +55,14 @@ class _RegressInputSpec(BaseInterfaceInputSpec):
                                      desc="Name of custom confounds file, or True",
                                      exists=False,
                                      mandatory=False)
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
+    precision = traits.Enum("float64",
+                            "float32",
+                            usedefault=True,
+                            desc="Floating-point precision of the BOLD data in memory")
 
 
 class _RegressOutputSpec(TraitedSpec):
@@ -59,8 +81,8 @@ class Regress(SimpleInterface):
 
     Then reads in the bold file, does demeaning and a linear detrend.
 
-    Finally, uses sklearns's Linear Regression to regress out the confounds from
-    the bold files and returns the residual image, as well as the confounds for testing.
+    Finally, projects the confounds out of the bold files with a least-squares
+    regression and returns the residual image, as well as the confounds for testing.
     """
 
     input_spec = _RegressInputSpec
@@ -98,24 +120,21 @@ class Regress(SimpleInterface):
         confound = confound.to_numpy().T  # Transpose confounds matrix to line up with bold matrix
         # Get the nifti/cifti matrix
         bold_matrix = read_ndata(datafile=self.inputs.in_file,
-                                 maskfile=self.inputs.mask)
+                                 maskfile=self.inputs.mask,
+                                 dtype=self.inputs.precision)
 
         # Demean and detrend the data
 
         demeaned_detrended_data = demean_detrend_data(data=bold_matrix)
 
-        # Regress out the confounds via linear regression from sklearn
-        if demeaned_detrended_data.shape[1] < confound.shape[0]:
-            print("Warning: Regression might not be effective due to rank deficiency, i.e:"
-                  "the number of volumes in the bold file is much smaller than the number of"
-                  " egressors.")
-        residualized_data = linear_regression(data=demeaned_detrended_data, confound=confound)
+        # Regress out the confounds via projection.
+        # Rank deficiency and the condition number of the design are logged.
+        residualized_data = projection_regression(data=demeaned_detrended_data,
+                                                  confound=confound)
 
         # Write out the data
-        if self.inputs.in_file.endswith('.dtseries.nii'):  # If cifti
-            suffix = '_residualized.dtseries.nii'
-        elif self.inputs.in_file.endswith('.nii.gz'):  # If nifti
-            suffix = '_residualized.nii.gz'
+        extension = get_work_extension(self.inputs.in_file, self.inputs.work_format)
+        suffix = f'_residualized{extension}'
 
         # write the output out
         self._results['res_file'] = fname_presuffix(
@@ -132,31 +151,266 @@ class Regress(SimpleInterface):
         return runtime
 
 
-class _CiftiDespikeInputSpec(BaseInterfaceInputSpec):
-    in_file = File(exists=True, mandatory=True, desc=" cifti  file ")
-    TR = traits.Float(exists=True, mandatory=True, desc="repetition time")
+class _DenoiseInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True,
+                   mandatory=True,
+                   desc="The censored bold file to be denoised")
+    bold_file = File(exists=True,
+                     mandatory=True,
+                     desc="The uncensored bold file, used as a template for the denoised file")
+    confounds = File(
+        exists=True,
+        mandatory=True,
+        desc="The fMRIPrep confounds tsv after censoring")
+    params = traits.Str(exists=True, mandatory=True, desc="Parameter set to use.")
+    TR = traits.Float(exists=True, mandatory=True, desc="Repetition time")
+    tmask = File(exists=True, mandatory=True, desc="temporal mask")
+    mask = File(exists=False, mandatory=False, desc="Brain mask for nifti files")
+    original_file = traits.Str(exists=True, mandatory=False,
+                               desc="Name of original bold file- helps load in the confounds"
+                               "file down the line using the original path name")
+    custom_confounds = traits.Either(traits.Undefined,
+                                     File,
+                                     desc="Name of custom confounds file, or True",
+                                     exists=False,
+                                     mandatory=False)
+    lowpass = traits.Float(exists=True,
+                           mandatory=True,
+                           default_value=0.10,
+                           desc="Lowpass filter in Hz")
+    highpass = traits.Float(exists=True,
+                            mandatory=True,
+                            default_value=0.01,
+                            desc="Highpass filter in Hz")
+    filter_order = traits.Int(exists=True,
+                              mandatory=True,
+                              default_value=2,
+                              desc="Filter order")
+    bandpass_filter = traits.Bool(exists=False,
+                                  mandatory=True,
+                                  desc="To apply bandpass or not")
+    filter_engine = traits.Enum("filtfilt",
+                                "fft",
+                                usedefault=True,
+                                desc="Apply the Butterworth filter with filtfilt, "
+                                     "or a frequency response in the Fourier domain")
+    fft_response = traits.Enum("butterworth",
+                               "ideal",
+                               usedefault=True,
+                               desc="Frequency response for the fft filter engine")
+    interpolation = traits.Enum("linear",
+                                "spectral",
+                                usedefault=True,
+                                desc="Linear or Lomb-Scargle (spectral) interpolation")
+    debug_intermediates = traits.Bool(False,
+                                      usedefault=True,
+                                      desc="Also write out the residuals and the "
+                                           "interpolated data, before bandpass filtering")
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
+    precision = traits.Enum("float64",
+                            "float32",
+                            usedefault=True,
+                            desc="Floating-point precision of the BOLD data in memory")
 
 
-class _CiftiDespikeOutputSpec(TraitedSpec):
-    des_file = File(exists=True, mandatory=True, desc=" despike cifti")
+class _DenoiseOutputSpec(TraitedSpec):
+    res_file = File(exists=True,
+                    mandatory=False,
+                    desc="Residual file after regression, only written if debug_intermediates")
+    confound_matrix = File(exists=True,
+                           mandatory=True,
+                           desc="Confounds matrix returned for testing purposes only")
+    interpolated_file = File(exists=True,
+                             mandatory=False,
+                             desc="Interpolated file, only written if debug_intermediates")
+    filtered_file = File(exists=True, mandatory=True, desc="Denoised file")
+
 
+class Denoise(SimpleInterface):
+    """Denoise censored BOLD data in memory.
 
-class CiftiDespike(SimpleInterface):
-    """Despike a CIFTI file."""
+    This runs the steps of :class:`Regress`,
+    :class:`~xcp_d.interfaces.prepostcleaning.Interpolate`,
+    and :class:`~xcp_d.interfaces.filtering.FilteringData` on a single data matrix,
+    so the BOLD file is only read once.
+    The residuals from the regression and the interpolated data are only written out
+    if ``debug_intermediates`` is True.
+    """
 
-    input_spec = _CiftiDespikeInputSpec
-    output_spec = _CiftiDespikeOutputSpec
+    input_spec = _DenoiseInputSpec
+    output_spec = _DenoiseOutputSpec
 
     def _run_interface(self, runtime):
 
-        # write the output out
+        # Get the confound matrix
+        # Do we have custom confounds?
+        if self.inputs.custom_confounds and exists(self.inputs.custom_confounds):
+            confound = load_confound_matrix(
+                original_file=self.inputs.original_file,
+                custom_confounds=self.inputs.custom_confounds,
+                confound_tsv=self.inputs.confounds,
+                params=self.inputs.params,
+            )
+        else:  # No custom confounds
+            confound = load_confound_matrix(
+                original_file=self.inputs.original_file,
+                confound_tsv=self.inputs.confounds,
+                params=self.inputs.params,
+            )
+
+        # for testing, let's write out the confounds file:
+        self._results['confound_matrix'] = fname_presuffix(
+            self.inputs.confounds,
+            suffix='_matrix.tsv',
+            newpath=runtime.cwd,
+            use_ext=False,
+        )
+        confound = pd.DataFrame(confound)
+        confound.to_csv(self._results['confound_matrix'], sep="\t", header=True, index=False)
+
+        confound = confound.to_numpy().T  # Transpose confounds matrix to line up with bold matrix
+        # Get the nifti/cifti matrix
+        bold_matrix = read_ndata(datafile=self.inputs.in_file,
+                                 maskfile=self.inputs.mask,
+                                 dtype=self.inputs.precision)
+
+        # Demean, detrend, and regress out the confounds
+        demeaned_detrended_data = demean_detrend_data(data=bold_matrix)
+        del bold_matrix
+        residualized_data = projection_regression(data=demeaned_detrended_data,
+                                                  confound=confound)
+        del demeaned_detrended_data
+
+        extension = get_work_extension(self.inputs.in_file, self.inputs.work_format)
+
+        if self.inputs.debug_intermediates:
+            self._results['res_file'] = write_ndata(
+                data_matrix=residualized_data,
+                template=self.inputs.in_file,
+                filename=fname_presuffix(
+                    self.inputs.in_file,
+                    suffix=f'_residualized{extension}',
+                    newpath=runtime.cwd,
+                    use_ext=False,
+                ),
+                mask=self.inputs.mask)
+
+        # Put 0s in place of the censored volumes, then interpolate over them
+        tmask_arr = pd.read_table(self.inputs.tmask)["framewise_displacement"].values
+        if residualized_data.shape[1] != len(tmask_arr):
+            data_with_zeros = np.zeros(
+                [residualized_data.shape[0], len(tmask_arr)],
+                dtype=residualized_data.dtype,
+            )
+            data_with_zeros[:, tmask_arr == 0] = residualized_data
+        else:
+            data_with_zeros = residualized_data
+
+        interpolated_data = interpolate_masked_data(
+            bold_data=data_with_zeros,
+            tmask=tmask_arr,
+            TR=self.inputs.TR,
+            method=self.inputs.interpolation,
+        )
+
+        if self.inputs.debug_intermediates:
+            self._results['interpolated_file'] = write_ndata(
+                data_matrix=interpolated_data,
+                template=self.inputs.bold_file,
+                filename=fname_presuffix(
+                    self.inputs.in_file,
+                    suffix=f'_interpolated{extension}',
+                    newpath=runtime.cwd,
+                    use_ext=False,
+                ),
+                mask=self.inputs.mask,
+                TR=self.inputs.TR)
+
+        # Bandpass filter the interpolated data
+        if self.inputs.bandpass_filter:
+            filtered_data = bandpass_filter_data(data=interpolated_data,
+                                                 TR=self.inputs.TR,
+                                                 lowpass=self.inputs.lowpass,
+                                                 highpass=self.inputs.highpass,
+                                                 order=self.inputs.filter_order,
+                                                 filter_engine=self.inputs.filter_engine,
+                                                 fft_response=self.inputs.fft_response)
+        else:
+            filtered_data = interpolated_data  # no filtering!
+
+        self._results['filtered_file'] = write_ndata(
+            data_matrix=filtered_data,
+            template=self.inputs.bold_file,
+            filename=fname_presuffix(
+                self.inputs.in_file,
+                suffix=f'_filtered{extension}',
+                newpath=runtime.cwd,
+                use_ext=False,
+            ),
+            mask=self.inputs.mask,
+            TR=self.inputs.TR)
+        return runtime
+
+
+class _DespikeInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="nifti or cifti file")
+    mask = File(exists=True, mandatory=False, desc="brain mask for nifti files")
+    TR = traits.Float(exists=True, mandatory=True, desc="repetition time")
+    num_threads = traits.Int(1, usedefault=True, desc="number of blocks to despike in parallel")
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
+    precision = traits.Enum("float64",
+                            "float32",
+                            usedefault=True,
+                            desc="Floating-point precision of the BOLD data in memory")
+
+
+class _DespikeOutputSpec(TraitedSpec):
+    des_file = File(exists=True, mandatory=True, desc="despiked nifti or cifti file")
+
+
+class Despike(SimpleInterface):
+    """Despike a NIfTI or CIFTI file.
+
+    Spikes are truncated in-process with the same algorithm for both file types,
+    following AFNI's ``3dDespike -NEW``.
+    """
+
+    input_spec = _DespikeInputSpec
+    output_spec = _DespikeOutputSpec
+
+    def _run_interface(self, runtime):
+        extension = get_work_extension(self.inputs.in_file, self.inputs.work_format)
         self._results['des_file'] = fname_presuffix(
-            'ciftidepike',
-            suffix='.dtseries.nii',
+            self.inputs.in_file,
+            suffix=f'_despiked{extension}',
             newpath=runtime.cwd,
             use_ext=False,
         )
-        self._results['des_file'] = despikedatacifti(cifti=self.inputs.in_file,
-                                                     TR=self.inputs.TR,
-                                                     basedir=runtime.cwd)
+
+        # Each voxel/vertex is despiked separately, so the data are processed one block
+        # per thread at a time (streamed from disk unless the input is gzipped).
+        num_threads = max(self.inputs.num_threads, 1)
+        writer = NdataWriter(
+            template=self.inputs.in_file,
+            filename=self._results['des_file'],
+            n_volumes=get_n_volumes(self.inputs.in_file),
+            mask=self.inputs.mask,
+            TR=self.inputs.TR,
+            dtype=self.inputs.precision,
+        )
+        with writer:
+            for data_block in iter_ndata_blocks(
+                self.inputs.in_file,
+                self.inputs.mask,
+                block_size=5000 * num_threads,
+                dtype=self.inputs.precision,
+            ):
+                writer.write(despike_data(data_block, n_threads=num_threads))
+
         return runtime
@@ -8,16 +8,11 @@
 import os
 import shutil
 
+import nibabel as nb
 import tempita
 from brainsprite import viewer_substitute
 from nipype import logging
-from nipype.interfaces.afni.preprocess import AFNICommandOutputSpec, DespikeInputSpec
-from nipype.interfaces.afni.utils import (
-    ReHoInputSpec,
-    ReHoOutputSpec,
-    UnifizeInputSpec,
-    UnifizeOutputSpec,
-)
+from nipype.interfaces.afni.utils import UnifizeInputSpec, UnifizeOutputSpec
 from nipype.interfaces.base import (
     BaseInterfaceInputSpec,
     File,
@@ -27,10 +22,22 @@ from nipype.interfaces.base import (
 )
 from pkg_resources import resource_filename as pkgrf
 
-from xcp_d.utils.fcon import compute_2d_reho, compute_alff, mesh_adjacency
+from xcp_d.utils.fcon import (
+    compute_2d_reho,
+    compute_alff,
+    mesh_adjacency,
+    volume_adjacency,
+)
 from xcp_d.utils.filemanip import fname_presuffix
+from xcp_d.utils.filter_design import get_frequency_bins
 from xcp_d.utils.utils import zscore_nifti
-from xcp_d.utils.write_save import read_gii, read_ndata, write_gii, write_ndata
+from xcp_d.utils.write_save import (
+    get_work_extension,
+    read_gii,
+    read_ndata,
+    write_gii,
+    write_ndata,
+)
 
 LOGGER = logging.getLogger('nipype.interface')
 
@@ -106,6 +113,14 @@ class _ComputeALFFInputSpec(BaseInterfaceInputSpec):
     mask = File(exists=False,
                 mandatory=False,
                 desc=" brain mask for nifti file")
+    work_format = traits.Enum("nii.gz",
+                              "nii",
+                              usedefault=True,
+                              desc="Format of the NIfTI intermediates written by the interface")
+    precision = traits.Enum("float64",
+                            "float32",
+                            usedefault=True,
+                            desc="Floating-point precision of the BOLD data in memory")
 
 
 class _ComputeALFFOutputSpec(TraitedSpec):
@@ -140,7 +155,15 @@ class ComputeALFF(SimpleInterface):
 
         # Get the nifti/cifti into matrix form
         data_matrix = read_ndata(datafile=self.inputs.in_file,
-                                 maskfile=self.inputs.mask)
+                                 maskfile=self.inputs.mask,
+                                 dtype=self.inputs.precision)
+        frequency_bins = get_frequency_bins(
+            n_timepoints=data_matrix.shape[1],
+            TR=self.inputs.TR,
+            lowpass=self.inputs.lowpass,
+            highpass=self.inputs.highpass,
+        )
+        LOGGER.info(f"Computing ALFF (frequency bins {frequency_bins.param_hash}).")
         # compute the ALFF
         alff_mat = compute_alff(data_matrix=data_matrix,
                                 low_pass=self.inputs.lowpass,
@@ -149,10 +172,8 @@ class ComputeALFF(SimpleInterface):
 
         # Write out the data
 
-        if self.inputs.in_file.endswith('.dtseries.nii'):
-            suffix = '_alff.dtseries.nii'
-        elif self.inputs.in_file.endswith('.nii.gz'):
-            suffix = '_alff.nii.gz'
+        extension = get_work_extension(self.inputs.in_file, self.inputs.work_format)
+        suffix = f'_alff{extension}'
 
         self._results['alff_out'] = fname_presuffix(
             self.inputs.in_file,
@@ -225,63 +246,78 @@ class BrainPlot(SimpleInterface):
         return runtime
 
 
-class ReHoNamePatch(SimpleInterface):
-    """Compute ReHo for a given neighbourhood, based on a local neighborhood of that voxel.
-
-    For complete details, see the `3dReHo Documentation.
-    <https://afni.nimh.nih.gov/pub/dist/doc/program_help/3dReHo.html>`_
-
-    Examples
-    --------
-    >>> from nipype.interfaces import afni
-    >>> reho = afni.ReHo()
-    >>> reho.inputs.in_file = 'functional.nii'
-    >>> reho.inputs.out_file = 'reho.nii.gz'
-    >>> reho.inputs.neighborhood = 'vertices'
-    >>> reho.cmdline
-    '3dReHo -prefix reho.nii.gz -inset functional.nii -nneigh 27'
-    >>> res = reho.run()  # doctest: +SKIP
-    """
+class _NiftiReHoInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, mandatory=True, desc="4D BOLD NIfTI file")
+    mask_file = File(exists=True, mandatory=True, desc="binary brain mask")
+    neighborhood = traits.Enum(
+        "vertices",
+        "edges",
+        "faces",
+        usedefault=True,
+        desc=(
+            "Voxels that share at least a vertex (27-voxel neighborhood), "
+            "an edge (19-voxel neighborhood), or a face (7-voxel neighborhood) "
+            "with the central voxel."
+        ),
+    )
+    precision = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="Floating-point precision of the BOLD data in memory",
+    )
 
-    _cmd = "3dReHo"
-    input_spec = ReHoInputSpec
-    output_spec = ReHoOutputSpec
 
-    def _run_interface(self, runtime):
-        outfile = runtime.cwd + "/reho.nii.gz"
-        shutil.copyfile(self.inputs.in_file, runtime.cwd + "/inset.nii.gz")
-        shutil.copyfile(self.inputs.mask_file, runtime.cwd + "/mask.nii.gz")
-        os.system(
-            "3dReHo -inset inset.nii.gz -mask mask.nii.gz -nneigh 27 -prefix reho.nii.gz"
-        )
-        self._results['out_file'] = outfile
+class _NiftiReHoOutputSpec(TraitedSpec):
+    out_file = File(exists=True, mandatory=True, desc="ReHo NIfTI file")
 
 
-class DespikePatch(SimpleInterface):
-    """Remove 'spikes' from the 3D+time input dataset.
+class NiftiReHo(SimpleInterface):
+    """Compute regional homogeneity (ReHo) on volumetric (NIfTI) data.
 
-    For complete details, see the `3dDespike Documentation.
-    <https://afni.nimh.nih.gov/pub/dist/doc/program_help/3dDespike.html>`_
+    ReHo is Kendall's coefficient of concordance (W) between the time series of each
+    in-mask voxel and those of its in-mask neighbors, as in AFNI's 3dReHo.
 
     Examples
     --------
-    >>> from nipype.interfaces import afni
-    >>> despike = afni.Despike()
-    >>> despike.inputs.in_file = 'functional.nii'
-    >>> despike.cmdline
-    '3dDespike -prefix functional_despike functional.nii'
-    >>> res = despike.run()  # doctest: +SKIP
+    .. testsetup::
+    >>> from tempfile import TemporaryDirectory
+    >>> tmpdir = TemporaryDirectory()
+    >>> os.chdir(tmpdir.name)
+    .. doctest::
+    >>> reho = NiftiReHo()
+    >>> reho.inputs.in_file = 'functional.nii.gz'
+    >>> reho.inputs.mask_file = 'mask.nii.gz'
+    >>> reho.inputs.neighborhood = 'vertices'
+    >>> reho.run()  # doctest: +SKIP
+    .. testcleanup::
+    >>> tmpdir.cleanup()
     """
 
-    _cmd = "3dDespike"
-    input_spec = DespikeInputSpec
-    output_spec = AFNICommandOutputSpec
+    input_spec = _NiftiReHoInputSpec
+    output_spec = _NiftiReHoOutputSpec
 
     def _run_interface(self, runtime):
-        outfile = runtime.cwd + "/3despike.nii.gz"
-        shutil.copyfile(self.inputs.in_file, runtime.cwd + "/inset.nii.gz")
-        os.system("3dDespike -NEW -prefix  3despike.nii.gz inset.nii.gz")
-        self._results['out_file'] = outfile
+        data_matrix = read_ndata(
+            datafile=self.inputs.in_file,
+            maskfile=self.inputs.mask_file,
+            dtype=self.inputs.precision,
+        )
+
+        # the neighborhood index table is built once for the whole mask
+        mask = nb.load(self.inputs.mask_file).get_fdata()
+        adjacency_matrix = volume_adjacency(mask, neighborhood=self.inputs.neighborhood)
+        reho = compute_2d_reho(data_matrix, adjacency_matrix)
+
+        self._results['out_file'] = os.path.join(runtime.cwd, "reho.nii.gz")
+        write_ndata(
+            reho,
+            template=self.inputs.in_file,
+            filename=self._results['out_file'],
+            mask=self.inputs.mask_file,
+        )
+
+        return runtime
 
 
 class ContrastEnhancement(SimpleInterface):
@@ -155,9 +155,6 @@ class RegPlot(SimpleInterface):
 
 class _PlotSVGDataInputSpec(BaseInterfaceInputSpec):
     rawdata = File(exists=True, mandatory=True, desc="Raw data")
-    regressed_data = File(exists=True,
-                          mandatory=True,
-                          desc="Data after regression")
     residual_data = File(exists=True, mandatory=True, desc="Data after filtering")
     filtered_motion = File(
         exists=True,
@@ -167,6 +164,12 @@ class _PlotSVGDataInputSpec(BaseInterfaceInputSpec):
     mask = File(exists=False, mandatory=False, desc="Bold mask")
     seg_data = File(exists=False, mandatory=False, desc="Segmentation file")
     TR = traits.Float(default_value=1, desc="Repetition time")
+    precision = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="Floating-point precision of the BOLD data in memory",
+    )
 
 
 class _PlotSVGDataOutputSpec(TraitedSpec):
@@ -181,7 +184,7 @@ class _PlotSVGDataOutputSpec(TraitedSpec):
 class PlotSVGData(SimpleInterface):
     """Plot fd, dvars, and carpet plots of the bold data before and after regression/filtering.
 
-    It takes in the data that's regressed, the data that's filtered and regressed,
+    It takes in the unprocessed data and the data that's filtered and regressed,
     as well as the segmentation files, TR, FD, bold_mask and unprocessed data.
 
     It outputs the .SVG files before after processing has taken place.
@@ -205,14 +208,14 @@ class PlotSVGData(SimpleInterface):
         self._results['before_process'], self._results[
             'after_process'] = plot_svgx(
                 rawdata=self.inputs.rawdata,
-                regressed_data=self.inputs.regressed_data,
                 residual_data=self.inputs.residual_data,
                 TR=self.inputs.TR,
                 mask=self.inputs.mask,
                 filtered_motion=self.inputs.filtered_motion,
                 seg_data=self.inputs.seg_data,
                 processed_filename=self._results['after_process'],
-                unprocessed_filename=self._results['before_process'])
+                unprocessed_filename=self._results['before_process'],
+                dtype=self.inputs.precision)
 
         return runtime
 
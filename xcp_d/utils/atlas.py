@@ -1,4 +1,8 @@
 """Functions for working with atlases."""
+import os
+
+import nibabel as nb
+import numpy as np
 
 
 def get_atlas_names():
@@ -130,3 +134,110 @@ def get_atlas_cifti(atlas_name):
         raise RuntimeError(f'Atlas "{atlas_name}" not available')
 
     return atlas_file
+
+
+def stack_atlases(atlas_files, out_dir):
+    """Stack NIfTI atlases into 4D label images, so each stack can be warped in one call.
+
+    Atlases are grouped by voxel grid, and each group is stacked along the fourth dimension.
+    Atlases whose grids only differ by axis flips or permutations are reoriented to the grid
+    of the group, which does not change their labels.
+
+    Parameters
+    ----------
+    atlas_files : :obj:`list` of :obj:`str`
+        Paths to the atlases.
+    out_dir : str
+        Directory in which the stacked atlases are written.
+
+    Returns
+    -------
+    stacked_files : :obj:`list` of :obj:`str`
+        Paths to the 4D stacked atlases, one for each distinct voxel grid.
+    atlas_index : :obj:`list` of :obj:`list` of :obj:`int`
+        The index of the stacked file and the volume that contain each atlas.
+        Aligned with ``atlas_files``.
+    """
+    groups, atlas_index = [], []
+    for atlas_file in atlas_files:
+        atlas_img = nb.load(atlas_file)
+        for i_group, (reference_img, group_data) in enumerate(groups):
+            reoriented_img = _reorient_to(atlas_img, reference_img)
+            if reoriented_img is not None:
+                atlas_index.append([i_group, len(group_data)])
+                group_data.append(np.asanyarray(reoriented_img.dataobj))
+                break
+        else:
+            atlas_index.append([len(groups), 0])
+            groups.append((atlas_img, [np.asanyarray(atlas_img.dataobj)]))
+
+    stacked_files = []
+    for i_group, (reference_img, group_data) in enumerate(groups):
+        stacked_data = np.rint(np.stack(group_data, axis=-1))
+        dtype = np.int16 if stacked_data.max() <= np.iinfo(np.int16).max else np.int32
+        stacked_img = nb.Nifti1Image(
+            stacked_data.astype(dtype),
+            reference_img.affine,
+            reference_img.header,
+        )
+        stacked_img.set_data_dtype(dtype)
+        stacked_file = os.path.join(out_dir, f"stacked_atlases_{i_group}.nii.gz")
+        stacked_img.to_filename(stacked_file)
+        stacked_files.append(stacked_file)
+
+    return stacked_files, atlas_index
+
+
+def split_atlases(stacked_files, atlas_index, out_files):
+    """Split stacked atlases, e.g., after warping them, into one file per atlas.
+
+    Parameters
+    ----------
+    stacked_files : :obj:`list` of :obj:`str`
+        Paths to the 4D stacked atlases.
+    atlas_index : :obj:`list` of :obj:`list` of :obj:`int`
+        The index of the stacked file and the volume that contain each atlas,
+        as returned by :func:`stack_atlases`.
+    out_files : :obj:`list` of :obj:`str`
+        Paths to the atlases to write. Aligned with ``atlas_index``.
+
+    Returns
+    -------
+    out_files : :obj:`list` of :obj:`str`
+        Paths to the atlases.
+    """
+    stacked_imgs = [nb.load(stacked_file) for stacked_file in stacked_files]
+    for (i_stack, i_volume), out_file in zip(atlas_index, out_files):
+        stacked_img = stacked_imgs[i_stack]
+        atlas_data = np.asanyarray(stacked_img.dataobj[..., i_volume])
+        # ANTs writes interpolated labels as floats
+        atlas_img = nb.Nifti1Image(
+            np.rint(atlas_data).astype(np.int32),
+            stacked_img.affine,
+            stacked_img.header,
+        )
+        atlas_img.set_data_dtype(np.int32)
+        atlas_img.to_filename(out_file)
+
+    return out_files
+
+
+def _reorient_to(img, reference_img):
+    """Reorient an image to the grid of a reference image, if only the axis order differs.
+
+    Returns None if the voxel grids differ otherwise.
+    """
+    if len(img.shape) != 3 or len(reference_img.shape) != 3:
+        return None
+
+    transform = nb.orientations.ornt_transform(
+        nb.orientations.io_orientation(img.affine),
+        nb.orientations.io_orientation(reference_img.affine),
+    )
+    reoriented_img = img.as_reoriented(transform)
+    if reoriented_img.shape == reference_img.shape and np.allclose(
+        reoriented_img.affine, reference_img.affine, atol=1e-4
+    ):
+        return reoriented_img
+
+    return None
@@ -0,0 +1,234 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Utilities for the on-disk cache shared by xcp_d processes.
+
+Nipype runs each node in its own process, so results that several nodes derive from the
+same input file are cached on disk rather than in memory.
+Cache entries are keyed on the input file's signature (absolute path, modification time,
+and size) and on the parameters used to derive them, so a modified input is never served
+from a stale entry.
+
+Results derived from a run's own files (see :func:`get_work_cache_dir`) are cached in the
+working directory, and are deleted with it.
+Only results derived from files that ship with xcp_d or TemplateFlow, which are reused by
+every subject, are cached in the shared cache directory (see :func:`get_cache_dir`).
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+# Environment variable that points to the cache directory.
+CACHE_DIR_ENV = "XCPD_CACHE_DIR"
+# Environment variable that points to the cache directory in the working directory.
+WORK_CACHE_DIR_ENV = "XCPD_WORK_CACHE_DIR"
+
+
+def get_cache_dir(subdir=None):
+    """Get the cache directory, creating it if necessary.
+
+    Parameters
+    ----------
+    subdir : str or None, optional
+        Subdirectory of the cache directory to return. Default is None.
+
+    Returns
+    -------
+    cache_dir : str
+        The ``XCPD_CACHE_DIR`` environment variable, if set,
+        or ``~/.cache/xcp_d`` otherwise.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV) or os.path.join(
+        os.path.expanduser("~"),
+        ".cache",
+        "xcp_d",
+    )
+    if subdir:
+        cache_dir = os.path.join(cache_dir, subdir)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_work_cache_dir(subdir=None):
+    """Get the cache directory for results derived from a run's own files.
+
+    Parameters
+    ----------
+    subdir : str or None, optional
+        Subdirectory of the cache directory to return. Default is None.
+
+    Returns
+    -------
+    cache_dir : str
+        The ``XCPD_WORK_CACHE_DIR`` environment variable, which xcp_d sets to a
+        directory in the working directory.
+        If the variable is not set, the directory from :func:`get_cache_dir` is used.
+    """
+    cache_dir = os.environ.get(WORK_CACHE_DIR_ENV)
+    if not cache_dir:
+        return get_cache_dir(subdir)
+
+    if subdir:
+        cache_dir = os.path.join(cache_dir, subdir)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def is_shared_file(filename):
+    """Check whether a file is the same for every subject, e.g., a template.
+
+    Parameters
+    ----------
+    filename : str
+        Path to a file.
+
+    Returns
+    -------
+    bool
+        True if the file ships with xcp_d, is in the TemplateFlow home directory,
+        or is itself an entry of the shared cache directory (see :func:`get_cache_dir`).
+    """
+    from templateflow.conf import TF_HOME
+
+    import xcp_d
+
+    filename = os.path.realpath(filename)
+    shared_dirs = [os.path.dirname(xcp_d.__file__), str(TF_HOME), get_cache_dir()]
+    return any(
+        filename.startswith(os.path.join(os.path.realpath(shared_dir), ""))
+        for shared_dir in shared_dirs
+    )
+
+
+def file_signature(filename):
+    """Get a signature that changes whenever a file is replaced or modified.
+
+    Parameters
+    ----------
+    filename : str
+        Path to an existing file.
+
+    Returns
+    -------
+    list
+        The absolute path, modification time (in nanoseconds), and size of the file.
+    """
+    stat = os.stat(filename)
+    return [os.path.abspath(filename), stat.st_mtime_ns, stat.st_size]
+
+
+def cache_key(*parts):
+    """Build a hash from JSON-serializable parts, such as file signatures and parameters.
+
+    Parameters
+    ----------
+    *parts
+        Values that define the cache entry.
+
+    Returns
+    -------
+    str
+        A 40-character hexadecimal hash.
+    """
+    serialized = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+def atomic_write(filename, write_function):
+    """Write a cache entry so that concurrent readers never see a partial file.
+
+    The entry is written to a temporary file in the same directory,
+    which is then renamed to ``filename``.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the cache entry.
+    write_function : callable
+        Function that takes a path and writes the entry to it.
+
+    Returns
+    -------
+    filename : str
+        Path of the cache entry.
+    """
+    directory, basename = os.path.split(filename)
+    _, extension = os.path.splitext(basename)
+    fd, temp_filename = tempfile.mkstemp(prefix=f".{basename}.", suffix=extension, dir=directory)
+    os.close(fd)
+    try:
+        write_function(temp_filename)
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+    return filename
+
+
+def write_json(filename, data):
+    """Write a JSON-serializable object to a file, e.g., with :func:`atomic_write`."""
+    with open(filename, "w") as fo:
+        json.dump(data, fo)
+
+
+def touch(filename):
+    """Mark a cache entry as recently used, for :func:`evict_lru`.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the cache entry.
+    """
+    try:
+        os.utime(filename)
+    except OSError:
+        # the entry may have been evicted by another process
+        pass
+
+
+def evict_lru(cache_dir, max_bytes, extension=".npy"):
+    """Delete the least recently used cache entries until the cache fits in a size limit.
+
+    Entries are ordered by modification time, which :func:`touch` updates on every hit.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory.
+    max_bytes : int
+        Maximum total size of the entries, in bytes.
+    extension : str, optional
+        Extension of the entries. Other files are ignored. Default is ".npy".
+
+    Returns
+    -------
+    list of str
+        The deleted entries.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        # skip the temporary files of entries that are being written
+        if entry.name.endswith(extension) and not entry.name.startswith("."):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_bytes -= size
+        evicted.append(path)
+
+    return evicted
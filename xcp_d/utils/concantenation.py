@@ -18,9 +18,8 @@ from nipype.interfaces.ants import ApplyTransforms
 from templateflow.api import get as get_template
 
 from xcp_d.utils.plot import _get_tr, plot_svgx
-from xcp_d.utils.qcmetrics import compute_dvars
 from xcp_d.utils.utils import get_transformfile
-from xcp_d.utils.write_save import read_ndata
+from xcp_d.utils.write_save import get_n_volumes
 
 
 def concatenatebold(subjlist, fmridir, outputdir, work_dir):
@@ -241,8 +240,6 @@ def concatenate_nifti(subid, fmridir, outputdir, ses=None, work_dir=None):
             # If no files found for this task, move on to the next task.
             continue
 
-        regressed_dvars = []
-
         res = denoised_task_files[0]
         resid = res.split('run-')[1].partition('_')[-1]
 
@@ -300,11 +297,6 @@ def concatenate_nifti(subid, fmridir, outputdir, ses=None, work_dir=None):
                 combine_img = concat_imgs(found_files)
                 combine_img.to_filename(outfile)
 
-                for found_file in found_files:
-                    dvar = compute_dvars(read_ndata(found_file, mask))
-                    dvar[0] = np.mean(dvar)
-                    regressed_dvars.append(dvar)
-
         preproc_files = natsorted(
             glob.glob(
                 os.path.join(
@@ -339,20 +331,14 @@ def concatenate_nifti(subid, fmridir, outputdir, ses=None, work_dir=None):
             figures_dir,
             f'{concatenated_filename_base}_desc-postcarpetplot_bold.svg',
         )
-        raw_dvars = []
-        for f in preproc_files:
-            dvar = compute_dvars(read_ndata(f, mask))
-            dvar[0] = np.mean(dvar)
-            raw_dvars.append(dvar)
-
+        # DVARS is computed separately for each run from the concatenated files
+        denoised_files = natsorted(glob.glob(f'{file_search_base}_desc-denoised_bold.nii.gz'))
         plot_svgx(
             rawdata=rawdata,
-            regressed_data=f'{concatenated_file_base}_desc-denoised_bold.nii.gz',
             residual_data=f'{concatenated_file_base}_desc-denoised_bold.nii.gz',
             filtered_motion=f'{mot_concatenated_file_base}{motion_suffix}',
-            raw_dvars=raw_dvars,
-            regressed_dvars=regressed_dvars,
-            filtered_dvars=regressed_dvars,
+            raw_run_lengths=[get_n_volumes(f) for f in preproc_files],
+            residual_run_lengths=[get_n_volumes(f) for f in denoised_files],
             processed_filename=postcarpet,
             unprocessed_filename=precarpet,
             mask=mask,
@@ -459,7 +445,6 @@ def concatenate_cifti(subid, fmridir, outputdir, ses=None, work_dir=None):
             # If no files found for this task, move on to the next task.
             continue
 
-        regressed_dvars = []
         res = denoised_task_files[0]
         resid = res.split('run-')[1].partition('_')[-1]
 
@@ -528,18 +513,7 @@ def concatenate_cifti(subid, fmridir, outputdir, ses=None, work_dir=None):
                 combinefile = " -cifti ".join(found_files)
                 os.system('wb_command -cifti-merge ' + outfile + ' -cifti ' + combinefile)
 
-                if file_pattern.endswith('_desc-denoised_bold.dtseries.nii'):
-                    for denoised_bold_file in found_files:
-                        dvar = compute_dvars(read_ndata(denoised_bold_file))
-                        dvar[0] = np.mean(dvar)
-                        regressed_dvars.append(dvar)
-
-        raw_dvars = []
         preproc_files = natsorted(glob.glob(os.path.join(func_dir, preproc_base_search_pattern)))
-        for f in preproc_files:
-            dvar = compute_dvars(read_ndata(f))
-            dvar[0] = np.mean(dvar)
-            raw_dvars.append(dvar)
 
         TR = _get_tr(preproc_files[0])
         rawdata = os.path.join(tempfile.mkdtemp(), 'den-91k_bold.dtseries.nii')
@@ -555,16 +529,16 @@ def concatenate_cifti(subid, fmridir, outputdir, ses=None, work_dir=None):
             f'{concatenated_filename_base}_desc-postcarpetplot_bold.svg',
         )
 
-        raw_dvars = np.concatenate([a.ravel() for a in raw_dvars])
-        regressed_dvars = np.concatenate([a.ravel() for a in regressed_dvars])
+        # DVARS is computed separately for each run from the concatenated files
+        denoised_files = natsorted(
+            glob.glob(f'{file_search_base}_desc-denoised_bold.dtseries.nii')
+        )
         plot_svgx(
             rawdata=rawdata,
-            regressed_data=f'{concatenated_file_base}_desc-denoised_bold.dtseries.nii',
             residual_data=f'{concatenated_file_base}_desc-denoised_bold.dtseries.nii',
             filtered_motion=f'{mot_concatenated_file_base}{motion_suffix}',
-            raw_dvars=raw_dvars,
-            regressed_dvars=regressed_dvars,
-            filtered_dvars=regressed_dvars,
+            raw_run_lengths=[get_n_volumes(f) for f in preproc_files],
+            residual_run_lengths=[get_n_volumes(f) for f in denoised_files],
             processed_filename=postcarpet,
             unprocessed_filename=precarpet,
             TR=TR,
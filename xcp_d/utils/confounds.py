@@ -3,12 +3,21 @@
 """Confound matrix selection based on Ciric et al. 2007."""
 import os
 import warnings
+from collections import namedtuple
 
 import numpy as np
 import pandas as pd
-from scipy.signal import filtfilt, firwin, iirnotch
-
+from scipy.signal import filtfilt
+
+from xcp_d.utils.cache import (
+    atomic_write,
+    cache_key,
+    file_signature,
+    get_work_cache_dir,
+    write_json,
+)
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.filter_design import get_motion_filter_design
 
 
 def get_confounds_tsv(datafile):
@@ -37,6 +46,159 @@ def get_confounds_tsv(datafile):
     return confounds_timeseries
 
 
+# Names of the six basic motion parameters, rotations first.
+MOTION_COLUMNS = ["rot_x", "rot_y", "rot_z", "trans_x", "trans_y", "trans_z"]
+
+
+def load_confounds_table(confounds_file, columns=None):
+    """Load columns from a confounds TSV file, parsing the file only once.
+
+    The first time a confounds file is requested, it is parsed with pandas and its
+    numeric columns are stored in the working directory's cache
+    (see :func:`~xcp_d.utils.cache.get_work_cache_dir`) as a column-major ``.npy`` array,
+    along with a JSON sidecar listing the column names and data types.
+    Later calls from any process memory-map the array, only read the requested columns,
+    and restore their original data types.
+    Non-numeric columns are not cached, and are read from the TSV file when requested.
+    Entries are keyed on the file's path, modification time, and size.
+
+    Parameters
+    ----------
+    confounds_file : str
+        Path to a confounds TSV file with a header row.
+    columns : list of str or None, optional
+        Columns to load. If None (default), all columns are loaded.
+
+    Returns
+    -------
+    confounds_df : pandas.DataFrame
+        The requested columns, in the requested order, with the data types pandas
+        assigns when reading the TSV file.
+    """
+    all_columns, dtypes, column_data = _load_cached_confounds(confounds_file)
+
+    if columns is None:
+        columns = all_columns
+
+    missing_columns = sorted(set(columns) - set(all_columns))
+    if missing_columns:
+        raise KeyError(f"Columns not found in {confounds_file}: {missing_columns}")
+
+    numeric_columns = [column for column in all_columns if column in dtypes]
+    column_positions = {column: i_column for i_column, column in enumerate(numeric_columns)}
+    other_columns = [column for column in columns if column not in column_positions]
+    if other_columns:
+        other_df = pd.read_table(confounds_file, usecols=other_columns)
+
+    confounds_df = pd.DataFrame(
+        {
+            column: (
+                column_data[column_positions[column], :].astype(dtypes[column])
+                if column in column_positions
+                else other_df[column]
+            )
+            for column in columns
+        },
+        columns=list(columns),
+    )
+
+    return confounds_df
+
+
+def get_confounds_columns(confounds_file):
+    """Get the column names of a confounds TSV file, through the cache.
+
+    Parameters
+    ----------
+    confounds_file : str
+        Path to a confounds TSV file with a header row.
+
+    Returns
+    -------
+    list of str
+        The column names.
+    """
+    return _load_cached_confounds(confounds_file)[0]
+
+
+def _load_cached_confounds(confounds_file):
+    """Get the column names and memory-mapped numeric data of a confounds file.
+
+    The numeric columns are stored as float64 rows, in the order of the file,
+    and their original data types are returned as a dictionary.
+    """
+    import json
+
+    cache_file = os.path.join(
+        get_work_cache_dir("confounds"),
+        f"{cache_key(file_signature(confounds_file), 'dtypes')}.npy",
+    )
+    names_file = cache_file.replace(".npy", ".json")
+
+    # the names are written last, so they mark a complete entry
+    if os.path.isfile(names_file):
+        with open(names_file) as fo:
+            sidecar = json.load(fo)
+
+        all_columns, dtypes = sidecar["columns"], sidecar["dtypes"]
+        column_data = np.load(cache_file, mmap_mode="r")
+
+    else:
+        confounds_df = pd.read_table(confounds_file)
+        all_columns = confounds_df.columns.tolist()
+        dtypes = {
+            column: str(confounds_df[column].dtype)
+            for column in all_columns
+            if pd.api.types.is_numeric_dtype(confounds_df[column])
+        }
+        column_data = np.ascontiguousarray(
+            confounds_df[list(dtypes)].to_numpy(dtype=np.float64).T
+        )
+        sidecar = {"columns": all_columns, "dtypes": dtypes}
+        atomic_write(cache_file, lambda filename: np.save(filename, column_data))
+        atomic_write(names_file, lambda filename: write_json(filename, sidecar))
+
+    return all_columns, dtypes, column_data
+
+
+def load_confounds_metadata(confounds_json):
+    """Load a confounds JSON file, parsing the file only once.
+
+    The parsed metadata are pickled in the working directory's cache, next to the
+    cached confounds tables, so later calls from any process skip the JSON parsing.
+    Entries are keyed on the file's path, modification time, and size.
+
+    Parameters
+    ----------
+    confounds_json : str
+        Path to a confounds JSON file.
+
+    Returns
+    -------
+    confoundjs : dict
+        Metadata from the confounds JSON file.
+    """
+    import pickle
+
+    cache_file = os.path.join(
+        get_work_cache_dir("confounds"),
+        f"{cache_key(file_signature(confounds_json))}.pkl",
+    )
+    if os.path.isfile(cache_file):
+        with open(cache_file, "rb") as fo:
+            return pickle.load(fo)
+
+    confoundjs = readjson(confounds_json)
+
+    def _write_pickle(filename):
+        with open(filename, "wb") as fo:
+            pickle.dump(confoundjs, fo, protocol=pickle.HIGHEST_PROTOCOL)
+
+    atomic_write(cache_file, _write_pickle)
+
+    return confoundjs
+
+
 def load_confound(datafile):
     """Load confound amd json.
 
@@ -69,9 +231,9 @@ def load_confound(datafile):
             + "_desc-confounds_timeseries.json"
         )
 
-    confoundpd = pd.read_csv(confounds_timeseries, delimiter="\t", encoding="utf-8")
+    confoundpd = load_confounds_table(confounds_timeseries)
 
-    confoundjs = readjson(confounds_json)
+    confoundjs = load_confounds_metadata(confounds_json)
 
     return confoundpd, confoundjs
 
@@ -136,9 +298,7 @@ def load_motion(
     assert motion_filter_type in ("lp", "notch", None), motion_filter_type
 
     # Select the motion columns from the overall confounds DataFrame
-    motion_confounds_df = confounds_df[
-        ["rot_x", "rot_y", "rot_z", "trans_x", "trans_y", "trans_z"]
-    ]
+    motion_confounds_df = confounds_df[MOTION_COLUMNS]
 
     # Apply LP or notch filter
     if motion_filter_type in ("lp", "notch"):
@@ -162,6 +322,78 @@ def load_motion(
     return motion_confounds_df
 
 
+@fill_doc
+def load_filtered_motion(
+    confounds_file,
+    TR,
+    motion_filter_type=None,
+    band_stop_min=None,
+    band_stop_max=None,
+    motion_filter_order=4,
+):
+    """Load the six basic motion regressors from a confounds file, with caching.
+
+    Filtered motion parameters are cached in the working directory
+    (see :func:`~xcp_d.utils.cache.get_work_cache_dir`) per confounds file and filter
+    parameters, so interfaces that need the same filtered motion share a single computation.
+
+    Parameters
+    ----------
+    confounds_file : str
+        The confounds TSV file from which to extract the six basic motion regressors.
+    TR : float
+        The repetition time of the associated scan.
+    motion_filter_type : {"lp", "notch", None}
+        The filter type to use.
+        If None, the unfiltered motion parameters are loaded and nothing is cached.
+    %(band_stop_min)s
+    %(band_stop_max)s
+    motion_filter_order : int, optional
+        Default is 4.
+
+    Returns
+    -------
+    motion_confounds : pandas.DataFrame
+        The six motion regressors.
+        The three rotations are listed first, then the three translations.
+
+    See Also
+    --------
+    load_motion
+    """
+    if motion_filter_type is None:
+        return load_confounds_table(confounds_file, columns=MOTION_COLUMNS)
+
+    design = get_motion_filter_design(
+        TR=TR,
+        motion_filter_type=motion_filter_type,
+        band_stop_min=band_stop_min,
+        band_stop_max=band_stop_max,
+        motion_filter_order=motion_filter_order,
+    )
+    cache_file = os.path.join(
+        get_work_cache_dir("motion"),
+        f"{cache_key(file_signature(confounds_file), design.param_hash)}.tsv",
+    )
+    if os.path.isfile(cache_file):
+        return pd.read_table(cache_file, float_precision="round_trip")
+
+    motion_confounds_df = load_motion(
+        load_confounds_table(confounds_file, columns=MOTION_COLUMNS),
+        TR=TR,
+        motion_filter_type=motion_filter_type,
+        band_stop_min=band_stop_min,
+        band_stop_max=band_stop_max,
+        motion_filter_order=motion_filter_order,
+    )
+    atomic_write(
+        cache_file,
+        lambda filename: motion_confounds_df.to_csv(filename, sep="\t", index=False),
+    )
+
+    return motion_confounds_df
+
+
 def load_global_signal(confounds_df):
     """Select global signal from confounds DataFrame.
 
@@ -220,82 +452,130 @@ def load_cosine(confounds_df):
     return confounds_df[cosine]
 
 
-def load_acompcor(confounds_df, confoundjs):
-    """Select WM and GM acompcor separately.
+def get_acompcor_columns(confoundjs, n_components=4):
+    """Get the names of the retained WM and CSF aCompCor components.
 
     Parameters
     ----------
-    confounds_df : pandas.DataFrame
-        The confounds DataFrame from which to select the aCompCor regressors.
     confoundjs : dict
         The metadata associated with the confounds file.
+    n_components : int, optional
+        Maximum number of components to select from each mask. Default is 4.
 
     Returns
     -------
-    pandas.DataFrame
-        The confounds DataFrame, reduced to only include aCompCor regressors.
-    """
-    WM = []
-    CSF = []
-    for key, value in confoundjs.items():  # Use the confounds json
-        if "comp_cor" in key and "t" not in key:
-            # Pull out variance explained for white matter masks that are retained
-            if value["Mask"] == "WM" and value["Retained"]:
-                WM.append([key, value["VarianceExplained"]])
-            # Pull out variance explained for CSF masks that are retained
-            if value["Mask"] == "CSF" and value["Retained"]:
-                CSF.append([key, value["VarianceExplained"]])
-    # Select the first five components and add them to the list
-    csflist = []
-    wmlist = []
-    for i in range(0, 4):
-        try:
-            csflist.append(CSF[i][0])
-        except Exception as exc:
-            pass
-            print(exc)
-        try:
-            wmlist.append(WM[i][0])
-        except Exception as exc:
-            pass
-            print(exc)
-    acompcor = wmlist + csflist
-    return confounds_df[acompcor]
-
-
-def derivative(confound):
-    """Calculate derivative of a given array.
-
-    Parameters
-    ----------
-    confound : pandas.DataFrame
-        The confound to be modified.
-
-    Returns
-    -------
-    pandas.DataFrame
-        Derivative of the array, with a zero at the beginning.
-        The column(s) will be untitled.
+    list of str
+        The WM components, followed by the CSF components,
+        in the order they appear in the metadata.
     """
-    data = confound.to_numpy()
-    # Prepend 0 to the differences of the confound data
-    return pd.DataFrame(np.diff(data, prepend=0))
+    # anatomical components only, not temporal ones
+    retained = [
+        (key, value["Mask"])
+        for key, value in confoundjs.items()
+        if "comp_cor" in key and "t" not in key and value["Retained"]
+    ]
+    wm_columns = [key for key, mask in retained if mask == "WM"][:n_components]
+    csf_columns = [key for key, mask in retained if mask == "CSF"][:n_components]
+    return wm_columns + csf_columns
 
 
-def square_confound(confound):
-    """Square an array.
+def load_acompcor(confounds_df, confoundjs):
+    """Select WM and GM acompcor separately.
 
     Parameters
     ----------
-    confound : array_like or int or float
-        An array or value to square.
+    confounds_df : pandas.DataFrame
+        The confounds DataFrame from which to select the aCompCor regressors.
+    confoundjs : dict
+        The metadata associated with the confounds file.
 
     Returns
     -------
-    array_like or int or float
-        The squared input data.
+    pandas.DataFrame
+        The confounds DataFrame, reduced to only include aCompCor regressors.
     """
-    return confound**2  # Square the confound data
+    return confounds_df[get_acompcor_columns(confoundjs)]
+
+
+ConfoundTerm = namedtuple("ConfoundTerm", ["sources", "derivative", "square"])
+ConfoundTerm.__doc__ = """A group of confounds in a confound model, with its expansions.
+
+Attributes
+----------
+sources : tuple of str
+    Keys in :data:`CONFOUND_SOURCES`. The selected columns are concatenated, in order.
+derivative : bool
+    Whether to add the temporal derivatives of the columns.
+square : bool
+    Whether to add the squares of the columns (and of their derivatives, if any).
+"""
+
+
+def _motion_columns(columns, confoundjs):  # noqa: U100
+    """Select the six motion parameters."""
+    return MOTION_COLUMNS
+
+
+def _wm_csf_columns(columns, confoundjs):  # noqa: U100
+    """Select the mean WM and CSF signals."""
+    return ["csf", "white_matter"]
+
+
+def _global_signal_columns(columns, confoundjs):  # noqa: U100
+    """Select the global signal."""
+    return ["global_signal"]
+
+
+def _acompcor_columns(columns, confoundjs):  # noqa: U100
+    """Select the retained WM and CSF aCompCor components."""
+    return get_acompcor_columns(confoundjs)
+
+
+def _cosine_columns(columns, confoundjs):  # noqa: U100
+    """Select the discrete cosine basis regressors."""
+    return [column for column in columns if "cosine" in column]
+
+
+# Base columns for each source of confounds.
+# Each function takes the confounds TSV's column names and the confounds JSON metadata,
+# and returns the columns to select.
+# AROMA components are not stored in the confounds TSV, so they are loaded separately.
+CONFOUND_SOURCES = {
+    "motion": _motion_columns,
+    "wm_csf": _wm_csf_columns,
+    "global_signal": _global_signal_columns,
+    "acompcor": _acompcor_columns,
+    "cosine": _cosine_columns,
+    "aroma": None,
+}
+
+# The terms of each confound model, following Ciric et al. (2017).
+# The expanded columns of each term are ordered as: base columns, derivatives,
+# squared base columns, squared derivatives.
+CONFOUND_MODELS = {
+    "24P": (ConfoundTerm(("motion",), derivative=True, square=True),),
+    "27P": (
+        ConfoundTerm(("motion",), derivative=True, square=True),
+        ConfoundTerm(("wm_csf", "global_signal"), derivative=False, square=False),
+    ),
+    "36P": (
+        ConfoundTerm(("motion",), derivative=True, square=True),
+        ConfoundTerm(("wm_csf", "global_signal"), derivative=True, square=True),
+    ),
+    "acompcor": (
+        ConfoundTerm(("motion",), derivative=True, square=False),
+        ConfoundTerm(("acompcor", "cosine"), derivative=False, square=False),
+    ),
+    "acompcor_gsr": (
+        ConfoundTerm(("motion",), derivative=True, square=False),
+        ConfoundTerm(("acompcor", "global_signal", "cosine"), derivative=False, square=False),
+    ),
+    "aroma": (ConfoundTerm(("wm_csf", "aroma"), derivative=False, square=False),),
+    "aroma_gsr": (
+        ConfoundTerm(("wm_csf", "aroma", "global_signal"), derivative=False, square=False),
+    ),
+    "custom": (),
+}
 
 
 @fill_doc
@@ -304,6 +584,10 @@ def load_confound_matrix(
 ):
     """Load a subset of the confounds associated with a given file.
 
+    The model's terms are looked up in :data:`CONFOUND_MODELS`,
+    only the required columns are read from the confounds TSV,
+    and the expanded design is written into a single preallocated array.
+
     Parameters
     ----------
     original_file :
@@ -318,102 +602,93 @@ def load_confound_matrix(
     -------
     confound : pandas.DataFrame
         The loaded and selected confounds.
+        Derivatives are named with a ``_derivative1`` suffix and squares with a
+        ``_power2`` suffix, as in fMRIPrep.
     """
-    #  Get the confounds dat from the json and tsv
-    confoundjson = load_confound(original_file)[1]
-    confoundtsv = pd.read_table(confound_tsv)
-
-    if params == "24P":  # Get rot and trans values, as well as derivatives and square
-        rot_values = confoundtsv[["rot_x", "rot_y", "rot_z"]]
-        trans_values = confoundtsv[["trans_x", "trans_y", "trans_z"]]
-        motion = pd.concat([rot_values, trans_values], axis=1)
-        derivative_rot_trans = pd.concat([motion, derivative(motion)], axis=1)
-        confound = pd.concat(
-            [derivative_rot_trans, square_confound(derivative_rot_trans)], axis=1
-        )
-    elif params == "27P":  # Get rot and trans values, as well as derivatives, WM, CSF
-        # global signal and square
-        rot_values = confoundtsv[["rot_x", "rot_y", "rot_z"]]
-        trans_values = confoundtsv[["trans_x", "trans_y", "trans_z"]]
-        motion = pd.concat([rot_values, trans_values], axis=1)
-        derivative_rot_trans = pd.concat([motion, derivative(motion)], axis=1)
-        whitematter_csf = load_wm_csf(confoundtsv)
-        global_signal = load_global_signal(confoundtsv)
-        confound = pd.concat(
-            [
-                derivative_rot_trans,
-                square_confound(derivative_rot_trans),
-                whitematter_csf,
-                global_signal,
-            ],
-            axis=1,
-        )
-    elif params == "36P":  # Get rot and trans values, as well as derivatives, WM, CSF,
-        # global signal, and square. Add the square and derivative of the WM, CSF
-        # and global signal as well.
-        rot_values = confoundtsv[["rot_x", "rot_y", "rot_z"]]
-        trans_values = confoundtsv[["trans_x", "trans_y", "trans_z"]]
-        motion = pd.concat([rot_values, trans_values], axis=1)
-        derivative_rot_trans = pd.concat([motion, derivative(motion)], axis=1)
-        square_confounds = pd.concat(
-            [derivative_rot_trans, square_confound(derivative_rot_trans)], axis=1
-        )
-        global_signal_whitematter_csf = pd.concat(
-            [load_wm_csf(confoundtsv), load_global_signal(confoundtsv)], axis=1
-        )
-        global_signal_whitematter_csf_derivative = pd.concat(
-            [global_signal_whitematter_csf, derivative(global_signal_whitematter_csf)],
-            axis=1,
-        )
-        confound = pd.concat(
-            [
-                square_confounds,
-                global_signal_whitematter_csf_derivative,
-                square_confound(global_signal_whitematter_csf_derivative),
-            ],
-            axis=1,
+    if params not in CONFOUND_MODELS:
+        raise ValueError(f"Unknown confound model: {params}")
+
+    terms = CONFOUND_MODELS[params]
+    sources = {source for term in terms for source in term.sources}
+
+    # Resolve the base columns of every source
+    source_data = {}
+    if sources - {"aroma"}:
+        confoundjson = {}
+        if "acompcor" in sources:
+            confoundjson = load_confounds_metadata(
+                get_confounds_tsv(original_file).replace(".tsv", ".json")
+            )
+
+        all_columns = get_confounds_columns(confound_tsv)
+        source_columns = {
+            source: CONFOUND_SOURCES[source](all_columns, confoundjson)
+            for source in sources - {"aroma"}
+        }
+        required_columns = list(
+            dict.fromkeys(column for columns in source_columns.values() for column in columns)
         )
-    elif params == "acompcor":  # Get the rot and trans values, their derivative,
-        # as well as acompcor and cosine
-        rot_values = confoundtsv[["rot_x", "rot_y", "rot_z"]]
-        trans_values = confoundtsv[["trans_x", "trans_y", "trans_z"]]
-        motion = pd.concat([rot_values, trans_values], axis=1)
-        derivative_rot_trans = pd.concat([motion, derivative(motion)], axis=1)
-        acompcor = load_acompcor(confounds_df=confoundtsv, confoundjs=confoundjson)
-        cosine = load_cosine(confoundtsv)
-        confound = pd.concat([derivative_rot_trans, acompcor, cosine], axis=1)
-    elif params == "aroma":  # Get the WM, CSF, and aroma values
-        whitematter_csf = load_wm_csf(confoundtsv)
-        aroma = load_aroma(datafile=original_file)
-        confound = pd.concat([whitematter_csf, aroma], axis=1)
-    elif (
-        params == "aroma_gsr"
-    ):  # Get the WM, CSF, and aroma values, as well as global signal
-        whitematter_csf = load_wm_csf(confoundtsv)
+        confounds_df = load_confounds_table(confound_tsv, columns=required_columns)
+        for source, columns in source_columns.items():
+            source_data[source] = (columns, confounds_df[columns].to_numpy())
+
+    if "aroma" in sources:
         aroma = load_aroma(datafile=original_file)
-        global_signal = load_global_signal(confoundtsv)
-        confound = pd.concat([whitematter_csf, aroma, global_signal], axis=1)
-    elif (
-        params == "acompcor_gsr"
-    ):  # Get the rot and trans values, as well as their derivative,
-        # acompcor and cosine values as well as global signal
-        rot_values = confoundtsv[["rot_x", "rot_y", "rot_z"]]
-        trans_values = confoundtsv[["trans_x", "trans_y", "trans_z"]]
-        motion = pd.concat([rot_values, trans_values], axis=1)
-        derivative_rot_trans = pd.concat([motion, derivative(motion)], axis=1)
-        acompcor = load_acompcor(confounds_df=confoundtsv, confoundjs=confoundjson)
-        global_signal = load_global_signal(confoundtsv)
-        cosine = load_cosine(confoundtsv)
-        confound = pd.concat(
-            [derivative_rot_trans, acompcor, global_signal, cosine], axis=1
+        source_data["aroma"] = (
+            [f"aroma_{column}" for column in aroma.columns],
+            aroma.to_numpy(dtype=np.float64),
         )
-    elif params == "custom":
-        # For custom confounds with no other confounds
-        confound = pd.read_table(custom_confounds, sep="\t", header=None)
-    if params != "custom":  # For both custom and fMRIPrep confounds
-        if custom_confounds is not None:
-            custom = pd.read_table(custom_confounds, sep="\t", header=None)
-            confound = pd.concat([confound, custom], axis=1)
+
+    if custom_confounds is not None:
+        custom = pd.read_table(custom_confounds, sep="\t", header=None).to_numpy(np.float64)
+
+    # Count the expanded columns, so the design can be preallocated
+    n_columns = 0
+    for term in terms:
+        n_base = sum(len(source_data[source][0]) for source in term.sources)
+        n_columns += n_base * (1 + term.derivative) * (1 + term.square)
+
+    if custom_confounds is not None:
+        n_columns += custom.shape[1]
+
+    if terms:
+        n_volumes = source_data[terms[0].sources[0]][1].shape[0]
+    elif custom_confounds is not None:
+        n_volumes = custom.shape[0]
+    else:
+        raise ValueError("The 'custom' confound model requires custom confounds.")
+
+    design = np.empty((n_volumes, n_columns), dtype=np.float64)
+    names = []
+    i_column = 0
+    for term in terms:
+        base_names = [name for source in term.sources for name in source_data[source][0]]
+        n_base = len(base_names)
+        start = i_column
+        for source in term.sources:
+            data = source_data[source][1]
+            design[:, i_column:i_column + data.shape[1]] = data
+            i_column += data.shape[1]
+
+        names += base_names
+        if term.derivative:
+            # backward differences, with a zero for the first volume
+            base = design[:, start:start + n_base]
+            design[:, i_column:i_column + n_base] = np.diff(base, axis=0, prepend=base[:1])
+            names += [f"{name}_derivative1" for name in base_names]
+            i_column += n_base
+
+        if term.square:
+            n_expanded = i_column - start
+            np.square(design[:, start:i_column], out=design[:, i_column:i_column + n_expanded])
+            names += [f"{name}_power2" for name in names[-n_expanded:]]
+            i_column += n_expanded
+
+    if custom_confounds is not None:
+        design[:, i_column:] = custom
+        names += [f"custom_{i_custom}" for i_custom in range(custom.shape[1])]
+
+    confound = pd.DataFrame(design, columns=names, copy=False)
 
     return confound
 
@@ -451,7 +726,7 @@ def load_aroma(datafile):
         aroma_noise,
         delimiter=",",
     )
-    aroma_noise = [np.int(i) - 1 for i in aroma_noise]  # change to 0-based index
+    aroma_noise = [int(i) - 1 for i in aroma_noise]  # change to 0-based index
 
     # Load in meloditc_ts
     melodic = pd.read_csv(melodic_ts, header=None, delimiter="\t", encoding="utf-8")
@@ -501,15 +776,6 @@ def motion_regression_filter(
     """
     assert motion_filter_type in ("lp", "notch")
 
-    # casting all variables
-    TR = float(TR)
-    order = float(motion_filter_order)
-
-    filtered_data = data.copy()
-
-    sampling_frequency = 1.0 / TR
-    nyquist_frequency = sampling_frequency / 2.0
-
     if motion_filter_type == "lp":  # low-pass filter
         # Remove any frequencies above band_stop_min.
         assert band_stop_min is not None
@@ -517,20 +783,6 @@ def motion_regression_filter(
         if band_stop_max:
             warnings.warn("The parameter 'band_stop_max' will be ignored.")
 
-        low_pass_freq_hertz = band_stop_min / 60  # change BPM to right time unit
-
-        # cutting frequency
-        cutting_frequency = np.abs(
-            low_pass_freq_hertz
-            - (np.floor((low_pass_freq_hertz + nyquist_frequency) / sampling_frequency))
-            * sampling_frequency
-        )
-        # cutting frequency normalized between 0 and nyquist
-        Wn = np.amin(cutting_frequency) / nyquist_frequency  # cutoffs
-        filt_num = firwin(int(order) + 1, Wn, pass_zero="lowpass")  # create b_filt
-        filt_denom = 1.0
-        num_f_apply = 1  # num of times to apply
-
     elif motion_filter_type == "notch":  # notch filter
         # Retain any frequencies *outside* the band_stop_min-band_stop_max range.
         assert band_stop_max is not None
@@ -539,26 +791,18 @@ def motion_regression_filter(
         assert band_stop_min > 0
         assert band_stop_min < band_stop_max
 
-        # bandwidth as an array
-        bandstop_band = np.array([band_stop_min, band_stop_max])
-        bandstop_band_hz = bandstop_band / 60  # change BPM to Hertz
-        cutting_frequencies = np.abs(
-            bandstop_band_hz
-            - (np.floor((bandstop_band_hz + nyquist_frequency) / sampling_frequency))
-            * sampling_frequency
-        )
+    # get filter coefficients from the process-wide registry
+    design = get_motion_filter_design(
+        TR=TR,
+        motion_filter_type=motion_filter_type,
+        band_stop_min=band_stop_min,
+        band_stop_max=band_stop_max,
+        motion_filter_order=motion_filter_order,
+    )
+    filtered_data = data.copy()
 
-        # normalize cutting frequency
-        W_notch = cutting_frequencies / nyquist_frequency
-        Wn = np.mean(W_notch)
-        Wd = np.diff(W_notch)
-        bandwidth = np.abs(Wd)  # bandwidth
-        # create filter coefficients
-        filt_num, filt_denom = iirnotch(Wn, Wn / bandwidth)
-        num_f_apply = np.int(np.floor(order / 2))  # how many times to apply filter
-
-    for i_iter in range(num_f_apply):
-        for j_row in range(data.shape[0]):  # apply filters across columns
-            filtered_data[j_row, :] = filtfilt(filt_num, filt_denom, filtered_data[j_row, :])
+    # filter all motion parameters along the time axis at once
+    for i_iter in range(design.n_apply):
+        filtered_data = filtfilt(design.b, design.a, filtered_data, axis=-1)
 
     return filtered_data
@@ -125,6 +125,59 @@ bpf_order : :obj:`int`
     This parameter is used in conjunction with ``lower_bpf`` and ``upper_bpf``.
 """
 
+docdict["filter_engine"] = """
+filter_engine : {"filtfilt", "fft"}
+    How the bandpass filter is applied.
+    If "filtfilt", the Butterworth filter is run forward and backward over each time series.
+    If "fft", the Fourier transform of all time series is multiplied by a precomputed
+    zero-phase frequency response (see ``fft_response``) and inverted.
+    Default is "filtfilt".
+"""
+
+docdict["fft_response"] = """
+fft_response : {"butterworth", "ideal"}
+    Frequency response used when ``filter_engine`` is "fft".
+    If "butterworth", the squared magnitude response of the Butterworth filter defined by
+    ``lower_bpf``, ``upper_bpf``, and ``bpf_order`` is used, so ``bpf_order`` controls
+    the roll-off.
+    If "ideal", a rectangular mask retaining only the ``lower_bpf``-``upper_bpf`` band is used.
+    Default is "butterworth".
+"""
+
+docdict["stack_atlases"] = """
+stack_atlases : :obj:`bool`
+    If True, the NIfTI atlases are stacked into one 4D label image per voxel grid,
+    which is warped to the BOLD data with a single ANTs call (using "GenericLabel"
+    interpolation), and split back into one file per atlas.
+    The warped stacks are not kept in the warp cache.
+    If False, each atlas is warped separately, with "MultiLabel" interpolation.
+    Default is False.
+"""
+
+docdict["work_format"] = """
+work_format : {"nii.gz", "nii"}
+    File format of the NIfTI intermediates written in the working directory.
+    Uncompressed ("nii") intermediates are memory-mapped instead of decompressed
+    on every read. CIFTI intermediates are never compressed.
+    Default is "nii.gz".
+"""
+
+docdict["precision"] = """
+precision : {"float64", "float32"}
+    Floating-point precision of the BOLD data held in memory.
+    Single precision ("float32") halves the memory used by the BOLD arrays.
+    Default is "float64".
+"""
+
+docdict["interpolation"] = """
+interpolation : {"linear", "spectral"}
+    How volumes censored for high motion are interpolated after nuisance regression.
+    If "linear", censored volumes are linearly interpolated from the nearest retained volumes.
+    If "spectral", censored volumes are replaced with a Lomb-Scargle reconstruction of the
+    retained volumes :footcite:p:`power_fd_dvars`.
+    Default is "linear".
+"""
+
 docdict["motion_filter_type"] = """
 motion_filter_type : {None, "lp", "notch"}
     Type of band-stop filter to use for removing respiratory artifact from motion regressors.
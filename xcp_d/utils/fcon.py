@@ -1,58 +1,346 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
-"""Functions for calculating functional connectivity in NIFTI files."""
+"""Functions for calculating functional connectivity in NIFTI and CIFTI files."""
+import os
+
 import nibabel as nb
 import numpy as np
-from nilearn.input_data import NiftiLabelsMasker
-from scipy import signal
+from scipy import fft, sparse
 from scipy.stats import rankdata
 from templateflow.api import get as get_template
 
+from xcp_d.utils.cache import (
+    atomic_write,
+    cache_key,
+    file_signature,
+    get_cache_dir,
+    write_json,
+)
+from xcp_d.utils.filter_design import get_frequency_bins
+from xcp_d.utils.utils import get_float_dtype
+
 
-def extract_timeseries_funct(in_file, atlas, timeseries, fconmatrix):
-    """Use Nilearn NiftiLabelsMasker to extract timeseries.
+def extract_timeseries_funct(in_file, atlases, timeseries, fconmatrices):
+    """Extract parcel time series and correlation matrices for several atlases at once.
+
+    The BOLD file is read once, and the mean time series of every parcel of every atlas
+    are computed with a single sparse matrix product
+    (see :func:`build_parcellation_operator`).
+    The results match those of *Nilearn's* ``NiftiLabelsMasker``.
+    Atlases that are not on the same grid as the BOLD data are resampled to it
+    with nearest-neighbor interpolation, as the masker does.
 
     Parameters
     ----------
     in_file : str
         bold file timeseries
-    atlas : str
-        atlas in the same space with bold
-    timeseries : str
-        extracted timeseries filename
-    fconmatrix : str
-        functional connectivity matrix filename
+    atlases : list of str
+        atlases in the same space with bold
+    timeseries : list of str
+        extracted timeseries filenames, one for each atlas
+    fconmatrices : list of str
+        functional connectivity matrix filenames, one for each atlas
+
+    Returns
+    -------
+    timeseries : list of str
+        extracted timeseries filenames
+    fconmatrices : list of str
+        functional connectivity matrix filenames
+    """
+    from nilearn.image import resample_img
+
+    bold_img = nb.load(in_file, mmap=True)
+    grid_shape, grid_affine = bold_img.shape[:3], bold_img.affine
+
+    atlas_arrays = []
+    for atlas in atlases:
+        atlas_img = nb.load(atlas)
+        if atlas_img.shape[:3] != grid_shape or not np.allclose(atlas_img.affine, grid_affine):
+            atlas_img = resample_img(
+                atlas_img,
+                target_affine=grid_affine,
+                target_shape=grid_shape,
+                interpolation="nearest",
+            )
+        atlas_arrays.append(np.asanyarray(atlas_img.dataobj).reshape(grid_shape))
+
+    operator, voxel_index, n_parcels = build_parcellation_operator(atlas_arrays)
+
+    # only the voxels in at least one parcel are read
+    voxel_data = np.asanyarray(bold_img.dataobj)[np.unravel_index(voxel_index, grid_shape)]
+    parcel_data = operator @ voxel_data
+
+    start = 0
+    for i_atlas, n_atlas_parcels in enumerate(n_parcels):
+        # Use numpy for correlation matrix
+        time_series = parcel_data[start:start + n_atlas_parcels, :].T
+        correlation_matrices = np.corrcoef(time_series.T)
+        start += n_atlas_parcels
+
+        np.savetxt(fconmatrices[i_atlas], correlation_matrices, delimiter="\t")
+        np.savetxt(timeseries[i_atlas], time_series, delimiter="\t")
+
+    return timeseries, fconmatrices
+
+
+def build_parcellation_operator(atlas_arrays):
+    """Build a sparse operator that averages voxels within the parcels of several atlases.
+
+    Parameters
+    ----------
+    atlas_arrays : list of numpy.ndarray
+        Integer-valued label arrays, all with the same shape.
+        Zero is the background.
+
+    Returns
+    -------
+    operator : scipy.sparse.csr_matrix of shape (P, V)
+        Averaging weights of the P parcels, stacked across atlases,
+        over the V voxels that belong to at least one parcel.
+        Within each atlas, parcels are ordered by label value.
+    voxel_index : numpy.ndarray of shape (V,)
+        Flat (C-order) indices of the voxels that make up the columns of ``operator``.
+    n_parcels : list of int
+        Number of parcels (rows of ``operator``) in each atlas.
+    """
+    in_any_parcel = np.zeros(atlas_arrays[0].shape, dtype=bool)
+    for atlas_array in atlas_arrays:
+        in_any_parcel |= atlas_array != 0
+
+    voxel_index = np.flatnonzero(in_any_parcel)
+
+    rows, cols, weights, n_parcels = [], [], [], []
+    for atlas_array in atlas_arrays:
+        voxel_labels = atlas_array.ravel()[voxel_index]
+        parcel_voxels = np.flatnonzero(voxel_labels)
+        _, parcel_idx, parcel_sizes = np.unique(
+            voxel_labels[parcel_voxels],
+            return_inverse=True,
+            return_counts=True,
+        )
+        rows.append(parcel_idx.ravel() + sum(n_parcels))
+        cols.append(parcel_voxels)
+        weights.append(1 / parcel_sizes[parcel_idx.ravel()])
+        n_parcels.append(parcel_sizes.size)
+
+    operator = sparse.csr_matrix(
+        (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(sum(n_parcels), voxel_index.size),
+    )
+    return operator, voxel_index, n_parcels
+
+
+def extract_timeseries_cifti(in_file, atlases, timeseries, correlations, dtype=None):
+    """Parcellate a dense CIFTI time series and correlate the parcels, for several atlases.
+
+    The dense time series are read once, and the mean time series of every parcel of
+    every atlas are computed with a single sparse matrix product
+    (see :func:`get_cifti_parcellation_operator`), as ``wb_command -cifti-parcellate``
+    does with the default MEAN method.
+    The parcel-to-parcel Pearson correlations match ``wb_command -cifti-correlation``.
+
+    Parameters
+    ----------
+    in_file : str
+        Dense time series (``.dtseries.nii``) file.
+    atlases : list of str
+        Dense label (``.dlabel.nii``) files, in the same space as the time series.
+    timeseries : list of str
+        Parcellated time series (``.ptseries.nii``) filenames, one for each atlas.
+    correlations : list of str
+        Parcellated connectivity (``.pconn.nii``) filenames, one for each atlas.
+    dtype : numpy dtype or None, optional
+        Floating-point type in which the dense time series are read.
+        If None (default), float64 is used.
 
     Returns
     -------
-    timeseries : str
-        extracted timeseries filename
-    fconmatrix : str
-        functional connectivity matrix filename
+    timeseries : list of str
+        Parcellated time series filenames.
+    correlations : list of str
+        Parcellated connectivity filenames.
     """
-    masker = NiftiLabelsMasker(labels_img=atlas,
-                               smoothing_fwhm=None,
-                               standardize=False)
-    # Use nilearn for time_series
-    time_series = masker.fit_transform(in_file)
-    # Use numpy for correlation matrix
-    correlation_matrices = np.corrcoef(time_series.T)
+    from xcp_d.utils.write_save import read_ndata
+
+    dense_img = nb.load(in_file)
+    series_axis, brain_model_axis = (dense_img.header.get_axis(i) for i in range(2))
+
+    operators, parcel_names = [], []
+    for atlas in atlases:
+        operator, atlas_parcel_names = get_cifti_parcellation_operator(atlas, brain_model_axis)
+        operators.append(operator)
+        parcel_names.append(atlas_parcel_names)
+
+    # vertices/voxels by timepoints
+    dense_data = read_ndata(in_file, dtype=dtype)
+    parcel_data = sparse.vstack(operators, format="csr") @ dense_data
+
+    start = 0
+    for i_atlas, operator in enumerate(operators):
+        parcels_axis = _get_parcels_axis(operator, parcel_names[i_atlas], brain_model_axis)
+        time_series = parcel_data[start:start + operator.shape[0], :]
+        start += operator.shape[0]
+
+        ptseries_img = nb.Cifti2Image(
+            time_series.T.astype(np.float32),
+            nb.cifti2.Cifti2Header.from_axes((series_axis, parcels_axis)),
+        )
+        ptseries_img.nifti_header.set_intent("ConnParcelSries")
+        ptseries_img.to_filename(timeseries[i_atlas])
 
-    np.savetxt(fconmatrix, correlation_matrices, delimiter="\t")
-    np.savetxt(timeseries, time_series, delimiter="\t")
+        pconn_img = nb.Cifti2Image(
+            np.corrcoef(time_series).astype(np.float32),
+            nb.cifti2.Cifti2Header.from_axes((parcels_axis, parcels_axis)),
+        )
+        pconn_img.nifti_header.set_intent("ConnParcels")
+        pconn_img.to_filename(correlations[i_atlas])
+
+    return timeseries, correlations
+
+
+def get_cifti_parcellation_operator(atlas_file, brain_model_axis):
+    """Get a sparse operator that averages grayordinates within the parcels of a CIFTI atlas.
+
+    The atlas's grayordinates are matched to those of ``brain_model_axis`` by structure,
+    and by vertex (for surfaces) or voxel (for volumes).
+    Parcels are ordered by label key, and only labels that cover at least one
+    grayordinate are kept. The "???" label (key 0) is the background.
+
+    The operator is cached on disk per atlas file and brain-model axis,
+    so it is only built once.
+
+    Parameters
+    ----------
+    atlas_file : str
+        Dense label (``.dlabel.nii``) file.
+    brain_model_axis : nibabel.cifti2.BrainModelAxis
+        The grayordinates of the dense data.
+
+    Returns
+    -------
+    operator : scipy.sparse.csr_matrix of shape (P, G)
+        Averaging weights of the P parcels over the G grayordinates.
+    parcel_names : list of str
+        The label name of each parcel.
+    """
+    import hashlib
+    import json
 
-    return timeseries, fconmatrix
+    axis_hash = hashlib.sha1()
+    for array in (
+        brain_model_axis.name.astype(str),
+        brain_model_axis.vertex,
+        brain_model_axis.voxel,
+    ):
+        axis_hash.update(np.ascontiguousarray(array).tobytes())
 
+    cache_file = os.path.join(
+        get_cache_dir("cifti_parcellation"),
+        f"{cache_key(file_signature(atlas_file), axis_hash.hexdigest())}.npz",
+    )
+    names_file = cache_file.replace(".npz", ".json")
 
-def compute_2d_reho(datat, adjacency_matrix):
+    # the names are written last, so they mark a complete entry
+    if os.path.isfile(names_file):
+        with open(names_file) as fo:
+            parcel_names = json.load(fo)
+
+        return sparse.load_npz(cache_file), parcel_names
+
+    atlas_img = nb.load(atlas_file)
+    label_axis, atlas_axis = (atlas_img.header.get_axis(i) for i in range(2))
+    atlas_labels = np.asanyarray(atlas_img.dataobj)[0].astype(np.int64)
+    atlas_structures = {
+        name: (atlas_slice, atlas_models)
+        for name, atlas_slice, atlas_models in atlas_axis.iter_structures()
+    }
+
+    dense_labels = np.zeros(len(brain_model_axis), dtype=np.int64)
+    for name, dense_slice, dense_models in brain_model_axis.iter_structures():
+        if name not in atlas_structures:
+            continue
+
+        atlas_slice, atlas_models = atlas_structures[name]
+        if dense_models.surface_mask.all():
+            lookup = np.zeros(atlas_models.nvertices[name], dtype=np.int64)
+            lookup[atlas_models.vertex] = atlas_labels[atlas_slice]
+            dense_labels[dense_slice] = lookup[dense_models.vertex]
+        else:
+            if atlas_models.volume_shape != dense_models.volume_shape or not np.allclose(
+                atlas_models.affine, dense_models.affine
+            ):
+                raise ValueError(
+                    f"The volume of {name} in {atlas_file} is not on the same grid "
+                    "as the data."
+                )
+            lookup = np.zeros(atlas_models.volume_shape, dtype=np.int64)
+            lookup[tuple(atlas_models.voxel.T)] = atlas_labels[atlas_slice]
+            dense_labels[dense_slice] = lookup[tuple(dense_models.voxel.T)]
+
+    parcel_grayordinates = np.flatnonzero(dense_labels)
+    label_keys, parcel_idx, parcel_sizes = np.unique(
+        dense_labels[parcel_grayordinates],
+        return_inverse=True,
+        return_counts=True,
+    )
+    parcel_idx = parcel_idx.ravel()
+    operator = sparse.csr_matrix(
+        (1 / parcel_sizes[parcel_idx], (parcel_idx, parcel_grayordinates)),
+        shape=(label_keys.size, len(brain_model_axis)),
+    )
+    label_table = label_axis.label[0]
+    parcel_names = [
+        label_table[key][0] if key in label_table else f"label_{key}" for key in label_keys
+    ]
+
+    atomic_write(cache_file, lambda filename: sparse.save_npz(filename, operator))
+    atomic_write(names_file, lambda filename: write_json(filename, parcel_names))
+
+    return operator, parcel_names
+
+
+def _get_parcels_axis(operator, parcel_names, brain_model_axis):
+    """Build the parcels axis of a parcellation, from its operator."""
+    operator = operator.tocsr()
+    surface_mask = brain_model_axis.surface_mask
+    voxels, vertices = [], []
+    for i_parcel in range(len(parcel_names)):
+        grayordinates = operator.indices[operator.indptr[i_parcel]:operator.indptr[i_parcel + 1]]
+        voxels.append(brain_model_axis.voxel[grayordinates[~surface_mask[grayordinates]]])
+
+        surface_grayordinates = grayordinates[surface_mask[grayordinates]]
+        structures = brain_model_axis.name[surface_grayordinates]
+        vertices.append({
+            structure: brain_model_axis.vertex[surface_grayordinates[structures == structure]]
+            for structure in np.unique(structures)
+        })
+
+    return nb.cifti2.ParcelsAxis(
+        name=parcel_names,
+        voxels=voxels,
+        vertices=vertices,
+        affine=brain_model_axis.affine,
+        volume_shape=brain_model_axis.volume_shape,
+        nvertices=brain_model_axis.nvertices,
+    )
+
+
+def compute_2d_reho(datat, adjacency_matrix, block_size=5000):
     """Calculate ReHo on 2D data.
 
+    Each vertex's time series is ranked once, the rank sums of every neighborhood are
+    computed with a single sparse matrix product, and Kendall's W is evaluated for all
+    vertices at the same time.
+
     Parameters
     ----------
     datat : numpy.ndarray of shape (V, T)
         data matrix in vertices by timepoints
-    adjacency_matrix : numpy.ndarray of shape (V, V)
-        surface adjacency matrix
+    adjacency_matrix : scipy.sparse.csr_matrix of shape (V, V)
+        binary surface adjacency matrix, without self-connections
+    block_size : int, optional
+        Number of neighborhoods to evaluate at a time. Default is 5000.
 
     Returns
     -------
@@ -63,44 +351,138 @@ def compute_2d_reho(datat, adjacency_matrix):
     -----
     From https://www.sciencedirect.com/science/article/pii/S0165178119305384#bib0045.
     """
-    KCC = np.zeros(datat.shape[0])  # a zero for each voxel
-
-    for i in range(datat.shape[0]):  # loop through each voxel
-        neigbor_index = np.where(adjacency_matrix[i, :] > 0)[0]  # the index of 4 neightbouts
-        nn = np.hstack((neigbor_index, np.array(i)))  # stack those indexes with voxel number
-        neidata = datat[nn, :]  # pull out data for relevant voxels
+    n_vertices, n_timepoints = datat.shape
+    # assign ranks to timepoints for each vertex, once
+    rankeddata = rankdata(datat, axis=1)
 
-        rankeddata = np.zeros_like(neidata)  # TODO: Fix typos #create 0s in same shape
-        # pull out index of voxel, timepoint
-        neigbor, timepoint = neidata.shape[0], neidata.shape[1]
+    # each neighborhood is a vertex and its neighbours
+    neighborhoods = sparse.csr_matrix(adjacency_matrix, dtype=np.float64)
+    neighborhoods.data[:] = 1
+    neighborhoods = neighborhoods + sparse.identity(n_vertices, format="csr")
+    n_neighbors = np.asarray(neighborhoods.sum(axis=1)).ravel()
 
-        for j in range(neidata.shape[0]):  # loop through each neighbour
-            rankeddata[j, :] = rankdata(neidata[j, ])  # assign ranks to timepoints for each voxel
-        rankmean = np.sum(rankeddata, axis=0)  # add up ranks
+    KCC = np.zeros(n_vertices)  # a zero for each vertex
+    for start in range(0, n_vertices, block_size):
+        stop = min(start + block_size, n_vertices)
+        rankmean = neighborhoods[start:stop] @ rankeddata  # add up ranks
         # KC is the sum of the squared rankmean minus the timepoints into
         # the mean of the rankmean squared
-        KC = np.sum(np.power(rankmean, 2)) - \
-            timepoint * np.power(np.mean(rankmean), 2)
+        KC = np.sum(rankmean ** 2, axis=1) - n_timepoints * np.mean(rankmean, axis=1) ** 2
         # square number of neighbours, multiply by (cubed timepoint - timepoint)
-        denom = np.power(neigbor, 2) * (np.power(timepoint, 3) - timepoint)
-        # the voxel value is 12*KC divided by denom
-        KCC[i] = 12 * KC / (denom)
+        denom = n_neighbors[start:stop] ** 2 * (n_timepoints ** 3 - n_timepoints)
+        # the vertex value is 12*KC divided by denom
+        KCC[start:stop] = 12 * KC / denom
 
     return KCC
 
 
-def mesh_adjacency(hemi):
+def faces_to_adjacency(faces, n_vertices):
+    """Build a sparse vertex adjacency matrix from the triangles of a mesh.
+
+    Parameters
+    ----------
+    faces : numpy.ndarray of shape (F, 3)
+        Vertex indices of each triangle.
+    n_vertices : int
+        Number of vertices in the mesh.
+
+    Returns
+    -------
+    adjacency_matrix : scipy.sparse.csr_matrix of shape (V, V)
+        Binary, symmetric adjacency matrix, with ones for every pair of vertices that
+        share an edge. The diagonal is zero.
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    # the three edges of each triangle, in both directions
+    edges = np.vstack((faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]))
+    rows = np.concatenate((edges[:, 0], edges[:, 1]))
+    cols = np.concatenate((edges[:, 1], edges[:, 0]))
+    adjacency_matrix = sparse.csr_matrix(
+        (np.ones(rows.size, dtype=np.uint8), (rows, cols)),
+        shape=(n_vertices, n_vertices),
+    )
+    # edges shared by two triangles are summed when the matrix is built
+    adjacency_matrix.data[:] = 1
+
+    return adjacency_matrix
+
+
+def volume_adjacency(mask, neighborhood="vertices"):
+    """Build a sparse adjacency matrix between the voxels in a brain mask.
+
+    The offsets of the neighborhood are applied to every in-mask voxel at once,
+    so the index table is built once per mask instead of once per voxel.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray of shape (X, Y, Z)
+        Binary brain mask.
+    neighborhood : {"faces", "edges", "vertices"}, optional
+        Voxels that share a face (7-voxel neighborhood), at least an edge
+        (19-voxel neighborhood), or at least a vertex (27-voxel neighborhood)
+        with the central voxel. Default is "vertices".
+
+    Returns
+    -------
+    adjacency_matrix : scipy.sparse.csr_matrix of shape (V, V)
+        Binary, symmetric adjacency matrix between the V in-mask voxels,
+        in the order returned by :func:`nilearn.masking.apply_mask`.
+        The diagonal is zero.
+    """
+    max_distances = {"faces": 1, "edges": 2, "vertices": 3}
+    if neighborhood not in max_distances:
+        raise ValueError(f"Unknown neighborhood: {neighborhood}")
+
+    mask = np.asarray(mask) > 0
+    coords = np.column_stack(np.nonzero(mask))
+    n_voxels = coords.shape[0]
+
+    # volume of voxel indices, with -1 outside the mask
+    index_volume = np.full(mask.shape, -1, dtype=np.int64)
+    index_volume[mask] = np.arange(n_voxels)
+
+    offsets = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij"), -1)
+    offsets = offsets.reshape(-1, 3)
+    n_shifted = np.abs(offsets).sum(axis=1)
+    offsets = offsets[(n_shifted > 0) & (n_shifted <= max_distances[neighborhood])]
+
+    rows, cols = [], []
+    for offset in offsets:
+        neighbor_coords = coords + offset
+        in_bounds = np.all((neighbor_coords >= 0) & (neighbor_coords < mask.shape), axis=1)
+        neighbors = np.full(n_voxels, -1, dtype=np.int64)
+        neighbors[in_bounds] = index_volume[tuple(neighbor_coords[in_bounds].T)]
+        in_mask = neighbors >= 0
+        rows.append(np.flatnonzero(in_mask))
+        cols.append(neighbors[in_mask])
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    adjacency_matrix = sparse.csr_matrix(
+        (np.ones(rows.size, dtype=np.uint8), (rows, cols)),
+        shape=(n_voxels, n_voxels),
+    )
+
+    return adjacency_matrix
+
+
+def mesh_adjacency(hemi, density="32k"):
     """Calculate adjacency matrix from mesh timeseries.
 
+    The sparse matrix is cached on disk per template, hemisphere, and density,
+    so it is only built once.
+
     Parameters
     ----------
     hemi : {"L", "R"}
         Surface sphere to be load from templateflow
         Either left or right hemisphere
+    density : str, optional
+        Density of the fsLR mesh. Default is "32k".
 
     Returns
     -------
-    numpy.ndarray
+    scipy.sparse.csr_matrix
         Adjacency matrix.
     """
     surf = str(
@@ -108,29 +490,33 @@ def mesh_adjacency(hemi):
                      space='fsaverage',
                      hemi=hemi,
                      suffix='sphere',
-                     density='32k'))  # Get relevant template
+                     density=density))  # Get relevant template
+
+    # the file signature protects against an updated template, and the "edges" tag
+    # against matrices cached before every edge of every triangle was included
+    key = cache_key(file_signature(surf), "edges")[:12]
+    cache_file = os.path.join(
+        get_cache_dir("adjacency"),
+        f"tpl-fsLR_hemi-{hemi}_den-{density}_{key}.npz",
+    )
+    if os.path.isfile(cache_file):
+        return sparse.load_npz(cache_file)
 
-    surf = nb.load(surf)  # load via nibabel
     #  Aggregate GIFTI data arrays into an ndarray or tuple of ndarray
     # select the arrays in a specific order
-    vertices_faces = surf.agg_data(('pointset', 'triangle'))
-    vertices = vertices_faces[0]  # the first array of the tuple
-    faces = vertices_faces[1]  # the second array in the tuples
-    # create an array of 0s = voxel*voxel
-    data_array = np.zeros([len(vertices), len(vertices)], dtype=np.uint8)
+    vertices, faces = nb.load(surf).agg_data(('pointset', 'triangle'))
+    adjacency_matrix = faces_to_adjacency(faces, n_vertices=vertices.shape[0])
+    atomic_write(cache_file, lambda filename: sparse.save_npz(filename, adjacency_matrix))
 
-    for i in range(1, len(faces)):  # looping thorugh each value in faces
-        data_array[faces[i, 0], faces[i, 2]] = 1  # use to index into data_array and
-        # turn select values to 1
-        data_array[faces[i, 1], faces[i, 1]] = 1
-        data_array[faces[i, 2], faces[i, 0]] = 1
+    return adjacency_matrix
 
-    return data_array + data_array.T  # transpose data_array and add it to itself
 
-
-def compute_alff(data_matrix, low_pass, high_pass, TR):
+def compute_alff(data_matrix, low_pass, high_pass, TR, block_size=5000, dtype=None):
     """Compute amplitude of low-frequency fluctuation (ALFF).
 
+    The amplitude spectrum is computed with one real FFT per block of voxels/vertices,
+    and the band limits are looked up once for all of them.
+
     Parameters
     ----------
     data_matrix : numpy.ndarray
@@ -141,6 +527,12 @@ def compute_alff(data_matrix, low_pass, high_pass, TR):
         high pass frequency in Hz
     TR : float
         repetition time in seconds
+    block_size : int, optional
+        Number of voxels/vertices to transform at a time. Default is 5000.
+    dtype : numpy dtype or None, optional
+        Data type used for the FFT and the returned ALFF values.
+        Use ``np.float32`` to halve the memory footprint.
+        If None (default), the floating-point type of ``data_matrix`` is used.
 
     Returns
     -------
@@ -150,26 +542,38 @@ def compute_alff(data_matrix, low_pass, high_pass, TR):
     Notes
     -----
     Implementation based on https://pubmed.ncbi.nlm.nih.gov/16919409/.
+
+    The values match those from a voxel-wise :func:`scipy.signal.periodogram`
+    with ``scaling='spectrum'``.
     """
-    fs = 1 / TR  # sampling frequency
-    alff = np.zeros(data_matrix.shape[0])  # Create a matrix of zeros in the shape of
-    # number of voxels
-    for ii in range(data_matrix.shape[0]):  # Loop through the voxels
-        # get array of sample frequencies + power spectrum density
-        array_of_sample_frequencies, power_spec_density = signal.periodogram(data_matrix[ii, :],
-                                                                             fs,
-                                                                             scaling='spectrum')
-        # square root of power spectrum density
-        power_spec_density_sqrt = np.sqrt(power_spec_density)
-        # get the position of the arguments closest to high_pass and low_pass, respectively
-        ff_alff = [
-            np.argmin(np.abs(array_of_sample_frequencies - high_pass)),
-            np.argmin(np.abs(array_of_sample_frequencies - low_pass))
-        ]
-        # alff for that voxel is 2 * the mean of the sqrt of the power spec density
-        # from the value closest to the low pass cutoff, to the value closest
-        # to the high pass pass cutoff
-        alff[ii] = len(ff_alff) * np.mean(power_spec_density_sqrt[ff_alff[0]:ff_alff[1]])
-    # reshape alff so it's no longer 1 dimensional, but a #ofvoxels by 1 matrix
-    alff = np.reshape(alff, [len(alff), 1])
+    dtype = get_float_dtype(data_matrix) if dtype is None else dtype
+    n_voxels, n_timepoints = data_matrix.shape
+    # get the position of the frequencies closest to high_pass and low_pass, respectively.
+    # These only depend on the number of timepoints, so they are computed once.
+    frequency_bins = get_frequency_bins(
+        n_timepoints=n_timepoints,
+        TR=TR,
+        lowpass=low_pass,
+        highpass=high_pass,
+    )
+
+    # The square root of the one-sided power spectrum is the amplitude spectrum,
+    # scaled by sqrt(2) for every bin except DC and (for even lengths) the Nyquist bin.
+    amplitude_scale = np.full(frequency_bins.freqs.size, np.sqrt(2) / n_timepoints, dtype=dtype)
+    amplitude_scale[0] = 1 / n_timepoints
+    if n_timepoints % 2 == 0:
+        amplitude_scale[-1] = 1 / n_timepoints
+    band = slice(frequency_bins.start, frequency_bins.stop)
+
+    alff = np.empty((n_voxels, 1), dtype=dtype)
+    for start in range(0, n_voxels, block_size):
+        block = np.asarray(data_matrix[start:start + block_size, :], dtype=dtype)
+        # the periodogram removes the mean of each time series before the FFT
+        block = block - block.mean(axis=1, keepdims=True)
+        amplitude = np.abs(fft.rfft(block, axis=1)[:, band]) * amplitude_scale[band]
+        # alff for each voxel is 2 * the mean of the amplitude spectrum
+        # from the value closest to the high pass cutoff, to the value closest
+        # to the low pass cutoff
+        alff[start:start + block_size, 0] = 2 * np.mean(amplitude, axis=1)
+
     return alff
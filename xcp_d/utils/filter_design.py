@@ -0,0 +1,366 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""A process-wide registry of filter designs.
+
+Filter coefficients, padding lengths, and frequency-bin ranges only depend on the
+repetition time and the filter parameters, which are shared by every run in a dataset.
+The functions in this module compute each design once per process and return the cached
+result on later calls.
+Every design carries a stable parameter hash that can be logged to identify the filter.
+
+The caches are bounded and evict the least recently used designs.
+Because they are module-level, every MultiProc worker process builds its own cache
+the first time a design is requested.
+"""
+import hashlib
+import json
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import butter, firwin, iirnotch, tf2sos
+
+# Maximum number of designs kept in each cache.
+CACHE_SIZE = 64
+
+FilterDesign = namedtuple("FilterDesign", ["b", "a", "sos", "padlen", "n_apply", "param_hash"])
+FilterDesign.__doc__ = """A cached filter design.
+
+Attributes
+----------
+b, a : numpy.ndarray
+    Numerator and denominator coefficients of the filter.
+sos : numpy.ndarray
+    The same filter as second-order sections.
+padlen : int
+    Number of samples to pad each time series with when calling ``filtfilt``.
+n_apply : int
+    Number of times the filter should be applied.
+param_hash : str
+    Stable hash of the parameters that define the filter.
+"""
+
+FrequencyBins = namedtuple("FrequencyBins", ["freqs", "start", "stop", "param_hash"])
+FrequencyBins.__doc__ = """Cached frequency bins for a periodogram.
+
+Attributes
+----------
+freqs : numpy.ndarray
+    Frequencies of the periodogram bins, in Hertz.
+start, stop : int
+    Indices of the bins closest to the high-pass and low-pass cutoffs, respectively.
+param_hash : str
+    Stable hash of the parameters that define the bins.
+"""
+
+
+def parameter_hash(**params):
+    """Build a stable, short hash from a set of filter parameters.
+
+    Parameters
+    ----------
+    **params
+        Filter parameters. Values must be JSON-serializable.
+
+    Returns
+    -------
+    str
+        A 12-character hexadecimal hash.
+    """
+    serialized = json.dumps(params, sort_keys=True, default=float)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()[:12]
+
+
+def _read_only(*arrays):
+    """Mark cached arrays as read-only, so callers cannot modify the shared design."""
+    for array in arrays:
+        array.setflags(write=False)
+
+
+def get_bandpass_design(TR, lowpass, highpass, order=2):
+    """Get the Butterworth bandpass filter used for the BOLD data.
+
+    Parameters
+    ----------
+    TR : float
+        Repetition time of the data, in seconds.
+    lowpass : float
+        Low-pass cutoff, in Hertz.
+    highpass : float
+        High-pass cutoff, in Hertz.
+    order : int
+        The order of the filter. This will be divided by 2 when calling scipy.signal.butter.
+
+    Returns
+    -------
+    FilterDesign
+    """
+    return _get_bandpass_design(float(TR), float(lowpass), float(highpass), int(order))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _get_bandpass_design(TR, lowpass, highpass, order):
+    nyq = 0.5 / TR  # nyquist frequency
+
+    # normalize the cutoffs
+    lowcut = highpass / nyq
+    highcut = lowpass / nyq
+
+    b, a = butter(order / 2, [lowcut, highcut], btype="band")
+    sos = butter(order / 2, [lowcut, highcut], btype="band", output="sos")
+    padlen = 3 * (max(len(b), len(a)) - 1)
+    _read_only(b, a, sos)
+
+    param_hash = parameter_hash(
+        filter="bandpass",
+        TR=TR,
+        lowpass=lowpass,
+        highpass=highpass,
+        order=order,
+    )
+    return FilterDesign(b=b, a=a, sos=sos, padlen=padlen, n_apply=1, param_hash=param_hash)
+
+
+def get_motion_filter_design(
+    TR,
+    motion_filter_type,
+    band_stop_min,
+    band_stop_max,
+    motion_filter_order=4,
+):
+    """Get the low-pass or notch filter used for the motion parameters.
+
+    Parameters
+    ----------
+    TR : float
+        Repetition time of the data, in seconds.
+    motion_filter_type : {"lp", "notch"}
+        The type of motion filter.
+    band_stop_min : float or None
+        Lower frequency for the band-stop motion filter, in breaths-per-minute (bpm).
+    band_stop_max : float or None
+        Upper frequency for the band-stop motion filter, in breaths-per-minute (bpm).
+        Ignored for the "lp" filter.
+    motion_filter_order : int, optional
+        Default is 4.
+
+    Returns
+    -------
+    FilterDesign
+    """
+    if motion_filter_type == "lp":
+        band_stop_max = None
+
+    return _get_motion_filter_design(
+        float(TR),
+        motion_filter_type,
+        None if band_stop_min is None else float(band_stop_min),
+        None if band_stop_max is None else float(band_stop_max),
+        int(motion_filter_order),
+    )
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _get_motion_filter_design(TR, motion_filter_type, band_stop_min, band_stop_max, order):
+    sampling_frequency = 1.0 / TR
+    nyquist_frequency = sampling_frequency / 2.0
+
+    if motion_filter_type == "lp":  # low-pass filter
+        low_pass_freq_hertz = band_stop_min / 60  # change BPM to right time unit
+
+        # cutting frequency
+        cutting_frequency = np.abs(
+            low_pass_freq_hertz
+            - (np.floor((low_pass_freq_hertz + nyquist_frequency) / sampling_frequency))
+            * sampling_frequency
+        )
+        # cutting frequency normalized between 0 and nyquist
+        Wn = np.amin(cutting_frequency) / nyquist_frequency  # cutoffs
+        b = firwin(order + 1, Wn, pass_zero="lowpass")  # create b_filt
+        a = np.array([1.0])
+        n_apply = 1  # num of times to apply
+
+    elif motion_filter_type == "notch":  # notch filter
+        # bandwidth as an array
+        bandstop_band = np.array([band_stop_min, band_stop_max])
+        bandstop_band_hz = bandstop_band / 60  # change BPM to Hertz
+        cutting_frequencies = np.abs(
+            bandstop_band_hz
+            - (np.floor((bandstop_band_hz + nyquist_frequency) / sampling_frequency))
+            * sampling_frequency
+        )
+
+        # normalize cutting frequency
+        W_notch = cutting_frequencies / nyquist_frequency
+        Wn = np.mean(W_notch)
+        Wd = np.diff(W_notch)
+        bandwidth = np.abs(Wd[0])  # bandwidth
+        # create filter coefficients
+        b, a = iirnotch(Wn, Wn / bandwidth)
+        n_apply = int(np.floor(order / 2))  # how many times to apply filter
+
+    else:
+        raise ValueError(f"Unknown motion filter type: {motion_filter_type}")
+
+    sos = tf2sos(b, a)
+    # filtfilt's default padding
+    padlen = 3 * max(len(b), len(a))
+    _read_only(b, a, sos)
+
+    param_hash = parameter_hash(
+        filter=motion_filter_type,
+        TR=TR,
+        band_stop_min=band_stop_min,
+        band_stop_max=band_stop_max,
+        order=order,
+    )
+    return FilterDesign(b=b, a=a, sos=sos, padlen=padlen, n_apply=n_apply, param_hash=param_hash)
+
+
+def get_frequency_bins(n_timepoints, TR, lowpass, highpass):
+    """Get the periodogram frequencies and the bins closest to the cutoffs.
+
+    Parameters
+    ----------
+    n_timepoints : int
+        Number of timepoints in the data.
+    TR : float
+        Repetition time of the data, in seconds.
+    lowpass : float
+        Low-pass cutoff, in Hertz.
+    highpass : float
+        High-pass cutoff, in Hertz.
+
+    Returns
+    -------
+    FrequencyBins
+    """
+    return _get_frequency_bins(int(n_timepoints), float(TR), float(lowpass), float(highpass))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _get_frequency_bins(n_timepoints, TR, lowpass, highpass):
+    freqs = np.fft.rfftfreq(n_timepoints, d=TR)
+    start = int(np.argmin(np.abs(freqs - highpass)))
+    stop = int(np.argmin(np.abs(freqs - lowpass)))
+    _read_only(freqs)
+
+    param_hash = parameter_hash(
+        bins="periodogram",
+        n_timepoints=n_timepoints,
+        TR=TR,
+        lowpass=lowpass,
+        highpass=highpass,
+    )
+    return FrequencyBins(freqs=freqs, start=start, stop=stop, param_hash=param_hash)
+
+
+def bandpass_frequency_response(freqs, fs, lowpass, highpass, order=2, response="butterworth"):
+    """Build a zero-phase bandpass frequency response.
+
+    Parameters
+    ----------
+    freqs : numpy.ndarray
+        Frequencies, in Hertz, at which to evaluate the response.
+        Typically the output of :func:`numpy.fft.rfftfreq`.
+    fs : float
+        Sampling frequency. 1/TR(s).
+    lowpass : float
+        frequency
+    highpass : float
+        frequency
+    order : int
+        The order of the Butterworth filter whose magnitude response is emulated.
+        Higher orders produce a steeper roll-off.
+        Only used if ``response`` is "butterworth".
+    response : {"butterworth", "ideal"}
+        If "butterworth", the squared magnitude response of the digital Butterworth filter
+        designed by :func:`get_bandpass_design` is used, which is the response ``filtfilt``
+        applies to the data.
+        If "ideal", frequencies within the band are retained and all others are removed.
+
+    Returns
+    -------
+    frequency_response : numpy.ndarray
+        Real-valued gain at each frequency in ``freqs``.
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    if response == "ideal":
+        return ((freqs >= highpass) & (freqs <= lowpass)).astype(np.float64)
+    elif response != "butterworth":
+        raise ValueError(f"Unknown frequency response: {response}")
+
+    # Pre-warp the frequencies, as the bilinear transform in scipy.signal.butter does.
+    nyq = 0.5 * fs
+    warped_freqs = np.tan(np.pi * np.clip(freqs, 0, nyq) / fs)
+    warped_low = np.tan(np.pi * float(highpass) / fs)
+    warped_high = np.tan(np.pi * float(lowpass) / fs)
+    center2 = warped_low * warped_high
+    bandwidth = warped_high - warped_low
+
+    frequency_response = np.zeros_like(freqs)
+    nonzero = warped_freqs > 0
+    ratio = (warped_freqs[nonzero] ** 2 - center2) / (warped_freqs[nonzero] * bandwidth)
+    # butter is called with order / 2, and filtfilt squares the magnitude response.
+    frequency_response[nonzero] = 1 / (1 + ratio ** (2 * (order / 2)))
+
+    return frequency_response
+
+
+def get_bandpass_response(n_timepoints, TR, lowpass, highpass, order=2, response="butterworth"):
+    """Get the frequency response used by the FFT bandpass engine.
+
+    Parameters
+    ----------
+    n_timepoints : int
+        Number of timepoints in the data.
+    TR : float
+        Repetition time of the data, in seconds.
+    lowpass : float
+        Low-pass cutoff, in Hertz.
+    highpass : float
+        High-pass cutoff, in Hertz.
+    order : int
+        The order of the emulated Butterworth filter.
+    response : {"butterworth", "ideal"}
+        The frequency response to build. See :func:`bandpass_frequency_response`.
+
+    Returns
+    -------
+    frequency_response : numpy.ndarray
+        Read-only gain at each frequency of :func:`numpy.fft.rfftfreq`.
+    param_hash : str
+        Stable hash of the parameters that define the response.
+    """
+    return _get_bandpass_response(
+        int(n_timepoints),
+        float(TR),
+        float(lowpass),
+        float(highpass),
+        int(order),
+        response,
+    )
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _get_bandpass_response(n_timepoints, TR, lowpass, highpass, order, response):
+    frequency_response = bandpass_frequency_response(
+        np.fft.rfftfreq(n_timepoints, d=TR),
+        fs=1 / TR,
+        lowpass=lowpass,
+        highpass=highpass,
+        order=order,
+        response=response,
+    )
+    _read_only(frequency_response)
+
+    param_hash = parameter_hash(
+        filter="fft_bandpass",
+        n_timepoints=n_timepoints,
+        TR=TR,
+        lowpass=lowpass,
+        highpass=highpass,
+        order=order,
+        response=response,
+    )
+    return frequency_response, param_hash
@@ -58,14 +58,132 @@ def generate_mask(fd_res, fd_thresh):
     return tmask
 
 
-def interpolate_masked_data(bold_data, tmask, TR=1):
+def get_interpolation_weights(tmask):
+    """Compute linear interpolation weights for the flagged volumes in a temporal mask.
+
+    Flagged volumes are interpolated from the nearest unflagged volumes before and after them.
+    The last volume is always used as an anchor, so flagged volumes at the end of the run
+    are interpolated toward it.
+    Flagged volumes at the beginning of the run take the value of the first
+    anchor after them, since there is nothing to interpolate from.
+
+    Parameters
+    ----------
+    tmask : numpy.ndarray of shape (T)
+        A temporal mask in which ones indicate volumes to be flagged and interpolated across.
+
+    Returns
+    -------
+    flagged_idx : numpy.ndarray of shape (F)
+        Indices of the flagged volumes.
+    left_idx, right_idx : numpy.ndarray of shape (F)
+        Indices of the anchor volumes before and after each flagged volume.
+    right_weights : numpy.ndarray of shape (F)
+        Weight of the right anchor for each flagged volume.
+        The left anchor has a weight of ``1 - right_weights``.
+    """
+    tmask = np.asarray(tmask)
+    n_volumes = tmask.size
+    flagged_idx = np.flatnonzero(tmask == 1)
+    anchor_idx = np.union1d(np.flatnonzero(tmask == 0), [n_volumes - 1])
+
+    # position of the first anchor at or after each flagged volume
+    right_pos = np.searchsorted(anchor_idx, flagged_idx)
+    right_idx = anchor_idx[right_pos]
+    left_idx = anchor_idx[np.maximum(right_pos - 1, 0)]
+
+    # flagged volumes before the first anchor have no left anchor
+    left_idx = np.where(left_idx < flagged_idx, left_idx, right_idx)
+    spacing = right_idx - left_idx
+    right_weights = np.divide(
+        flagged_idx - left_idx,
+        spacing,
+        out=np.ones(flagged_idx.size),
+        where=spacing > 0,
+    )
+
+    return flagged_idx, left_idx, right_idx, right_weights
+
+
+def get_spectral_interpolation_matrix(
+    tmask,
+    TR,
+    oversampling_factor=8,
+    maximum_frequency_factor=1,
+):
+    """Build the Lomb-Scargle reconstruction matrix for a temporal mask.
+
+    The sine and cosine basis functions are fitted to the retained volumes,
+    and the fitted coefficients are used to reconstruct the full time series.
+    Both steps are linear in the data, so they are combined into a single matrix
+    that maps the retained volumes of each voxel to the reconstructed time series.
+
+    Parameters
+    ----------
+    tmask : numpy.ndarray of shape (T)
+        A temporal mask in which ones indicate volumes to be flagged and interpolated across.
+    TR : float
+        The repetition time of the BOLD data, in seconds.
+    oversampling_factor : int, optional
+        Oversampling of the frequency grid. Default is 8.
+    maximum_frequency_factor : float, optional
+        Highest frequency to fit, as a multiple of the average Nyquist frequency of the
+        retained volumes. Default is 1.
+
+    Returns
+    -------
+    reconstruction_matrix : numpy.ndarray of shape (R, T)
+        Matrix mapping the R retained volumes to the T reconstructed volumes.
+
+    Notes
+    -----
+    This follows the spectral interpolation used in the DCAN Labs pipelines
+    :footcite:p:`power_fd_dvars`.
+    """
+    tmask = np.asarray(tmask)
+    all_times = TR * np.arange(tmask.size)
+    retained_times = all_times[tmask == 0]
+    n_retained = retained_times.size
+    time_span = retained_times.max() - retained_times.min()
+
+    frequency_step = 1 / (time_span * oversampling_factor)
+    frequencies = np.arange(
+        frequency_step,
+        maximum_frequency_factor * n_retained / (2 * time_span) + frequency_step / 2,
+        frequency_step,
+    )
+    angular_frequencies = 2 * np.pi * frequencies
+
+    # time offsets that make the sine and cosine terms orthogonal at each frequency
+    tau = np.arctan2(
+        np.sin(2 * np.outer(angular_frequencies, retained_times)).sum(axis=1),
+        np.cos(2 * np.outer(angular_frequencies, retained_times)).sum(axis=1),
+    ) / (2 * angular_frequencies)
+
+    # basis functions at the retained volumes (F x R), and at all volumes (F x T)
+    retained_phase = angular_frequencies[:, None] * (retained_times[None, :] - tau[:, None])
+    cosine_term = np.cos(retained_phase)
+    sine_term = np.sin(retained_phase)
+    all_phase = angular_frequencies[:, None] * (all_times[None, :] - tau[:, None])
+
+    # coefficient estimators (R x F), followed by the reconstruction (F x T)
+    reconstruction_matrix = (cosine_term / np.sum(cosine_term ** 2, axis=1)[:, None]).T @ np.cos(
+        all_phase
+    )
+    reconstruction_matrix += (sine_term / np.sum(sine_term ** 2, axis=1)[:, None]).T @ np.sin(
+        all_phase
+    )
+
+    return reconstruction_matrix
+
+
+def interpolate_masked_data(bold_data, tmask, TR=1, method="linear", block_size=5000):
     """Interpolate masked data.
 
     No interpolation will be performed if more than 50% of the volumes in the BOLD data are
     flagged by the temporal mask.
-
-    NOTE: TS- Why are slice times being inferred from the number of volumes?
-    Am I missing something?
+    The interpolation weights are computed from the temporal mask once,
+    and the flagged volumes are replaced in place for all voxels at the same time.
 
     Parameters
     ----------
@@ -76,41 +194,63 @@ def interpolate_masked_data(bold_data, tmask, TR=1):
         A temporal mask in which ones indicate volumes to be flagged and interpolated across.
     TR : float, optional
         The repetition time of the BOLD data, in seconds. Default is 1.
+        The volumes are evenly spaced, so linear interpolation does not depend on it.
+    method : {"linear", "spectral"}, optional
+        If "linear", flagged volumes are linearly interpolated from the nearest
+        unflagged volumes.
+        If "spectral", flagged volumes are replaced with a Lomb-Scargle reconstruction
+        of the unflagged volumes. See :func:`get_spectral_interpolation_matrix`.
+        Default is "linear".
+    block_size : int, optional
+        Number of voxels/vertices to reconstruct at a time with the "spectral" method.
+        Default is 5000.
 
     Returns
     -------
     bold_data_interpolated : numpy.ndarray of shape (S, T)
         The interpolated BOLD data.
+        This is the same array as ``bold_data``, which is modified in place.
     """
-    # import interpolate functionality
-    from scipy.interpolate import interp1d
-
     # Confirm that interpolation can be correctly performed
     bold_data_interpolated = bold_data
     if np.mean(tmask) == 0:
         print('No flagged volume, interpolation will not be done.')
     elif np.mean(tmask) > 0.5:
         print('More than 50% of volumes are flagged, interpolation will not be done.')
+    elif method == "spectral":
+        # The reconstruction is accumulated in float64, one block at a time,
+        # and cast back to the type of the BOLD data when the block is replaced.
+        reconstruction_matrix = get_spectral_interpolation_matrix(tmask, TR=TR)
+        retained = tmask == 0
+        flagged = tmask == 1
+        for start in range(0, bold_data.shape[0], block_size):
+            block = bold_data[start:start + block_size, :]
+            retained_data = block[:, retained].astype(np.float64)
+            retained_mean = retained_data.mean(axis=1, keepdims=True)
+            retained_data = retained_data - retained_mean
+            reconstructed_data = retained_data @ reconstruction_matrix
+
+            # rescale the reconstruction to the variance of the retained data
+            reconstructed_std = reconstructed_data.std(axis=1, keepdims=True)
+            scale = np.divide(
+                retained_data.std(axis=1, keepdims=True),
+                reconstructed_std,
+                out=np.zeros_like(reconstructed_std),
+                where=reconstructed_std > 0,
+            )
+            block[:, flagged] = reconstructed_data[:, flagged] * scale + retained_mean
+    elif method == "linear":
+        flagged_idx, left_idx, right_idx, right_weights = get_interpolation_weights(tmask)
+        if np.issubdtype(bold_data.dtype, np.floating):
+            # a weighted average of two values needs no extra precision
+            right_weights = right_weights.astype(bold_data.dtype)
+        # The anchors are never flagged volumes (except for the last volume,
+        # which interpolates to itself), so the flagged volumes can be replaced in place.
+        bold_data_interpolated[:, flagged_idx] = (
+            bold_data[:, left_idx] * (1 - right_weights)
+            + bold_data[:, right_idx] * right_weights
+        )
     else:
-        # Create slice time array
-        slice_times = TR * np.arange(0, (bold_data.shape[1]), 1)
-        # then add all the times which were not scrubbed. Append the last
-        # time to the end
-        slice_times_extended = np.append(slice_times[tmask == 0], slice_times[-1])
-        # Stack bold data: all timepoints not scrubbed are appended to
-        # the last timepoint
-        clean_volume = np.hstack(
-            (bold_data[:,
-                       (tmask == 0)], np.reshape(bold_data[:, -1],
-                                                 [bold_data.shape[0], 1])))
-
-        # looping through each voxel
-        for voxel in range(0, bold_data.shape[0]):
-            # create interpolation function
-            interpolation_function = interp1d(slice_times_extended, clean_volume[voxel, :])
-            # create data
-            interpolated_data = interpolation_function(slice_times)
-            # if the data was scrubbed, replace it with the interpolated data
-            bold_data_interpolated[voxel, (tmask == 1)] = interpolated_data[tmask == 1]
+        raise ValueError(f"Unknown interpolation method: {method}")
 
     return bold_data_interpolated
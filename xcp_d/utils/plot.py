@@ -15,7 +15,7 @@ from nilearn._utils import check_niimg_4d
 from nilearn._utils.niimg import _safe_get_data
 from nilearn.signal import clean
 
-from xcp_d.utils.qcmetrics import compute_dvars
+from xcp_d.utils.qcmetrics import compute_qc_statistics
 from xcp_d.utils.write_save import read_ndata, scalex, write_ndata
 
 
@@ -458,7 +458,6 @@ def confoundplotx(time_series,
 
 
 def plot_svgx(rawdata,
-              regressed_data,
               residual_data,
               filtered_motion,
               unprocessed_filename,
@@ -466,18 +465,16 @@ def plot_svgx(rawdata,
               mask=None,
               seg_data=None,
               TR=1,
-              raw_dvars=None,
-              regressed_dvars=None,
-              filtered_dvars=None,
-              work_dir=None):
+              raw_run_lengths=None,
+              residual_run_lengths=None,
+              work_dir=None,
+              dtype=None):
     """Generate carpet plot with DVARS, FD, and WB.
 
     Parameters
     ----------
     rawdata :
         nifti or cifti before processing
-    regressed_data :
-        nifti or cifti after nuisance regression
     residual_data :
         nifti or cifti after regression and filtering
     mask :
@@ -492,41 +489,44 @@ def plot_svgx(rawdata,
         output file svg before processing
     processed_filename :
         output file svg after processing
+    raw_run_lengths, residual_run_lengths : list of int or None, optional
+        Number of volumes in each run of ``rawdata`` and ``residual_data``,
+        if they are concatenations of several runs.
+        DVARS is then computed separately for each run.
+    dtype : numpy dtype or None, optional
+        Floating-point type in which the data are read. If None (default), float64 is used.
     """
-    # Compute dvars correctly if not already done
-    if type(raw_dvars) != np.ndarray:
-        raw_dvars = compute_dvars(read_ndata(datafile=rawdata, maskfile=mask))
-    if type(regressed_dvars) != np.ndarray:
-        regressed_dvars = compute_dvars(read_ndata(datafile=regressed_data, maskfile=mask))
-    if type(filtered_dvars) != np.ndarray:
-        filtered_dvars = compute_dvars(read_ndata(datafile=residual_data,
-                                                  maskfile=mask))
+    # Read each file once, and compute its DVARS, mean, std, and range in one pass.
+    raw_data = read_ndata(datafile=rawdata, maskfile=mask, dtype=dtype)
+    residual_data_matrix = read_ndata(datafile=residual_data, maskfile=mask, dtype=dtype)
+    raw_stats = compute_qc_statistics(raw_data, run_lengths=raw_run_lengths)
+    residual_stats = compute_qc_statistics(
+        residual_data_matrix,
+        run_lengths=residual_run_lengths,
+    )
+    raw_dvars = raw_stats.dvars
+    filtered_dvars = residual_stats.dvars
     # For ease of reference later
     residual_data_file = residual_data
     raw_data_file = rawdata
 
     # Formatting & setting of files
     sns.set_style('whitegrid')
-    # regressed_dvars_data = regressed_dvars
     residual_dvars_data = filtered_dvars
     raw_dvars_data = raw_dvars
-    # Load files
-    raw_data = read_ndata(datafile=raw_data_file, maskfile=mask)
-    residual_data = read_ndata(datafile=residual_data_file, maskfile=mask)
+    raw_mean, raw_std = raw_stats.mean, raw_stats.std
 
     # Remove first N deleted from raw_data so it's same length as censored files
     if len(raw_dvars_data) > len(residual_dvars_data):
         # TODO: Should this be [-len(residual_dvars_data):] ?
         # ... Seems to grab first N, not last N.
         raw_dvars_data = raw_dvars_data[0:len(residual_dvars_data)]
-        raw_data = raw_data[:, 0:len(residual_dvars_data)]
-        # TODO: Figure out how to slice the regressed DVARS instead of just overwriting it
-        # regressed_dvars_data = raw_dvars_data
+        raw_mean = raw_mean[0:len(residual_dvars_data)]
+        raw_std = raw_std[0:len(residual_dvars_data)]
 
     # Create dataframes for the bold_data DVARS, FD
     DVARS_timeseries = pd.DataFrame({
         'Pre regression': raw_dvars_data,
-        # 'Post regression': regressed_dvars_data,
         'Post all': residual_dvars_data
     })
 
@@ -536,13 +536,13 @@ def plot_svgx(rawdata,
 
     # The mean and standard deviation of raw data
     unprocessed_data_timeseries = pd.DataFrame({
-        'Mean': np.nanmean(raw_data, axis=0),
-        'Std': np.nanstd(raw_data, axis=0)
+        'Mean': raw_mean,
+        'Std': raw_std,
     })
     # The mean and standard deviation of filtered data
     processed_data_timeseries = pd.DataFrame({
-        'Mean': np.nanmean(residual_data, axis=0),
-        'Std': np.nanstd(residual_data, axis=0)
+        'Mean': residual_stats.mean,
+        'Std': residual_stats.std,
     })
     if seg_data is not None:
         atlaslabels = nb.load(seg_data).get_fdata()
@@ -550,8 +550,15 @@ def plot_svgx(rawdata,
         atlaslabels = None
 
     # The plot going to carpet plot will be rescaled to [-600,600]
-    scaled_raw_data = read_ndata(datafile=raw_data_file, maskfile=mask, scale=600)
-    scaled_residual_data = read_ndata(datafile=residual_data_file, maskfile=mask, scale=600)
+    scaled_raw_data = scalex(raw_data, -600, 600, raw_stats.min, raw_stats.max)
+    scaled_residual_data = scalex(
+        residual_data_matrix,
+        -600,
+        600,
+        residual_stats.min,
+        residual_stats.max,
+    )
+    del raw_data, residual_data_matrix
 
     # Make a temporary file for niftis and ciftis
     if rawdata.endswith('.nii.gz'):
@@ -939,10 +946,10 @@ def _carpet(func,
                aspect="auto",
                cmap=cmap)
 
-    if func.endswith('nii.gz'):  # Nifti
-        labels = ['Cortical GM', 'Subcortical GM', 'Cerebellum', 'CSF and WM']
-    else:  # Cifti
+    if func.endswith('dtseries.nii'):  # Cifti
         labels = ['Left Cortex', 'Right Cortex', 'Subcortical', 'Cerebellum']
+    else:  # Nifti
+        labels = ['Cortical GM', 'Subcortical GM', 'Cerebellum', 'CSF and WM']
 
     # Formatting the plot
     tick_locs = []
@@ -1011,10 +1018,10 @@ def plot_text(imgdata, grid_spec_ts):
                                                      subplot_spec=grid_spec_ts,
                                                      width_ratios=[1, 100],
                                                      wspace=0.0)
-    if imgdata.endswith('nii.gz'):  # Nifti
-        label = "Blue: Cortical GM, Orange: Subcortical GM, Green: Cerebellum, Red: CSF and WM"
-    else:  # Cifti
+    if imgdata.endswith('dtseries.nii'):  # Cifti
         label = "Blue: Left Cortex, Cyan: Right Cortex,Orange: Subcortical, Green: Cerebellum"
+    else:  # Nifti
+        label = "Blue: Cortical GM, Orange: Subcortical GM, Green: Cerebellum, Red: CSF and WM"
 
     text_kwargs = dict(ha='center', va='center', fontsize=50)
 
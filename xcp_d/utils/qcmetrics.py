@@ -1,4 +1,6 @@
 """Quality control metrics."""
+from collections import namedtuple
+
 import nibabel as nb
 import numpy as np
 
@@ -175,7 +177,7 @@ def coverage(input1, input2):
     return cov
 
 
-def compute_dvars(datat):
+def compute_dvars(datat, block_size=5000):
     """Compute standard DVARS.
 
     Parameters
@@ -183,6 +185,8 @@ def compute_dvars(datat):
     datat : numpy.ndarray
         The data matrix from which to calculate DVARS.
         Ordered as vertices by timepoints.
+    block_size : int, optional
+        Number of vertices to difference at a time. Default is 5000.
 
     Returns
     -------
@@ -190,7 +194,101 @@ def compute_dvars(datat):
         The calculated DVARS array.
         A (timepoints,) array.
     """
-    firstcolumn = np.zeros((datat.shape[0]))[..., None]
-    datax = np.hstack((firstcolumn, np.diff(datat)))
-    datax_ss = np.sum(np.square(datax), axis=0) / datat.shape[0]
-    return np.sqrt(datax_ss)
+    return compute_qc_statistics(datat, block_size=block_size).dvars
+
+
+QCStatistics = namedtuple("QCStatistics", ["dvars", "mean", "std", "min", "max"])
+QCStatistics.__doc__ = """Volume-wise statistics of a BOLD data matrix.
+
+Attributes
+----------
+dvars : numpy.ndarray of shape (T,)
+    Standard DVARS, with a zero for the first volume.
+mean, std : numpy.ndarray of shape (T,)
+    Mean and standard deviation across vertices of each volume, ignoring NaNs.
+min, max : float
+    Minimum and maximum of the whole matrix, ignoring NaNs,
+    as used to rescale the data for carpet plots.
+"""
+
+
+def compute_qc_statistics(datat, block_size=5000, run_lengths=None):
+    """Compute DVARS, whole-brain mean and std, and the data range in one pass.
+
+    The data are processed in blocks of vertices, accumulating every statistic at once,
+    so no copy of the full matrix is made.
+
+    Parameters
+    ----------
+    datat : numpy.ndarray
+        The data matrix from which to calculate the statistics.
+        Ordered as vertices by timepoints.
+    block_size : int, optional
+        Number of vertices to process at a time. Default is 5000.
+    run_lengths : list of int or None, optional
+        Number of volumes in each run, if ``datat`` is a concatenation of several runs.
+        DVARS is not computed across runs, so the first volume of each run gets
+        the run's mean DVARS instead of the difference from the previous run.
+        Default is None.
+
+    Returns
+    -------
+    QCStatistics
+    """
+    datat = np.atleast_2d(datat)
+    n_vertices, n_volumes = datat.shape
+
+    dvars_ss = np.zeros(n_volumes)
+    counts = np.zeros(n_volumes)
+    means = np.zeros(n_volumes)
+    sum_squares = np.zeros(n_volumes)
+    data_min, data_max = np.inf, -np.inf
+    for start in range(0, n_vertices, block_size):
+        block = np.asarray(datat[start:start + block_size, :], dtype=np.float64)
+        dvars_ss[1:] += np.sum(np.square(np.diff(block, axis=1)), axis=0)
+
+        # merge the block's mean and sum of squared deviations into the running ones
+        valid = ~np.isnan(block)
+        block_counts = valid.sum(axis=0)
+        block_sums = np.where(valid, block, 0).sum(axis=0)
+        block_means = np.divide(
+            block_sums,
+            block_counts,
+            out=np.zeros(n_volumes),
+            where=block_counts > 0,
+        )
+        block_sum_squares = np.where(valid, block - block_means, 0) ** 2
+        total_counts = counts + block_counts
+        weights = np.divide(
+            block_counts,
+            total_counts,
+            out=np.zeros(n_volumes),
+            where=total_counts > 0,
+        )
+        delta = block_means - means
+        sum_squares += block_sum_squares.sum(axis=0) + delta ** 2 * counts * weights
+        means += delta * weights
+        counts = total_counts
+
+        if valid.any():
+            data_min = min(data_min, np.nanmin(block))
+            data_max = max(data_max, np.nanmax(block))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means[counts == 0] = np.nan
+        stds = np.sqrt(sum_squares / counts)
+
+    dvars = np.sqrt(dvars_ss / n_vertices)
+    if run_lengths is not None:
+        run_starts = np.cumsum([0] + list(run_lengths))
+        for start, stop in zip(run_starts[:-1], run_starts[1:]):
+            dvars[start] = 0
+            dvars[start] = np.mean(dvars[start:stop])
+
+    return QCStatistics(
+        dvars=dvars,
+        mean=means,
+        std=stds,
+        min=data_min,
+        max=data_max,
+    )
@@ -5,11 +5,15 @@ import os
 
 import nibabel as nb
 import numpy as np
+from nipype import logging
 from pkg_resources import resource_filename as pkgrf
-from scipy.signal import butter, detrend, filtfilt
+from scipy.signal import filtfilt
 from sklearn.linear_model import LinearRegression
 
 from xcp_d.utils.doc import fill_doc
+from xcp_d.utils.filter_design import get_bandpass_design, get_bandpass_response
+
+LOGGER = logging.getLogger("nipype.utils")
 
 
 def get_transformfilex(bold_file, mni_to_t1w, t1w_to_native):
@@ -332,6 +336,44 @@ def stringforparams(params):
     return bsignal
 
 
+def stringforfilter(filter_engine="filtfilt", fft_response="butterworth", bpf_order=2):
+    """Describe the bandpass filter engine for the boilerplate.
+
+    Parameters
+    ----------
+    filter_engine : {"filtfilt", "fft"}
+        The engine used for bandpass filtering.
+    fft_response : {"butterworth", "ideal"}
+        The frequency response used by the "fft" engine.
+    bpf_order : int
+        The order of the Butterworth filter.
+
+    Returns
+    -------
+    filter_str : str
+        String describing how the bandpass filter was applied.
+    """
+    if filter_engine == "fft":
+        if fft_response == "ideal":
+            response_str = "an ideal (rectangular) band-pass mask"
+        else:
+            response_str = (
+                f"the squared magnitude response of an order-{bpf_order} Butterworth filter"
+            )
+
+        filter_str = (
+            "a zero-phase frequency-domain filter, in which the Fourier transform of each "
+            f"time series was multiplied by {response_str} and then inverted"
+        )
+    else:
+        filter_str = (
+            f"an order-{bpf_order} Butterworth filter, applied forward and backward "
+            "to produce a zero-phase response"
+        )
+
+    return filter_str
+
+
 def get_customfile(custom_confounds, bold_file):
     """Identify a custom confounds file.
 
@@ -407,9 +449,48 @@ def zscore_nifti(img, outputname, mask=None):
     return outputname
 
 
-def butter_bandpass(data, fs, lowpass, highpass, order=2):
+def get_float_dtype(data):
+    """Get the floating-point type in which to process an array.
+
+    Floating-point arrays keep their own type, so single-precision BOLD data
+    (read with ``--precision float32``) stay in single precision.
+    Other arrays are processed in float64.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The array to process.
+
+    Returns
+    -------
+    numpy.dtype
+    """
+    data = np.asanyarray(data)
+    if np.issubdtype(data.dtype, np.floating):
+        return data.dtype
+
+    return np.dtype(np.float64)
+
+
+def butter_bandpass(
+    data,
+    fs,
+    lowpass,
+    highpass,
+    order=2,
+    block_size=5000,
+    dtype=None,
+    design=None,
+):
     """Apply a Butterworth bandpass filter to data.
 
+    The filter is applied along the time axis of blocks of voxels/vertices at once,
+    rather than looping over individual rows.
+    Each block is filtered in float64 and then cast to the output data type,
+    so results are equivalent to filtering each row separately.
+    Only one block at a time is held in float64, so single-precision data stay in
+    single precision from input to output.
+
     Parameters
     ----------
     data : numpy.ndarray
@@ -422,33 +503,324 @@ def butter_bandpass(data, fs, lowpass, highpass, order=2):
         frequency
     order : int
         The order of the filter. This will be divided by 2 when calling scipy.signal.butter.
+    block_size : int or None, optional
+        Number of voxels/vertices to filter at once.
+        Larger blocks are faster, but require more memory.
+        If None, all voxels/vertices are filtered in a single block.
+        Default is 5000.
+    dtype : numpy.dtype or None, optional
+        Data type of the filtered data. Use ``np.float32`` to halve the memory footprint
+        of the output array. If None, the floating-point type of ``data`` is used
+        (see :func:`get_float_dtype`). Default is None.
+    design : FilterDesign or None, optional
+        The filter to apply, from :func:`~xcp_d.utils.filter_design.get_bandpass_design`.
+        If None (default), it is looked up from ``fs``, ``lowpass``, ``highpass``,
+        and ``order``.
 
     Returns
     -------
     filtered_data : numpy.ndarray
         The filtered data.
     """
-    nyq = 0.5 * fs  # nyquist frequency
+    if design is None:
+        # get filter coeff from the process-wide registry
+        design = get_bandpass_design(TR=1 / fs, lowpass=lowpass, highpass=highpass, order=order)
+
+    data = np.atleast_2d(data)
+    n_rows = data.shape[0]
+    if not block_size:
+        block_size = max(n_rows, 1)
+
+    # create something to populate filtered values with
+    filtered_data = np.empty(data.shape, dtype=dtype or get_float_dtype(data))
+
+    # apply the filter along the time axis, one block of rows at a time
+    for start in range(0, n_rows, block_size):
+        end = min(start + block_size, n_rows)
+        filtered_data[start:end, :] = filtfilt(
+            design.b,
+            design.a,
+            np.asarray(data[start:end, :], dtype=np.float64),
+            axis=-1,
+            padtype='odd',
+            padlen=design.padlen,
+        )
 
-    # normalize the cutoffs
-    lowcut = np.float(highpass) / nyq
-    highcut = np.float(lowpass) / nyq
+    return filtered_data
 
-    b, a = butter(order / 2, [lowcut, highcut], btype='band')  # get filter coeff
 
-    filtered_data = np.zeros(data.shape)  # create something to populate filtered values with
+def fft_bandpass(
+    data,
+    fs,
+    lowpass,
+    highpass,
+    order=2,
+    response="butterworth",
+    block_size=5000,
+    dtype=None,
+    frequency_response=None,
+):
+    """Apply a zero-phase bandpass filter to data in the frequency domain.
 
-    # apply the filter, loop through columns of regressors
-    for ii in range(filtered_data.shape[0]):
-        filtered_data[ii, :] = filtfilt(b, a, data[ii, :], padtype='odd',
-                                        padlen=3 * (max(len(b), len(a)) - 1))
+    A real FFT is computed over the time axis of blocks of voxels/vertices,
+    multiplied by a precomputed frequency response, and inverted.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Voxels/vertices by timepoints dimension.
+    fs : float
+        Sampling frequency. 1/TR(s).
+    lowpass : float
+        frequency
+    highpass : float
+        frequency
+    order : int
+        The order of the Butterworth filter whose magnitude response is emulated.
+        Only used if ``response`` is "butterworth".
+    response : {"butterworth", "ideal"}
+        The frequency response to apply.
+        See :func:`~xcp_d.utils.filter_design.bandpass_frequency_response`.
+    block_size : int or None, optional
+        Number of voxels/vertices to filter at once.
+        If None, all voxels/vertices are filtered in a single block.
+        Default is 5000.
+    dtype : numpy.dtype or None, optional
+        Data type of the filtered data. If None, the floating-point type of ``data``
+        is used (see :func:`get_float_dtype`). Default is None.
+    frequency_response : numpy.ndarray or None, optional
+        The response to apply,
+        from :func:`~xcp_d.utils.filter_design.get_bandpass_response`.
+        If None (default), it is looked up from ``fs``, ``lowpass``, ``highpass``,
+        ``order``, and ``response``.
+
+    Returns
+    -------
+    filtered_data : numpy.ndarray
+        The filtered data.
+    """
+    data = np.atleast_2d(data)
+    n_rows, n_timepoints = data.shape
+    if not block_size:
+        block_size = max(n_rows, 1)
+
+    if frequency_response is None:
+        frequency_response, _ = get_bandpass_response(
+            n_timepoints,
+            TR=1 / fs,
+            lowpass=lowpass,
+            highpass=highpass,
+            order=order,
+            response=response,
+        )
+
+    filtered_data = np.empty(data.shape, dtype=dtype or get_float_dtype(data))
+    for start in range(0, n_rows, block_size):
+        end = min(start + block_size, n_rows)
+        spectrum = np.fft.rfft(np.asarray(data[start:end, :], dtype=np.float64), axis=-1)
+        spectrum = spectrum * frequency_response
+        filtered_data[start:end, :] = np.fft.irfft(spectrum, n=n_timepoints, axis=-1)
 
     return filtered_data
 
 
+@fill_doc
+def get_bandpass_filter(
+    n_timepoints,
+    TR,
+    lowpass,
+    highpass,
+    order=2,
+    filter_engine="filtfilt",
+    fft_response="butterworth",
+):
+    """Look up a bandpass filter once, to apply it to one or more blocks of data.
+
+    The design is taken from the process-wide registry and logged here,
+    so blocks filtered with the returned function do not look it up or log it again.
+
+    Parameters
+    ----------
+    n_timepoints : int
+        Number of timepoints in the data.
+    TR : float
+        Repetition time of the data, in seconds.
+    lowpass : float
+        Low-pass cutoff, in Hertz.
+    highpass : float
+        High-pass cutoff, in Hertz.
+    order : int
+        The order of the filter.
+    %(filter_engine)s
+    %(fft_response)s
+
+    Returns
+    -------
+    filter_function : callable
+        Function that takes a voxels/vertices by timepoints array with ``n_timepoints``
+        timepoints and returns the filtered array.
+    """
+    from functools import partial
+
+    # the filters are given the design that is logged, so they do not look it up again
+    # from 1 / fs, which does not always round-trip to TR
+    if filter_engine == "fft":
+        frequency_response, param_hash = get_bandpass_response(
+            n_timepoints=n_timepoints,
+            TR=TR,
+            lowpass=lowpass,
+            highpass=highpass,
+            order=order,
+            response=fft_response,
+        )
+        LOGGER.info(f"Applying FFT bandpass filter (design {param_hash}).")
+        return partial(
+            fft_bandpass,
+            fs=1 / TR,
+            lowpass=lowpass,
+            highpass=highpass,
+            order=order,
+            response=fft_response,
+            frequency_response=frequency_response,
+        )
+    elif filter_engine != "filtfilt":
+        raise ValueError(f"Unknown filter engine: {filter_engine}")
+
+    design = get_bandpass_design(TR=TR, lowpass=lowpass, highpass=highpass, order=order)
+    LOGGER.info(f"Applying Butterworth bandpass filter (design {design.param_hash}).")
+    return partial(
+        butter_bandpass,
+        fs=1 / TR,
+        lowpass=lowpass,
+        highpass=highpass,
+        order=order,
+        design=design,
+    )
+
+
+@fill_doc
+def bandpass_filter_data(
+    data,
+    TR,
+    lowpass,
+    highpass,
+    order=2,
+    filter_engine="filtfilt",
+    fft_response="butterworth",
+):
+    """Bandpass filter data with the requested filter engine.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Voxels/vertices by timepoints dimension.
+    TR : float
+        Repetition time of the data, in seconds.
+    lowpass : float
+        Low-pass cutoff, in Hertz.
+    highpass : float
+        High-pass cutoff, in Hertz.
+    order : int
+        The order of the filter.
+    %(filter_engine)s
+    %(fft_response)s
+
+    Returns
+    -------
+    filtered_data : numpy.ndarray
+        The filtered data.
+
+    See Also
+    --------
+    get_bandpass_filter
+    """
+    filter_function = get_bandpass_filter(
+        n_timepoints=data.shape[1],
+        TR=TR,
+        lowpass=lowpass,
+        highpass=highpass,
+        order=order,
+        filter_engine=filter_engine,
+        fft_response=fft_response,
+    )
+    return filter_function(data)
+
+
+def projection_regression(data, confound, block_size=5000, dtype=None):
+    """Regress confounds out of data by projecting onto the confounds' orthogonal complement.
+
+    The confound design (with an intercept) is factored once with a singular value
+    decomposition, and the residual-forming projector is applied to blocks of voxels
+    in place, so no full prediction array is created.
+    Rank-deficient designs are handled like a pseudo-inverse fit,
+    by projecting out only the non-degenerate components.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        vertices by timepoints for bold file
+    confound : numpy.ndarray
+       nuisance regressors - regressors by timepoints for confounds matrix
+    block_size : int, optional
+        Number of vertices to residualize at a time. Default is 5000.
+    dtype : numpy dtype or None, optional
+        Data type of the residuals. Use ``np.float32`` to halve the memory footprint.
+        The design is always factored, and each block projected, in double precision.
+        If None (default), the floating-point type of ``data`` is used
+        (see :func:`get_float_dtype`).
+
+    Returns
+    -------
+    residuals : numpy.ndarray
+        residual matrix after regression
+
+    Notes
+    -----
+    The results match :func:`linear_regression` up to floating-point precision.
+    """
+    data = np.atleast_2d(data)
+    confound = np.atleast_2d(confound)
+    n_volumes = data.shape[1]
+    if confound.shape[1] != n_volumes:
+        raise ValueError(
+            f"Confounds have {confound.shape[1]} timepoints, but data have {n_volumes}."
+        )
+
+    design = np.column_stack((np.ones(n_volumes), confound.T.astype(np.float64)))
+    u, singular_values, _ = np.linalg.svd(design, full_matrices=False)
+    tolerance = singular_values.max() * max(design.shape) * np.finfo(np.float64).eps
+    rank = int(np.sum(singular_values > tolerance))
+    condition_number = singular_values[0] / singular_values[rank - 1]
+
+    LOGGER.info(
+        f"Regressing {design.shape[1] - 1} confounds (plus intercept) out of "
+        f"{n_volumes} volumes. Design rank: {rank}. Condition number: {condition_number:.2e}."
+    )
+    if rank < design.shape[1]:
+        LOGGER.warning(
+            f"The confound design is rank deficient ({rank} < {design.shape[1]} columns). "
+            "Regression might not be effective, i.e., "
+            "the number of volumes in the bold file may be smaller than the number of "
+            "regressors, or some regressors may be linear combinations of others."
+        )
+
+    dtype = get_float_dtype(data) if dtype is None else dtype
+    basis = np.ascontiguousarray(u[:, :rank])
+    residuals = np.array(data, dtype=dtype)
+    for start in range(0, residuals.shape[0], block_size):
+        block = residuals[start:start + block_size, :]
+        # the projection is accumulated in float64 and cast back to the residuals' type
+        block -= (block @ basis) @ basis.T
+
+    return residuals
+
+
 def linear_regression(data, confound):
     """Perform linear regression with sklearn's LinearRegression.
 
+    This implementation is kept to validate :func:`projection_regression`,
+    which is used by the regression interfaces.
+
     Parameters
     ----------
     data : numpy.ndarray
@@ -459,32 +831,122 @@ def linear_regression(data, confound):
     Returns
     -------
     numpy.ndarray
-        residual matrix after regression
+        residual matrix after regression, in the floating-point type of ``data``
     """
     regression = LinearRegression(n_jobs=1)
     regression.fit(confound.T, data.T)
     y_predicted = regression.predict(confound.T)
 
-    return data - y_predicted.T
+    return (data - y_predicted.T).astype(get_float_dtype(data), copy=False)
 
 
-def demean_detrend_data(data):
+def demean_detrend_data(data, block_size=5000):
     """Mean-center and remove linear trends over time from data.
 
+    The mean and linear trend are projected out of blocks of vertices at a time.
+    Each projection is accumulated in float64, but the detrended data keep the
+    floating-point type of ``data``.
+
     Parameters
     ----------
     data : numpy.ndarray
         vertices by timepoints for bold file
+    block_size : int, optional
+        Number of vertices to detrend at a time. Default is 5000.
 
     Returns
     -------
     detrended : numpy.ndarray
         demeaned and detrended data
+
+    Notes
+    -----
+    The results match :func:`scipy.signal.detrend` with ``type='constant'``
+    followed by ``type='linear'``.
     """
-    demeaned = detrend(data, axis=- 1, type='constant', bp=0,
-                       overwrite_data=False)  # Demean data using "constant" detrend,
-    # which subtracts mean
-    detrended = detrend(demeaned, axis=- 1, type='linear', bp=0,
-                        overwrite_data=False)  # Detrend data using linear method
+    data = np.atleast_2d(data)
+    n_timepoints = data.shape[1]
+
+    # orthonormal basis of the intercept and linear trend
+    trend = np.column_stack((np.ones(n_timepoints), np.arange(n_timepoints, dtype=np.float64)))
+    basis, _ = np.linalg.qr(trend)
+
+    detrended = np.array(data, dtype=get_float_dtype(data))
+    for start in range(0, detrended.shape[0], block_size):
+        block = detrended[start:start + block_size, :]
+        block -= (block @ basis) @ basis.T
 
-    return detrended  # Subtract these predicted values from the demeaned data
+    return detrended
+
+
+def despike_data(data, cut=(2.5, 4.0), block_size=5000, n_threads=1):
+    """Truncate spikes in time series, following AFNI's ``3dDespike -NEW``.
+
+    A smooth curve (a quadratic trend plus ``n_timepoints // 30`` sine/cosine pairs)
+    is fit by least squares to a 9-point running median of each time series.
+    The residuals from the curve are scaled by ``sqrt(pi / 2)`` times their median
+    absolute value, and values whose scaled residual ``s`` exceeds ``c1`` are replaced
+    by the curve plus ``c1 + (c2 - c1) * tanh((s - c1) / (c2 - c1))`` scaled residuals.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        vertices by timepoints for bold file
+    cut : tuple of float, optional
+        The spike threshold ``c1`` and the upper limit ``c2`` of the truncated values,
+        in scaled residuals. Default is (2.5, 4.0), as in 3dDespike.
+    block_size : int, optional
+        Number of vertices to despike at a time. Default is 5000.
+    n_threads : int, optional
+        Number of blocks to despike in parallel. Default is 1.
+
+    Returns
+    -------
+    despiked_data : numpy.ndarray
+        The despiked data, in the floating-point type of ``data``.
+        Time series with no variability around the curve are returned unchanged.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from scipy.ndimage import median_filter
+
+    data = np.atleast_2d(data)
+    n_timepoints = data.shape[1]
+    c1, c2 = cut
+    median_width = 9
+
+    # build the curve-fitting design and its pseudo-inverse once
+    time = np.arange(n_timepoints, dtype=np.float64)
+    regressors = [np.ones(n_timepoints), time, time ** 2]
+    for k in range(1, n_timepoints // 30 + 1):
+        regressors.append(np.sin(2 * np.pi * k * time / n_timepoints))
+        regressors.append(np.cos(2 * np.pi * k * time / n_timepoints))
+    design = np.column_stack(regressors)
+    design_pinv = np.linalg.pinv(design)
+
+    despiked_data = np.array(data, dtype=get_float_dtype(data))
+
+    def _despike_block(start):
+        block = despiked_data[start:start + block_size, :]
+        # running median, with the edges padded by their nearest value
+        smoothed = median_filter(block, size=(1, median_width), mode="nearest")
+        curve = (smoothed @ design_pinv.T) @ design.T
+
+        residuals = block - curve
+        sigma = np.sqrt(np.pi / 2) * np.median(np.abs(residuals), axis=1, keepdims=True)
+        scaled = np.divide(residuals, sigma, out=np.zeros_like(residuals), where=sigma > 0)
+        spikes = np.abs(scaled) > c1
+        truncated = c1 + (c2 - c1) * np.tanh((np.abs(scaled[spikes]) - c1) / (c2 - c1))
+        block[spikes] = (
+            curve[spikes] + np.sign(scaled[spikes]) * truncated * np.broadcast_to(
+                sigma, block.shape
+            )[spikes]
+        )
+        return int(spikes.sum())
+
+    starts = range(0, despiked_data.shape[0], block_size)
+    with ThreadPoolExecutor(max_workers=max(int(n_threads), 1)) as executor:
+        n_spikes = sum(executor.map(_despike_block, starts))
+
+    LOGGER.info(f"Truncated {n_spikes} of {despiked_data.size} values as spikes.")
+    return despiked_data
@@ -9,10 +9,21 @@ import numpy as np
 from nilearn import masking
 from templateflow.api import get as get_template
 
+from xcp_d.utils.cache import atomic_write, cache_key, evict_lru, file_signature, touch
 
-def read_ndata(datafile, maskfile=None, scale=0):
+# Environment variables that enable the masked-matrix cache and bound its size (in GB).
+MATRIX_CACHE_DIR_ENV = "XCPD_MATRIX_CACHE_DIR"
+MATRIX_CACHE_SIZE_ENV = "XCPD_MATRIX_CACHE_GB"
+
+
+def read_ndata(datafile, maskfile=None, scale=0, dtype=None):
     """Read nifti or cifti file.
 
+    If the masked-matrix cache is enabled (see :func:`get_matrix_cache_dir`),
+    the data matrix is stored in it the first time a file is read,
+    and later reads of the same file, with the same mask and data type,
+    memory-map the cached matrix instead of decoding the image again.
+
     Parameters
     ----------
     datafile : str
@@ -21,31 +32,171 @@ def read_ndata(datafile, maskfile=None, scale=0):
         Path to a binary mask.
         Unused for CIFTI data.
     scale : ?
+    dtype : numpy dtype or None, optional
+        Floating-point type of the data matrix.
+        If None (default), float64 is used.
 
     Outputs
     -------
     data : (TxS) :obj:`numpy.ndarray`
         Vertices or voxels by timepoints.
+        Matrices from the cache are copy-on-write memory maps,
+        so they can be modified without changing the cache.
     """
+    dtype = np.dtype(np.float64 if dtype is None else dtype)
+
+    cache_dir = get_matrix_cache_dir()
+    if cache_dir:
+        signatures = [file_signature(datafile)]
+        if maskfile is not None and not datafile.endswith(".dtseries.nii"):
+            signatures.append(file_signature(maskfile))
+
+        cache_file = os.path.join(cache_dir, f"{cache_key(*signatures, dtype.str)}.npy")
+        data = _load_cache_entry(cache_file)
+        if data is None:
+            data = _read_ndata(datafile, maskfile, dtype)
+            _save_cache_entry(cache_file, data)
+
+    else:
+        data = _read_ndata(datafile, maskfile, dtype)
+
+    if scale > 0:
+        data = scalex(data, -scale, scale)
+
+    return data
+
+
+def _read_ndata(datafile, maskfile, dtype):
+    """Read a nifti or cifti file into an SxT matrix, without the cache."""
     # read cifti series
     if datafile.endswith(".dtseries.nii"):
-        data = nb.load(datafile).get_fdata()
+        data = nb.load(datafile).get_fdata(dtype=dtype)
 
     # or nifti data, mask is required
     elif datafile.endswith(".nii.gz"):
         assert maskfile is not None, "Input `maskfile` must be provided if `datafile` is a nifti."
-        data = masking.apply_mask(datafile, maskfile)
+        data = np.asarray(masking.apply_mask(datafile, maskfile, dtype=dtype), dtype=dtype)
+
+    # uncompressed nifti data are memory-mapped, and only in-mask voxels are read
+    elif datafile.endswith(".nii"):
+        assert maskfile is not None, "Input `maskfile` must be provided if `datafile` is a nifti."
+        mask = load_mask(maskfile)
+        img = nb.load(datafile, mmap=True)
+        data = np.asarray(np.asanyarray(img.dataobj)[mask], dtype=dtype).T
 
     else:
         raise ValueError(f"Unknown extension for {datafile}")
 
     # transpose from TxS to SxT
-    data = data.T
+    return data.T
 
-    if scale > 0:
-        data = scalex(data, -scale, scale)
 
-    return data
+def get_matrix_cache_dir():
+    """Get the directory of the masked-matrix cache.
+
+    The cache stores the matrices returned by :func:`read_ndata`, and the boolean arrays
+    returned by :func:`load_mask`, as memory-mappable ``.npy`` files.
+    Entries are keyed on the signatures (path, modification time, and size) of the data
+    and mask files, and on the data type.
+    The least recently used entries are deleted when the cache grows larger than the
+    ``XCPD_MATRIX_CACHE_GB`` environment variable (set by ``--matrix-cache-gb``).
+
+    Returns
+    -------
+    str or None
+        The ``XCPD_MATRIX_CACHE_DIR`` environment variable, which xcp_d sets to a
+        directory in the working directory.
+        None if the variable is not set, in which case the cache is disabled.
+    """
+    cache_dir = os.environ.get(MATRIX_CACHE_DIR_ENV)
+    if not cache_dir:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _get_matrix_cache_size():
+    """Get the size limit of the masked-matrix cache, in bytes."""
+    return int(float(os.environ.get(MATRIX_CACHE_SIZE_ENV, 10)) * 1024**3)
+
+
+def _load_cache_entry(cache_file):
+    """Memory-map a cached matrix, or return None if it is not in the cache."""
+    try:
+        data = np.load(cache_file, mmap_mode="c")
+    except (FileNotFoundError, ValueError):
+        # missing, or evicted by another process while being opened
+        return None
+
+    touch(cache_file)
+    # a plain array view, so results of operations on it are not memmaps themselves
+    return np.asarray(data)
+
+
+def _save_cache_entry(cache_file, data):
+    """Store a matrix in the cache, then evict entries to stay within the size limit."""
+    max_bytes = _get_matrix_cache_size()
+    if data.nbytes > max_bytes:
+        return
+
+    atomic_write(cache_file, lambda filename: np.save(filename, data))
+    evict_lru(os.path.dirname(cache_file), max_bytes)
+
+
+def load_mask(maskfile):
+    """Load a binary mask as a boolean array, through the masked-matrix cache.
+
+    The array indexes the in-mask voxels of a NIfTI image in the same order as
+    :func:`read_ndata`.
+
+    Parameters
+    ----------
+    maskfile : str
+        Path to a binary mask.
+
+    Returns
+    -------
+    mask : numpy.ndarray of bool
+        The mask. Arrays from the cache are copy-on-write memory maps.
+    """
+    cache_dir = get_matrix_cache_dir()
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f"{cache_key(file_signature(maskfile), 'mask')}.npy")
+        mask = _load_cache_entry(cache_file)
+        if mask is not None:
+            return mask
+
+    mask = np.asanyarray(nb.load(maskfile).dataobj).astype(bool)
+    if cache_dir:
+        _save_cache_entry(cache_file, mask)
+
+    return mask
+
+
+def get_work_extension(filename, work_format="nii.gz"):
+    """Get the extension of an intermediate file derived from a nifti or cifti file.
+
+    CIFTI files are never compressed. NIfTI intermediates are gzipped unless
+    ``work_format`` is "nii", in which case they are written uncompressed,
+    so :func:`read_ndata` can memory-map them.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the nifti or cifti file the intermediate is derived from.
+    work_format : {"nii.gz", "nii"}, optional
+        File format of NIfTI intermediates. Default is "nii.gz".
+
+    Returns
+    -------
+    str
+        The extension, including the leading dot.
+    """
+    if filename.endswith(".dtseries.nii"):
+        return ".dtseries.nii"
+
+    return f".{work_format}"
 
 
 def write_ndata(data_matrix, template, filename, mask=None, TR=1, scale=0):
@@ -76,7 +227,7 @@ def write_ndata(data_matrix, template, filename, mask=None, TR=1, scale=0):
 
     if template.endswith(".dtseries.nii"):
         file_format = "cifti"
-    elif template.endswith(".nii.gz"):
+    elif template.endswith((".nii.gz", ".nii")):
         file_format = "nifti"
         assert mask is not None, "A binary mask must be provided for nifti inputs."
         assert os.path.isfile(mask), f"The mask file does not exist: {mask}"
@@ -91,54 +242,297 @@ def write_ndata(data_matrix, template, filename, mask=None, TR=1, scale=0):
 
     if file_format == "cifti":
         # write cifti series
-        template_img = nb.load(template)
+        img = _new_cifti_image(data_matrix, template, TR=TR)
+
+    else:
+        # write nifti series
+        img = masking.unmask(data_matrix, mask)
+        if img.ndim == 4:
+            # we'll override the default TR (1) in the header
+            pixdim = list(img.header.get_zooms())
+            pixdim[3] = TR
+            img.header.set_zooms(pixdim)
+
+    img.to_filename(filename)
+
+    return filename
+
+
+def _new_cifti_image(data_matrix, template, TR=1):
+    """Create a CIFTI image from a TxS (or S) data matrix and a template CIFTI file.
+
+    The template's header is reused if the data have as many volumes as the template.
+    Otherwise, a series axis with the new number of volumes is built.
+    """
+    template_img = nb.load(template)
+
+    if data_matrix.ndim == 1:
+        n_volumes = 0
+    else:
+        n_volumes = data_matrix.shape[0]
+
+    if n_volumes == template_img.shape[0]:
+        # same number of volumes in data as original image
+        img = nb.Cifti2Image(
+            dataobj=data_matrix,
+            header=template_img.header,
+            file_map=template_img.file_map,
+            nifti_header=template_img.nifti_header,
+        )
+
+    else:
+        # different number of volumes in data from original image
+        # the time axis must be constructed manually based on its new length
+        ax_1 = template_img.header.get_axis(1)
+
+        if n_volumes > 0:
+            ax_0 = nb.cifti2.SeriesAxis(start=0, step=TR, size=n_volumes)
+
+            # create new header and cifti object
+            new_header = nb.cifti2.Cifti2Header.from_axes((ax_0, ax_1))
 
-        if data_matrix.ndim == 1:
-            n_volumes, n_vertices = 0, data_matrix.shape[0]
         else:
-            n_volumes, n_vertices = data_matrix.shape
-
-        if n_volumes == template_img.shape[0]:
-            # same number of volumes in data as original image
-            img = nb.Cifti2Image(
-                dataobj=data_matrix,
-                header=template_img.header,
-                file_map=template_img.file_map,
-                nifti_header=template_img.nifti_header,
+            # create new header and cifti object
+            new_header = nb.cifti2.Cifti2Header.from_axes((ax_1,))
+
+        img = nb.Cifti2Image(data_matrix, new_header)
+
+    # NOTE: Intent is necessary for plotting functions,
+    # but I don't know if we should assume that any saved CIFTI is a ConnDenseSeries.
+    img.nifti_header.set_intent("ConnDenseSeries")
+    return img
+
+
+def get_n_volumes(datafile):
+    """Get the number of timepoints in a nifti or cifti file, without reading its data.
+
+    Parameters
+    ----------
+    datafile : str
+        nifti or cifti file
+
+    Returns
+    -------
+    int
+    """
+    shape = nb.load(datafile).shape
+    if datafile.endswith(".dtseries.nii"):
+        return shape[0]
+
+    return shape[3] if len(shape) > 3 else 1
+
+
+def iter_ndata_blocks(datafile, maskfile=None, block_size=5000, dtype=None):
+    """Read a nifti or cifti file one block of voxels or vertices at a time.
+
+    The blocks are read from the image's array proxy, so the full data matrix is never
+    loaded. Concatenating the blocks along the first axis gives the same matrix as
+    :func:`read_ndata`.
+
+    NIfTI blocks are built from slabs along the first image axis, since that is the
+    order in which masked voxels are returned.
+    Gzipped NIfTI files cannot be read one slab at a time without decompressing the whole
+    file for every slab, so they are read at once with :func:`read_ndata` and split into
+    blocks in memory. Only uncompressed (``--work-format nii``) NIfTI files and CIFTI files
+    are streamed from disk.
+
+    Parameters
+    ----------
+    datafile : str
+        nifti or cifti file
+    maskfile : str or None, optional
+        Path to a binary mask. Required for NIfTI data.
+        Unused for CIFTI data.
+    block_size : int, optional
+        Maximum number of voxels/vertices per block. Default is 5000.
+        Blocks of uncompressed NIfTI files always contain at least one full slab of
+        in-mask voxels, which may exceed ``block_size``.
+    dtype : numpy dtype or None, optional
+        Floating-point type of the blocks.
+        If None (default), float64 is used.
+
+    Yields
+    ------
+    block : (S_block x T) :obj:`numpy.ndarray`
+        Voxels or vertices by timepoints.
+    """
+    dtype = np.dtype(np.float64 if dtype is None else dtype)
+
+    if datafile.endswith(".dtseries.nii"):
+        # CIFTI data are stored with time varying fastest, so vertex blocks are contiguous
+        dataobj = nb.load(datafile).dataobj
+        n_vertices = dataobj.shape[1]
+        for start in range(0, n_vertices, block_size):
+            block = dataobj[:, start:start + block_size]
+            yield np.asarray(block, dtype=dtype).T
+
+    elif datafile.endswith(".nii.gz"):
+        data = read_ndata(datafile, maskfile, dtype=dtype)
+        for start in range(0, data.shape[0], block_size):
+            yield data[start:start + block_size]
+
+    elif datafile.endswith(".nii"):
+        assert maskfile is not None, "Input `maskfile` must be provided if `datafile` is a nifti."
+        mask = load_mask(maskfile)
+        dataobj = nb.load(datafile, mmap=True).dataobj
+        n_voxels_per_slab = mask.reshape(mask.shape[0], -1).sum(axis=1)
+
+        start = 0
+        while start < mask.shape[0]:
+            # group consecutive slabs until the block would exceed block_size voxels
+            stop, n_voxels = start + 1, n_voxels_per_slab[start]
+            while (
+                stop < mask.shape[0]
+                and n_voxels + n_voxels_per_slab[stop] <= block_size
+            ):
+                n_voxels += n_voxels_per_slab[stop]
+                stop += 1
+
+            if n_voxels > 0:
+                slab = np.asanyarray(dataobj[start:stop, ...])
+                yield np.asarray(slab[mask[start:stop]], dtype=dtype)
+
+            start = stop
+
+    else:
+        raise ValueError(f"Unknown extension for {datafile}")
+
+
+class NdataWriter:
+    """Write a data matrix to a nifti or cifti file one block of voxels or vertices at a time.
+
+    The output image is allocated on disk and memory-mapped, and each block is written
+    into it in the order given by :func:`iter_ndata_blocks`, so the full data matrix is
+    never held in memory. Gzipped NIfTI files are written uncompressed first and
+    compressed when the writer is closed.
+
+    Parameters
+    ----------
+    template : str
+        Path to a template image. For CIFTI data, header information is taken from it.
+    filename : str
+        Name of the output file to be written.
+    n_volumes : int
+        Number of timepoints in the data.
+    mask : str or None, optional
+        The path to a binary mask file. Required for NIfTI data.
+        Default is None.
+    TR : float, optional
+    dtype : numpy dtype or None, optional
+        Data type of the output image.
+        If None (default), float64 is used.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        with NdataWriter(template, filename, n_volumes, mask=mask) as writer:
+            for block in iter_ndata_blocks(in_file, mask):
+                writer.write(block)
+    """
+
+    def __init__(self, template, filename, n_volumes, mask=None, TR=1, dtype=None):
+        dtype = np.dtype(np.float64 if dtype is None else dtype)
+        self.filename = filename
+        self._n_written = 0
+
+        # the empty image is written through a broadcast view, so no data are allocated
+        if template.endswith(".dtseries.nii"):
+            n_vertices = nb.load(template).shape[1]
+            empty_data = np.broadcast_to(np.zeros((), dtype=dtype), (n_volumes, n_vertices))
+            img = _new_cifti_image(empty_data, template, TR=TR)
+            self._voxel_index = None
+            self._n_rows = n_vertices
+        elif template.endswith((".nii.gz", ".nii")):
+            assert mask is not None, "A binary mask must be provided for nifti inputs."
+            mask_img = nb.load(mask)
+            mask_data = load_mask(mask)
+            empty_data = np.broadcast_to(np.zeros((), dtype=dtype), mask_data.shape + (n_volumes,))
+            img = nb.Nifti1Image(empty_data, mask_img.affine)
+            # we'll override the default TR (1) in the header
+            pixdim = list(img.header.get_zooms())
+            pixdim[3] = TR
+            img.header.set_zooms(pixdim)
+            self._voxel_index = np.nonzero(mask_data)
+            self._n_rows = self._voxel_index[0].size
+        else:
+            raise ValueError(f"Unknown extension for {template}")
+
+        img.set_data_dtype(dtype)
+        self._uncompressed_file = filename[:-3] if filename.endswith(".gz") else filename
+        img.to_filename(self._uncompressed_file)
+
+        proxy = nb.load(self._uncompressed_file).dataobj
+        self._data = np.memmap(
+            self._uncompressed_file,
+            dtype=proxy.dtype,
+            mode="r+",
+            offset=proxy.offset,
+            shape=proxy.shape,
+            order=proxy.order,
+        )
+
+    def write(self, block):
+        """Write the next block of voxels/vertices.
+
+        Parameters
+        ----------
+        block : (S_block x T) :obj:`numpy.ndarray`
+            Voxels or vertices by timepoints.
+        """
+        start, stop = self._n_written, self._n_written + block.shape[0]
+        if stop > self._n_rows:
+            raise ValueError(
+                f"Cannot write rows {start}-{stop} of a file with {self._n_rows} rows."
             )
 
+        if self._voxel_index is None:
+            self._data[:, start:stop] = block.T
         else:
-            # different number of volumes in data from original image
-            # the time axis must be constructed manually based on its new length
-            ax_1 = template_img.header.get_axis(1)
+            self._data[tuple(index[start:stop] for index in self._voxel_index)] = block
 
-            if n_volumes > 0:
-                ax_0 = nb.cifti2.SeriesAxis(start=0, step=TR, size=data_matrix.shape[0])
+        self._n_written = stop
 
-                # create new header and cifti object
-                new_header = nb.cifti2.Cifti2Header.from_axes((ax_0, ax_1))
+    def close(self):
+        """Flush the data to disk, compressing them if necessary.
 
-            else:
-                # create new header and cifti object
-                new_header = nb.cifti2.Cifti2Header.from_axes((ax_1,))
+        Returns
+        -------
+        filename : str
+            The name of the generated output file.
+        """
+        if self._data is None:
+            return self.filename
 
-            img = nb.Cifti2Image(data_matrix, new_header)
+        if self._n_written != self._n_rows:
+            raise ValueError(f"Only {self._n_written} of {self._n_rows} rows were written.")
 
-        # NOTE: Intent is necessary for plotting functions,
-        # but I don't know if we should assume that any saved CIFTI is a ConnDenseSeries.
-        img.nifti_header.set_intent("ConnDenseSeries")
+        self._data.flush()
+        self._data = None
+        if self._uncompressed_file != self.filename:
+            import gzip
+            import shutil
 
-    else:
-        # write nifti series
-        img = masking.unmask(data_matrix, mask)
-        # we'll override the default TR (1) in the header
-        pixdim = list(img.header.get_zooms())
-        pixdim[3] = TR
-        img.header.set_zooms(pixdim)
+            with open(self._uncompressed_file, "rb") as f_in:
+                with gzip.open(self.filename, "wb", compresslevel=6) as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            os.remove(self._uncompressed_file)
 
-    img.to_filename(filename)
+        return self.filename
 
-    return filename
+    def __enter__(self):
+        """Return the writer, for use as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):  # noqa: U100
+        """Close the writer, or delete the partially-written file after an error."""
+        if exc_type is None:
+            self.close()
+        else:
+            # don't leave a partially-written file behind
+            self._data = None
+            if os.path.exists(self._uncompressed_file):
+                os.remove(self._uncompressed_file)
 
 
 def edit_ciftinifti(in_file, out_file, datax):
@@ -244,30 +638,16 @@ def read_gii(surf_gii):
     return gifti_data
 
 
-def despikedatacifti(cifti, TR, basedir):
-    """Despike CIFTI file."""
-    fake_cifti1 = str(basedir + '/fake_niftix.nii.gz')
-    fake_cifti1_depike = str(basedir + '/fake_niftix_depike.nii.gz')
-    cifti_despike = str(basedir + '/despike_nifti2cifti.dtseries.nii')
-    run_shell([
-        'OMP_NUM_THREADS=2 wb_command -cifti-convert -to-nifti ', cifti,
-        fake_cifti1
-    ])
-    run_shell(
-        ['3dDespike -nomask -NEW -prefix', fake_cifti1_depike, fake_cifti1])
-    run_shell([
-        'OMP_NUM_THREADS=2 wb_command  -cifti-convert -from-nifti  ',
-        fake_cifti1_depike, cifti, cifti_despike, '-reset-timepoints',
-        str(TR),
-        str(0)
-    ])
-    return cifti_despike
-
-
-def scalex(X, x_min, x_max):
-    """Scale data to between minimum and maximum values."""
-    nom = (X - X.min()) * (x_max - x_min)
-    denom = X.max() - X.min()
+def scalex(X, x_min, x_max, data_min=None, data_max=None):
+    """Scale data to between minimum and maximum values.
+
+    The data's own range is used unless ``data_min`` and ``data_max`` are provided,
+    e.g., from :func:`~xcp_d.utils.qcmetrics.compute_qc_statistics`.
+    """
+    data_min = X.min() if data_min is None else data_min
+    data_max = X.max() if data_max is None else data_max
+    nom = (X - data_min) * (x_max - x_min)
+    denom = data_max - data_min
 
     if denom == 0:
         denom = 1
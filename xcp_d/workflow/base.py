@@ -60,6 +60,12 @@ def init_xcpd_wf(
     work_dir,
     dummytime,
     fd_thresh,
+    filter_engine="filtfilt",
+    fft_response="butterworth",
+    interpolation="linear",
+    stack_atlases=False,
+    work_format="nii.gz",
+    precision="float64",
     process_surfaces=False,
     input_type='fmriprep',
     name='xcpd_wf',
@@ -99,6 +105,12 @@ def init_xcpd_wf(
                 work_dir=".",
                 dummytime=0,
                 fd_thresh=0.2,
+                filter_engine="filtfilt",
+                fft_response="butterworth",
+                interpolation="linear",
+                stack_atlases=False,
+                work_format="nii.gz",
+                precision="float64",
                 process_surfaces=False,
                 input_type='fmriprep',
                 name='xcpd_wf',
@@ -141,6 +153,12 @@ def init_xcpd_wf(
         path to cusrtom nuisance regressors
     dummytime: float
         the first vols in seconds to be removed before postprocessing
+    %(filter_engine)s
+    %(fft_response)s
+    %(interpolation)s
+    %(stack_atlases)s
+    %(work_format)s
+    %(precision)s
     %(process_surfaces)s
     %(input_type)s
     %(name)s
@@ -179,6 +197,12 @@ def init_xcpd_wf(
             dummytime=dummytime,
             custom_confounds=custom_confounds,
             fd_thresh=fd_thresh,
+            filter_engine=filter_engine,
+            fft_response=fft_response,
+            interpolation=interpolation,
+            stack_atlases=stack_atlases,
+            work_format=work_format,
+            precision=precision,
             process_surfaces=process_surfaces,
             input_type=input_type,
             name=f"single_subject_{subject_id}_wf",
@@ -220,6 +244,12 @@ def init_subject_wf(
     process_surfaces,
     output_dir,
     input_type,
+    filter_engine,
+    fft_response,
+    interpolation,
+    stack_atlases,
+    work_format,
+    precision,
     name,
 ):
     """Organize the postprocessing pipeline for a single subject.
@@ -255,6 +285,12 @@ def init_subject_wf(
                 process_surfaces=False,
                 output_dir=".",
                 input_type="fmriprep",
+                filter_engine="filtfilt",
+                fft_response="butterworth",
+                interpolation="linear",
+                stack_atlases=False,
+                work_format="nii.gz",
+                precision="float64",
                 name="single_subject_sub-01_wf",
             )
 
@@ -291,6 +327,12 @@ def init_subject_wf(
     %(process_surfaces)s
     %(subject_id)s
     %(input_type)s
+    %(filter_engine)s
+    %(fft_response)s
+    %(interpolation)s
+    %(stack_atlases)s
+    %(work_format)s
+    %(precision)s
     %(name)s
 
     References
@@ -309,6 +351,12 @@ def init_subject_wf(
     # determine the appropriate post-processing workflow
     postproc_wf_function = init_ciftipostprocess_wf if cifti else init_boldpostprocess_wf
     preproc_files = preproc_cifti_files if cifti else preproc_nifti_files
+    # CIFTI atlases are already in the same space as the BOLD data, so they are never warped,
+    # and CIFTI intermediates are never compressed
+    postproc_kwargs = {} if cifti else {
+        "stack_atlases": stack_atlases,
+        "work_format": work_format,
+    }
 
     inputnode = pe.Node(
         niu.IdentityInterface(fields=['custom_confounds', 'subj_data']),
@@ -473,7 +521,12 @@ It is released under the [CC0](https://creativecommons.org/publicdomain/zero/1.0
             dummytime=dummytime,
             fd_thresh=fd_thresh,
             output_dir=output_dir,
+            filter_engine=filter_engine,
+            fft_response=fft_response,
+            interpolation=interpolation,
+            precision=precision,
             name=f"{'cifti' if cifti else 'nifti'}_postprocess_{i_run}_wf",
+            **postproc_kwargs,
         )
 
         workflow.connect(
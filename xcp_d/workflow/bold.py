@@ -5,7 +5,6 @@ import os
 
 import nibabel as nb
 import numpy as np
-import sklearn
 from nipype import Function, logging
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
@@ -15,18 +14,18 @@ from num2words import num2words
 from templateflow.api import get as get_template
 
 from xcp_d.interfaces.bids import DerivativesDataSink
-from xcp_d.interfaces.filtering import FilteringData
-from xcp_d.interfaces.prepostcleaning import CensorScrub, Interpolate, RemoveTR
+from xcp_d.interfaces.connectivity import ComposeTransforms
+from xcp_d.interfaces.prepostcleaning import CensorScrub, RemoveTR
 from xcp_d.interfaces.qc_plot import CensoringPlot, QCPlot
-from xcp_d.interfaces.regression import Regress
+from xcp_d.interfaces.regression import Denoise, Despike
 from xcp_d.interfaces.report import FunctionalSummary
-from xcp_d.interfaces.resting_state import DespikePatch
 from xcp_d.utils.concantenation import _t12native
 from xcp_d.utils.doc import fill_doc
 from xcp_d.utils.utils import (
     get_maskfiles,
     get_transformfile,
     get_transformfilex,
+    stringforfilter,
     stringforparams,
 )
 from xcp_d.workflow.connectivity import init_nifti_functional_connectivity_wf
@@ -59,6 +58,12 @@ def init_boldpostprocess_wf(
     fd_thresh,
     n_runs,
     despike,
+    filter_engine="filtfilt",
+    fft_response="butterworth",
+    interpolation="linear",
+    stack_atlases=False,
+    work_format="nii.gz",
+    precision="float64",
     layout=None,
     name='bold_postprocess_wf',
 ):
@@ -90,6 +95,12 @@ def init_boldpostprocess_wf(
                 fd_thresh=0.2,
                 n_runs=1,
                 despike=False,
+                filter_engine="filtfilt",
+                fft_response="butterworth",
+                interpolation="linear",
+                stack_atlases=False,
+                work_format="nii.gz",
+                precision="float64",
                 layout=None,
                 name='bold_postprocess_wf',
             )
@@ -119,7 +130,13 @@ def init_boldpostprocess_wf(
     %(fd_thresh)s
     n_runs
     despike: bool
-        If True, run 3dDespike from AFNI
+        If True, truncate spikes in the BOLD data before regression
+    %(filter_engine)s
+    %(fft_response)s
+    %(interpolation)s
+    %(stack_atlases)s
+    %(work_format)s
+    %(precision)s
     layout : BIDSLayout object
         BIDS dataset layout
     %(name)s
@@ -219,10 +236,20 @@ def init_boldpostprocess_wf(
         )
 
     if despike:
-        despike_str = "despiked, mean-centered, and linearly detrended"
+        despike_str = (
+            "despiked (using the algorithm of *3dDespike* in AFNI [@afni]), "
+            "mean-centered, and linearly detrended"
+        )
     else:
         despike_str = "mean-centered and linearly detrended"
 
+    if interpolation == "spectral":
+        interpolation_str = (
+            "a Lomb-Scargle spectral reconstruction of the retained volumes [@power_fd_dvars]"
+        )
+    else:
+        interpolation_str = "linear interpolation between the nearest retained volumes"
+
     workflow.__desc__ = f"""\
 For each of the {num2words(n_runs)} BOLD series found per subject (across all tasks and sessions),
 the following post-processing was performed.
@@ -233,12 +260,13 @@ Volumes with {'filtered ' if motion_filter_type else ''}framewise displacement g
 {filter_post_str}
 Before nuisance regression, but after censoring, the BOLD data were {despike_str}.
 {stringforparams(params=params)} [@benchmarkp;@satterthwaite_2013].
-These nuisance regressors were regressed from the BOLD data using linear regression -
-as implemented in Scikit-Learn {sklearn.__version__} [@scikit-learn].
+These nuisance regressors were regressed from the BOLD data using linear least-squares
+regression, as implemented in NumPy {np.__version__} [@harris2020array].
 Any volumes censored earlier in the workflow were then interpolated in the residual time series
-produced by the regression.
+produced by the regression, using {interpolation_str}.
 The interpolated timeseries were then band-pass filtered to retain signals within the
-{lower_bpf}-{upper_bpf} Hz frequency band.
+{lower_bpf}-{upper_bpf} Hz frequency band, using
+{stringforfilter(filter_engine, fft_response, bpf_order)}.
 """
 
     # get reference and mask
@@ -286,12 +314,13 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         name='outputnode',
     )
 
-    mem_gbx = _create_mem_gb(bold_file)
+    mem_gbx = _create_mem_gb(bold_file, precision=precision)
 
     fcon_ts_wf = init_nifti_functional_connectivity_wf(
         mem_gb=mem_gbx['timeseries'],
         name="fcons_ts_wf",
         omp_nthreads=omp_nthreads,
+        stack_atlases=stack_atlases,
     )
 
     alff_compute_wf = init_compute_alff_wf(mem_gb=mem_gbx['timeseries'],
@@ -300,12 +329,15 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
                                            highpass=lower_bpf,
                                            smoothing=smoothing,
                                            cifti=False,
+                                           work_format=work_format,
+                                           precision=precision,
                                            name="compute_alff_wf",
                                            omp_nthreads=omp_nthreads)
 
     reho_compute_wf = init_3d_reho_wf(mem_gb=mem_gbx['timeseries'],
                                       name="afni_reho_wf",
-                                      omp_nthreads=omp_nthreads)
+                                      omp_nthreads=omp_nthreads,
+                                      precision=precision)
 
     write_derivative_wf = init_writederivatives_wf(
         smoothing=smoothing,
@@ -329,7 +361,8 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         motion_filter_type=motion_filter_type,
         motion_filter_order=motion_filter_order,
         head_radius=head_radius,
-        fd_thresh=fd_thresh),
+        fd_thresh=fd_thresh,
+        work_format=work_format),
         name='censoring',
         mem_gb=mem_gbx['timeseries'],
         omp_nthreads=omp_nthreads)
@@ -341,26 +374,21 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         name="resd_smoothing_wf",
         omp_nthreads=omp_nthreads)
 
-    filtering_wf = pe.Node(
-        FilteringData(
+    denoise_bold = pe.Node(
+        Denoise(
             TR=TR,
+            original_file=bold_file,
+            params=params,
             lowpass=upper_bpf,
             highpass=lower_bpf,
             filter_order=bpf_order,
-            bandpass_filter=bandpass_filter),
-        name="filtering_wf",
-        mem_gb=mem_gbx['timeseries'],
-        n_procs=omp_nthreads)
-
-    regression_wf = pe.Node(
-        Regress(TR=TR, original_file=bold_file, params=params),
-        name="regression_wf",
-        mem_gb=mem_gbx['timeseries'],
-        n_procs=omp_nthreads)
-
-    interpolate_wf = pe.Node(
-        Interpolate(TR=TR),
-        name="interpolation_wf",
+            bandpass_filter=bandpass_filter,
+            filter_engine=filter_engine,
+            fft_response=fft_response,
+            interpolation=interpolation,
+            work_format=work_format,
+            precision=precision),
+        name="denoise_bold",
         mem_gb=mem_gbx['timeseries'],
         n_procs=omp_nthreads)
 
@@ -370,6 +398,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         layout=layout,
         mem_gb=mem_gbx['timeseries'],
         output_dir=output_dir,
+        precision=precision,
         omp_nthreads=omp_nthreads)
 
     # get transform file for resampling and fcon
@@ -408,6 +437,40 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
                                                   ("t1w_to_native", "t1w_to_native")]),
     ])
 
+    # Compose each chain of transforms into a single displacement field on the target grid,
+    # so the warps below do not load and compose the h5 transforms again.
+    compose_std2native = pe.Node(
+        ComposeTransforms(dimension=3),
+        name='compose_std2native_transform',
+        n_procs=omp_nthreads,
+        mem_gb=mem_gbx['timeseries'])
+
+    compose_bold2T1w = pe.Node(
+        ComposeTransforms(dimension=3),
+        name='compose_bold2t1_transform',
+        n_procs=omp_nthreads,
+        mem_gb=mem_gbx['timeseries'])
+
+    mni_mask = str(
+        get_template('MNI152NLin2009cAsym',
+                     resolution=2,
+                     desc='brain',
+                     suffix='mask',
+                     extension=['.nii', '.nii.gz']))
+    compose_bold2MNI = pe.Node(
+        ComposeTransforms(dimension=3, reference_image=mni_mask),
+        name='compose_bold2mni_transform',
+        n_procs=omp_nthreads,
+        mem_gb=mem_gbx['timeseries'])
+
+    workflow.connect([
+        (inputnode, compose_std2native, [('ref_file', 'reference_image')]),
+        (get_std2native_transform, compose_std2native, [('transform_list', 'transforms')]),
+        (get_t1w_mask, compose_bold2T1w, [('t1w_mask', 'reference_image')]),
+        (get_native2space_transforms, compose_bold2T1w, [('bold2T1w_trans', 'transforms')]),
+        (get_native2space_transforms, compose_bold2MNI, [('bold2MNI_trans', 'transforms')]),
+    ])
+
     resample_parc = pe.Node(ApplyTransforms(
         dimension=3,
         input_image=str(
@@ -431,25 +494,20 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
 
     workflow.connect([
         (get_t1w_mask, resample_bold2T1w, [('t1w_mask', 'reference_image')]),
-        (get_native2space_transforms, resample_bold2T1w, [('bold2T1w_trans', 'transforms')]),
+        (compose_bold2T1w, resample_bold2T1w, [('output_image', 'transforms')]),
     ])
 
     resample_bold2MNI = pe.Node(ApplyTransforms(
         dimension=3,
         input_image=mask_file,
-        reference_image=str(
-            get_template('MNI152NLin2009cAsym',
-                         resolution=2,
-                         desc='brain',
-                         suffix='mask',
-                         extension=['.nii', '.nii.gz'])),
+        reference_image=mni_mask,
         interpolation='NearestNeighbor'),
         name='bold2mni_trans',
         n_procs=omp_nthreads,
         mem_gb=mem_gbx['timeseries'])
 
     workflow.connect([
-        (get_native2space_transforms, resample_bold2MNI, [('bold2MNI_trans', 'transforms')]),
+        (compose_bold2MNI, resample_bold2MNI, [('output_image', 'transforms')]),
     ])
 
     censor_report = pe.Node(
@@ -482,6 +540,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
                 )
             ),
             head_radius=head_radius,
+            precision=precision,
         ),
         name="qc_report",
         mem_gb=mem_gbx['timeseries'],
@@ -501,7 +560,8 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
     if dummytime > 0:
         rm_dummytime = pe.Node(
             RemoveTR(initial_volumes_to_drop=initial_volumes_to_drop,
-                     custom_confounds=custom_confounds),
+                     custom_confounds=custom_confounds,
+                     work_format=work_format),
             name="remove_dummy_time",
             mem_gb=0.1 * mem_gbx['timeseries'])
         workflow.connect([
@@ -533,46 +593,41 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         # and data, and different from temporal censoring. It can be added to the
         # command line arguments with --despike.
 
-        despike3d = pe.Node(DespikePatch(
-            outputtype='NIFTI_GZ',
-            args='-NEW'),
-            name="despike3d",
-            mem_gb=mem_gbx['timeseries'],
-            n_procs=omp_nthreads)
+        despike3d = pe.Node(Despike(TR=TR,
+                                    num_threads=omp_nthreads,
+                                    work_format=work_format,
+                                    precision=precision),
+                            name="despike3d",
+                            mem_gb=mem_gbx['timeseries'],
+                            n_procs=omp_nthreads)
 
-        workflow.connect([(censor_scrub, despike3d, [('bold_censored', 'in_file')])])
+        workflow.connect([(censor_scrub, despike3d, [('bold_censored', 'in_file')]),
+                          (inputnode, despike3d, [('bold_mask', 'mask')])])
         # Censor Scrub:
         workflow.connect([
-            (despike3d, regression_wf, [
-                ('out_file', 'in_file')]),
-            (inputnode, regression_wf, [('bold_mask', 'mask')]),
-            (censor_scrub, regression_wf,
+            (despike3d, denoise_bold, [
+                ('des_file', 'in_file')]),
+            (inputnode, denoise_bold, [('bold_mask', 'mask')]),
+            (censor_scrub, denoise_bold,
              [('fmriprep_confounds_censored', 'confounds'),
               ('custom_confounds_censored', 'custom_confounds')])])
 
     else:  # If we don't despike
         # regression workflow
-        workflow.connect([(inputnode, regression_wf, [('bold_mask', 'mask')]),
-                          (censor_scrub, regression_wf,
+        workflow.connect([(inputnode, denoise_bold, [('bold_mask', 'mask')]),
+                          (censor_scrub, denoise_bold,
                          [('bold_censored', 'in_file'),
                           ('fmriprep_confounds_censored', 'confounds'),
                           ('custom_confounds_censored', 'custom_confounds')])])
 
-    # interpolation workflow
+    # interpolation inputs
     workflow.connect([
-        (inputnode, interpolate_wf, [('bold_file', 'bold_file'),
-                                     ('bold_mask', 'mask_file')]),
-        (censor_scrub, interpolate_wf, [('tmask', 'tmask')]),
-        (regression_wf, interpolate_wf, [('res_file', 'in_file')])
+        (inputnode, denoise_bold, [('bold_file', 'bold_file')]),
+        (censor_scrub, denoise_bold, [('tmask', 'tmask')]),
     ])
 
-    # add filtering workflow
-    workflow.connect([(inputnode, filtering_wf, [('bold_mask', 'mask')]),
-                      (interpolate_wf, filtering_wf, [('bold_interpolated',
-                                                       'in_file')])])
-
     # residual smoothing
-    workflow.connect([(filtering_wf, resdsmoothing_wf,
+    workflow.connect([(denoise_bold, resdsmoothing_wf,
                        [('filtered_file', 'inputnode.bold_file')])])
 
     # functional connect workflow
@@ -581,27 +636,27 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
                                  ('ref_file', 'inputnode.ref_file'),
                                  ('mni_to_t1w', 'inputnode.mni_to_t1w'),
                                  ('t1w_to_native', 'inputnode.t1w_to_native')]),
-        (filtering_wf, fcon_ts_wf, [('filtered_file', 'inputnode.clean_bold')])
+        (denoise_bold, fcon_ts_wf, [('filtered_file', 'inputnode.clean_bold')])
     ])
 
     # reho and alff
     workflow.connect([
         (inputnode, alff_compute_wf, [('bold_mask', 'inputnode.bold_mask')]),
         (inputnode, reho_compute_wf, [('bold_mask', 'inputnode.bold_mask')]),
-        (filtering_wf, alff_compute_wf, [('filtered_file', 'inputnode.clean_bold')
+        (denoise_bold, alff_compute_wf, [('filtered_file', 'inputnode.clean_bold')
                                          ]),
-        (filtering_wf, reho_compute_wf, [('filtered_file', 'inputnode.clean_bold')
+        (denoise_bold, reho_compute_wf, [('filtered_file', 'inputnode.clean_bold')
                                          ]),
     ])
 
     # qc report
     workflow.connect([
         (inputnode, qcreport, [('bold_mask', 'mask_file')]),
-        (filtering_wf, qcreport, [('filtered_file', 'cleaned_file')]),
+        (denoise_bold, qcreport, [('filtered_file', 'cleaned_file')]),
         (censor_scrub, qcreport, [('tmask', 'tmask')]),
         (censor_scrub, censor_report, [('tmask', 'tmask')]),
         (inputnode, resample_parc, [('ref_file', 'reference_image')]),
-        (get_std2native_transform, resample_parc, [('transform_list', 'transforms')]),
+        (compose_std2native, resample_parc, [('output_image', 'transforms')]),
         (resample_parc, qcreport, [('output_image', 'seg_file')]),
         (resample_bold2T1w, qcreport, [('output_image', 'bold2T1w_mask')]),
         (resample_bold2MNI, qcreport, [('output_image', 'bold2temp_mask')]),
@@ -610,7 +665,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
 
     # write  to the outputnode, may be use in future
     workflow.connect([
-        (filtering_wf, outputnode, [('filtered_file', 'processed_bold')]),
+        (denoise_bold, outputnode, [('filtered_file', 'processed_bold')]),
         (censor_scrub, outputnode, [('filtered_motion', 'filtered_motion'),
                                     ('tmask', 'tmask')]),
         (resdsmoothing_wf, outputnode, [('outputnode.smoothed_bold',
@@ -626,7 +681,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
 
     # write derivatives
     workflow.connect([
-        (filtering_wf, write_derivative_wf, [('filtered_file',
+        (denoise_bold, write_derivative_wf, [('filtered_file',
                                               'inputnode.processed_bold')]),
         (resdsmoothing_wf, write_derivative_wf, [('outputnode.smoothed_bold',
                                                   'inputnode.smoothed_bold')]),
@@ -725,15 +780,14 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
                                           ('bold_file', 'inputnode.bold_file'),
                                           ('bold_mask', 'inputnode.mask'),
                                           ('mni_to_t1w', 'inputnode.mni_to_t1w')]),
-        (regression_wf, executivesummary_wf, [('res_file', 'inputnode.regressed_data')]),
-        (filtering_wf, executivesummary_wf, [('filtered_file', 'inputnode.residual_data')]),
+        (denoise_bold, executivesummary_wf, [('filtered_file', 'inputnode.residual_data')]),
         (censor_scrub, executivesummary_wf, [('filtered_motion', 'inputnode.filtered_motion')]),
     ])
 
     return workflow
 
 
-def _create_mem_gb(bold_fname):
+def _create_mem_gb(bold_fname, precision="float64"):
     bold_size_gb = os.path.getsize(bold_fname) / (1024**3)
     bold_tlen = nb.load(bold_fname).shape[-1]
     mem_gbz = {
@@ -749,6 +803,11 @@ def _create_mem_gb(bold_fname):
         mem_gbz['timeseries'] = 8.0
         mem_gbz['resampled'] = 3
 
+    # data matrices held in single precision take half the memory
+    precision_scale = np.dtype(precision).itemsize / np.dtype(np.float64).itemsize
+    mem_gbz['timeseries'] *= precision_scale
+    mem_gbz['resampled'] *= precision_scale
+
     return mem_gbz
 
 
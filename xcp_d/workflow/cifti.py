@@ -5,7 +5,6 @@ import os
 
 import nibabel as nb
 import numpy as np
-import sklearn
 from nipype import logging
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
@@ -13,14 +12,13 @@ from niworkflows.engine.workflows import LiterateWorkflow as Workflow
 from num2words import num2words
 
 from xcp_d.interfaces.bids import DerivativesDataSink
-from xcp_d.interfaces.filtering import FilteringData
-from xcp_d.interfaces.prepostcleaning import CensorScrub, Interpolate, RemoveTR
+from xcp_d.interfaces.prepostcleaning import CensorScrub, RemoveTR
 from xcp_d.interfaces.qc_plot import CensoringPlot, QCPlot
-from xcp_d.interfaces.regression import CiftiDespike, Regress
+from xcp_d.interfaces.regression import Denoise, Despike
 from xcp_d.interfaces.report import FunctionalSummary
 from xcp_d.utils.doc import fill_doc
 from xcp_d.utils.plot import _get_tr
-from xcp_d.utils.utils import stringforparams
+from xcp_d.utils.utils import stringforfilter, stringforparams
 from xcp_d.workflow.connectivity import init_cifti_functional_connectivity_wf
 from xcp_d.workflow.execsummary import init_execsummary_wf
 from xcp_d.workflow.outputs import init_writederivatives_wf
@@ -51,6 +49,10 @@ def init_ciftipostprocess_wf(
     fd_thresh,
     despike,
     n_runs,
+    filter_engine="filtfilt",
+    fft_response="butterworth",
+    interpolation="linear",
+    precision="float64",
     layout=None,
     name='cifti_process_wf',
 ):
@@ -82,6 +84,10 @@ def init_ciftipostprocess_wf(
                 fd_thresh=0.2,
                 despike=False,
                 n_runs=1,
+                filter_engine="filtfilt",
+                fft_response="butterworth",
+                interpolation="linear",
+                precision="float64",
                 layout=None,
                 name='cifti_postprocess_wf',
             )
@@ -108,8 +114,12 @@ def init_ciftipostprocess_wf(
         the first few seconds to be removed before postprocessing
     %(fd_thresh)s
     despike: bool
-        afni depsike
+        If True, truncate spikes in the BOLD data before regression
     n_runs
+    %(filter_engine)s
+    %(fft_response)s
+    %(interpolation)s
+    %(precision)s
     layout : BIDSLayout object
         BIDS dataset layout
     %(name)s
@@ -202,10 +212,20 @@ def init_ciftipostprocess_wf(
         )
 
     if despike:
-        despike_str = "despiked, mean-centered, and linearly detrended"
+        despike_str = (
+            "despiked (using the algorithm of *3dDespike* in AFNI [@afni]), "
+            "mean-centered, and linearly detrended"
+        )
     else:
         despike_str = "mean-centered and linearly detrended"
 
+    if interpolation == "spectral":
+        interpolation_str = (
+            "a Lomb-Scargle spectral reconstruction of the retained volumes [@power_fd_dvars]"
+        )
+    else:
+        interpolation_str = "linear interpolation between the nearest retained volumes"
+
     workflow.__desc__ = f"""\
 For each of the {num2words(n_runs)} BOLD series found per subject (across all tasks and sessions),
 the following post-processing was performed.
@@ -216,12 +236,13 @@ Volumes with {'filtered ' if motion_filter_type else ''}framewise displacement g
 {filter_post_str}
 Before nuisance regression, but after censoring, the BOLD data were {despike_str}.
 {stringforparams(params=params)} [@benchmarkp;@satterthwaite_2013].
-These nuisance regressors were regressed from the BOLD data using linear regression -
-as implemented in Scikit-Learn {sklearn.__version__} [@scikit-learn].
+These nuisance regressors were regressed from the BOLD data using linear least-squares
+regression, as implemented in NumPy {np.__version__} [@harris2020array].
 Any volumes censored earlier in the workflow were then interpolated in the residual time series
-produced by the regression.
+produced by the regression, using {interpolation_str}.
 The interpolated timeseries were then band-pass filtered to retain signals within the
-{lower_bpf}-{upper_bpf} Hz frequency band.
+{lower_bpf}-{upper_bpf} Hz frequency band, using
+{stringforfilter(filter_engine, fft_response, bpf_order)}.
 """
 
     inputnode = pe.Node(
@@ -261,12 +282,12 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         name='outputnode',
     )
 
-    mem_gbx = _create_mem_gb(bold_file)
+    mem_gbx = _create_mem_gb(bold_file, precision=precision)
 
     fcon_ts_wf = init_cifti_functional_connectivity_wf(
         mem_gb=mem_gbx['timeseries'],
-        name='cifti_ts_con_wf',
-        omp_nthreads=omp_nthreads)
+        precision=precision,
+        name='cifti_ts_con_wf')
 
     alff_compute_wf = init_compute_alff_wf(
         mem_gb=mem_gbx['timeseries'],
@@ -275,6 +296,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         highpass=lower_bpf,
         smoothing=smoothing,
         cifti=True,
+        precision=precision,
         name="compute_alff_wf",
         omp_nthreads=omp_nthreads)
 
@@ -317,26 +339,20 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         name="resd_smoothing_wf",
         omp_nthreads=omp_nthreads)
 
-    filtering_wf = pe.Node(
-        FilteringData(
+    denoise_bold = pe.Node(
+        Denoise(
             TR=TR,
+            original_file=bold_file,
+            params=params,
             lowpass=upper_bpf,
             highpass=lower_bpf,
             filter_order=bpf_order,
-            bandpass_filter=bandpass_filter),
-        name="filtering_wf",
-        mem_gb=mem_gbx['timeseries'],
-        n_procs=omp_nthreads)
-
-    regression_wf = pe.Node(
-        Regress(TR=TR, original_file=bold_file, params=params),
-        name="regression_wf",
-        mem_gb=mem_gbx['timeseries'],
-        n_procs=omp_nthreads)
-
-    interpolate_wf = pe.Node(
-        Interpolate(TR=TR),
-        name="interpolation_wf",
+            bandpass_filter=bandpass_filter,
+            filter_engine=filter_engine,
+            fft_response=fft_response,
+            interpolation=interpolation,
+            precision=precision),
+        name="denoise_bold",
         mem_gb=mem_gbx['timeseries'],
         n_procs=omp_nthreads)
 
@@ -345,6 +361,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
             TR=TR,
             dummytime=dummytime,
             head_radius=head_radius,
+            precision=precision,
         ),
         name="qc_report",
         mem_gb=mem_gbx['resampled'],
@@ -373,6 +390,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         output_dir=output_dir,
         omp_nthreads=omp_nthreads,
         mem_gb=mem_gbx['timeseries'],
+        precision=precision,
     )
 
     # Remove TR first:
@@ -401,7 +419,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
             ])])
 
     if despike:  # If we despike
-        despike3d = pe.Node(CiftiDespike(TR=TR),
+        despike3d = pe.Node(Despike(TR=TR, num_threads=omp_nthreads, precision=precision),
                             name="cifti_despike",
                             mem_gb=mem_gbx['timeseries'],
                             n_procs=omp_nthreads)
@@ -409,55 +427,50 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
         workflow.connect([(censor_scrub, despike3d, [('bold_censored', 'in_file')])])
         # Censor Scrub:
         workflow.connect([
-            (despike3d, regression_wf, [
+            (despike3d, denoise_bold, [
                 ('des_file', 'in_file')]),
-            (censor_scrub, regression_wf,
+            (censor_scrub, denoise_bold,
              [('fmriprep_confounds_censored', 'confounds'),
               ('custom_confounds_censored', 'custom_confounds')])])
 
     else:  # If we don't despike
         # regression workflow
-        workflow.connect([(censor_scrub, regression_wf,
+        workflow.connect([(censor_scrub, denoise_bold,
                          [('bold_censored', 'in_file'),
                           ('fmriprep_confounds_censored', 'confounds'),
                           ('custom_confounds_censored', 'custom_confounds')])])
 
-    # interpolation workflow
+    # interpolation inputs
     workflow.connect([
-        (inputnode, interpolate_wf, [('bold_file', 'bold_file')]),
-        (censor_scrub, interpolate_wf, [('tmask', 'tmask')]),
-        (regression_wf, interpolate_wf, [('res_file', 'in_file')])
+        (inputnode, denoise_bold, [('bold_file', 'bold_file')]),
+        (censor_scrub, denoise_bold, [('tmask', 'tmask')]),
     ])
 
-    # add filtering workflow
-    workflow.connect([(interpolate_wf, filtering_wf, [('bold_interpolated',
-                                                       'in_file')])])
-
     # residual smoothing
-    workflow.connect([(filtering_wf, resdsmoothing_wf,
+    workflow.connect([(denoise_bold, resdsmoothing_wf,
                        [('filtered_file', 'inputnode.bold_file')])])
 
     # functional connect workflow
-    workflow.connect([(filtering_wf, fcon_ts_wf, [('filtered_file', 'inputnode.clean_bold')])])
+    workflow.connect([(denoise_bold, fcon_ts_wf, [('filtered_file', 'inputnode.clean_bold')])])
 
     # reho and alff
-    workflow.connect([(filtering_wf, alff_compute_wf,
+    workflow.connect([(denoise_bold, alff_compute_wf,
                        [('filtered_file', 'inputnode.clean_bold')]),
-                      (filtering_wf, reho_compute_wf,
+                      (denoise_bold, reho_compute_wf,
                        [('filtered_file', 'inputnode.clean_bold')])])
 
     # qc report
     workflow.connect([
         (inputnode, qcreport, [("bold_file", "bold_file")]),
         (inputnode, censor_report, [("bold_file", "bold_file")]),
-        (filtering_wf, qcreport, [('filtered_file', 'cleaned_file')]),
+        (denoise_bold, qcreport, [('filtered_file', 'cleaned_file')]),
         (censor_scrub, qcreport, [("tmask", "tmask")]),
         (censor_scrub, censor_report, [('tmask', 'tmask')]),
         (qcreport, outputnode, [('qc_file', 'qc_file')])
     ])
 
     workflow.connect([
-        (filtering_wf, outputnode, [('filtered_file', 'processed_bold')]),
+        (denoise_bold, outputnode, [('filtered_file', 'processed_bold')]),
         (censor_scrub, outputnode, [('filtered_motion', 'filtered_motion'),
                                     ('tmask', 'tmask')]),
         (resdsmoothing_wf, outputnode, [('outputnode.smoothed_bold',
@@ -472,7 +485,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
 
     # write derivatives
     workflow.connect([
-        (filtering_wf, write_derivative_wf, [('filtered_file',
+        (denoise_bold, write_derivative_wf, [('filtered_file',
                                               'inputnode.processed_bold')]),
         (resdsmoothing_wf, write_derivative_wf, [('outputnode.smoothed_bold',
                                                   'inputnode.smoothed_bold')]),
@@ -555,10 +568,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
                                           ('t1seg', 'inputnode.t1seg'),
                                           ('bold_file', 'inputnode.bold_file'),
                                           ('mni_to_t1w', 'inputnode.mni_to_t1w')]),
-        (regression_wf, executivesummary_wf, [('res_file', 'inputnode.regressed_data')
-                                              ]),
-        (filtering_wf, executivesummary_wf, [('filtered_file',
-                                              'inputnode.residual_data')]),
+        (denoise_bold, executivesummary_wf, [('filtered_file', 'inputnode.residual_data')]),
         (censor_scrub, executivesummary_wf, [('filtered_motion',
                                               'inputnode.filtered_motion')]),
     ])
@@ -566,7 +576,7 @@ The interpolated timeseries were then band-pass filtered to retain signals withi
     return workflow
 
 
-def _create_mem_gb(bold_fname):
+def _create_mem_gb(bold_fname, precision="float64"):
     bold_size_gb = os.path.getsize(bold_fname) / (1024**3)
     bold_tlen = nb.load(bold_fname).shape[-1]
     mem_gbz = {
@@ -575,4 +585,9 @@ def _create_mem_gb(bold_fname):
         'timeseries': bold_size_gb * (max(bold_tlen / 100, 1.0) + 4),
     }
 
+    # data matrices held in single precision take half the memory
+    precision_scale = np.dtype(precision).itemsize / np.dtype(np.float64).itemsize
+    mem_gbz['timeseries'] *= precision_scale
+    mem_gbz['resampled'] *= precision_scale
+
     return mem_gbz
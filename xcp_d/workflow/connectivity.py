@@ -2,14 +2,20 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 """Workflows for extracting time series and computing functional connectivity."""
 
-import nilearn as nl
 from nipype import Function
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
 from niworkflows.engine.workflows import LiterateWorkflow as Workflow
 
-from xcp_d.interfaces.connectivity import ApplyTransformsx, ConnectPlot, NiftiConnect
-from xcp_d.interfaces.workbench import CiftiCorrelation, CiftiParcellate
+from xcp_d.interfaces.connectivity import (
+    ApplyTransformsx,
+    CiftiConnect,
+    ComposeTransforms,
+    ConnectPlot,
+    NiftiConnect,
+    SplitAtlases,
+    StackAtlases,
+)
 from xcp_d.utils.atlas import get_atlas_cifti, get_atlas_names, get_atlas_nifti
 from xcp_d.utils.doc import fill_doc
 from xcp_d.utils.utils import get_transformfile
@@ -19,6 +25,7 @@ from xcp_d.utils.utils import get_transformfile
 def init_nifti_functional_connectivity_wf(
     mem_gb,
     omp_nthreads,
+    stack_atlases=False,
     name="nifti_fcon_wf",
 ):
     """Extract BOLD time series and compute functional connectivity.
@@ -32,6 +39,7 @@ def init_nifti_functional_connectivity_wf(
             wf = init_nifti_functional_connectivity_wf(
                 mem_gb=0.1,
                 omp_nthreads=1,
+                stack_atlases=False,
                 name="nifti_fcon_wf",
             )
 
@@ -39,6 +47,7 @@ def init_nifti_functional_connectivity_wf(
     ----------
     %(mem_gb)s
     %(omp_nthreads)s
+    %(stack_atlases)s
     %(name)s
         Default is "nifti_fcon_wf".
 
@@ -64,10 +73,9 @@ def init_nifti_functional_connectivity_wf(
     """
     workflow = Workflow(name=name)
 
-    workflow.__desc__ = f"""
+    workflow.__desc__ = """
 Processed functional timeseries were extracted from the residual BOLD signal
-with *Nilearn's* [version {nl.__version__}, @nilearn] *NiftiLabelsMasker* for the following
-atlases:
+as the mean time series of the voxels in each parcel of the following atlases:
 the Schaefer 17-network 100, 200, 300, 400, 500, 600, 700, 800, 900, and 1000 parcel
 atlas [@Schaefer_2017], the Glasser atlas [@Glasser_2016],
 the Gordon atlas [@Gordon_2014], and the Tian subcortical artlas [@tian2020topographic].
@@ -111,12 +119,22 @@ which was operationalized as the Pearson's correlation of each parcel's unsmooth
         name="get_transformfile_node",
     )
 
-    # Using the generated transforms, apply them to get everything in the correct MNI form
+    # Compose the transforms once, rather than in every atlas warp
+    compose_transforms = pe.Node(
+        ComposeTransforms(dimension=3),
+        name="compose_std2native_transform",
+        mem_gb=mem_gb,
+        n_procs=omp_nthreads,
+    )
+
+    # Using the generated transforms, apply them to get everything in the correct MNI form.
+    # The stacked atlases are rewritten by every run, so they would never hit the warp cache.
     atlas_transform = pe.MapNode(
         ApplyTransformsx(
-            interpolation="MultiLabel",
+            interpolation="GenericLabel" if stack_atlases else "MultiLabel",
             input_image_type=3,
             dimension=3,
+            cache_output=not stack_atlases,
         ),
         name="atlas_mni_to_native",
         iterfield=["input_image"],
@@ -124,10 +142,10 @@ which was operationalized as the Pearson's correlation of each parcel's unsmooth
         n_procs=omp_nthreads,
     )
 
-    nifti_connect = pe.MapNode(
+    # A single node reads the BOLD data once for all of the atlases
+    nifti_connect = pe.Node(
         NiftiConnect(),
         name="nifti_connect",
-        iterfield=["atlas"],
         mem_gb=mem_gb,
     )
 
@@ -143,28 +161,48 @@ which was operationalized as the Pearson's correlation of each parcel's unsmooth
         (inputnode, get_transformfile_node, [("bold_file", "bold_file"),
                                              ("mni_to_t1w", "mni_to_t1w"),
                                              ("t1w_to_native", "t1w_to_native")]),
+        (inputnode, compose_transforms, [("ref_file", "reference_image")]),
         (inputnode, atlas_transform, [("ref_file", "reference_image")]),
         (inputnode, nifti_connect, [("clean_bold", "filtered_file")]),
         (inputnode, matrix_plot, [("clean_bold", "in_file")]),
         (atlas_name_grabber, outputnode, [("atlas_names", "atlas_names")]),
         (atlas_name_grabber, atlas_file_grabber, [("atlas_names", "atlas_name")]),
         (atlas_name_grabber, matrix_plot, [["atlas_names", "atlas_names"]]),
-        (atlas_file_grabber, atlas_transform, [("atlas_file", "input_image")]),
-        (get_transformfile_node, atlas_transform, [("transformfile", "transforms")]),
-        (atlas_transform, nifti_connect, [("output_image", "atlas")]),
+        (atlas_name_grabber, nifti_connect, [("atlas_names", "atlas_names")]),
+        (get_transformfile_node, compose_transforms, [("transformfile", "transforms")]),
+        (compose_transforms, atlas_transform, [("output_image", "transforms")]),
         (nifti_connect, outputnode, [("time_series_tsv", "timeseries"),
                                      ("fcon_matrix_tsv", "correlations")]),
         (nifti_connect, matrix_plot, [("time_series_tsv", "time_series_tsv")]),
         (matrix_plot, outputnode, [("connectplot", "connectplot")]),
     ])
 
+    if stack_atlases:
+        # Warp all atlases that share a voxel grid with a single ANTs call
+        stack_atlases_node = pe.Node(StackAtlases(), name="stack_atlases", mem_gb=mem_gb)
+        split_atlases_node = pe.Node(SplitAtlases(), name="split_atlases", mem_gb=mem_gb)
+
+        workflow.connect([
+            (atlas_file_grabber, stack_atlases_node, [("atlas_file", "atlases")]),
+            (atlas_file_grabber, split_atlases_node, [("atlas_file", "atlases")]),
+            (stack_atlases_node, atlas_transform, [("stacked_atlases", "input_image")]),
+            (stack_atlases_node, split_atlases_node, [("atlas_index", "atlas_index")]),
+            (atlas_transform, split_atlases_node, [("output_image", "stacked_atlases")]),
+            (split_atlases_node, nifti_connect, [("atlases", "atlases")]),
+        ])
+    else:
+        workflow.connect([
+            (atlas_file_grabber, atlas_transform, [("atlas_file", "input_image")]),
+            (atlas_transform, nifti_connect, [("output_image", "atlases")]),
+        ])
+
     return workflow
 
 
 @fill_doc
 def init_cifti_functional_connectivity_wf(
     mem_gb,
-    omp_nthreads,
+    precision="float64",
     name="cifti_fcon_wf",
 ):
     """Extract CIFTI time series.
@@ -177,14 +215,16 @@ def init_cifti_functional_connectivity_wf(
             from xcp_d.workflow.connectivity import init_cifti_functional_connectivity_wf
             wf = init_cifti_functional_connectivity_wf(
                 mem_gb=0.1,
-                omp_nthreads=1,
+                precision="float64",
                 name="cifti_fcon_wf",
             )
 
     Parameters
     ----------
     %(mem_gb)s
-    %(omp_nthreads)s
+    %(precision)s
+    %(name)s
+        Default is "cifti_fcon_wf".
 
     Inputs
     ------
@@ -207,14 +247,13 @@ def init_cifti_functional_connectivity_wf(
     """
     workflow = Workflow(name=name)
     workflow.__desc__ = """
-Processed functional timeseries were extracted from residual BOLD using
-Connectome Workbench [@hcppipelines] for the following atlases:
+Processed functional timeseries were extracted from residual BOLD as the mean time series
+of the grayordinates in each parcel of the following atlases:
 the Schaefer 17-network 100, 200, 300, 400, 500, 600, 700, 800, 900, and 1000 parcel
 atlas [@Schaefer_2017], the Glasser atlas [@Glasser_2016],
 the Gordon atlas [@Gordon_2014], and the Tian subcortical artlas [@tian2020topographic].
 Corresponding pair-wise functional connectivity between all regions was computed for each atlas,
-which was operationalized as the Pearson's correlation of each parcel's unsmoothed timeseries with
-the Connectome Workbench.
+which was operationalized as the Pearson's correlation of each parcel's unsmoothed timeseries.
 """
 
     inputnode = pe.Node(
@@ -242,20 +281,11 @@ the Connectome Workbench.
         iterfield=["atlas_name"],
     )
 
-    parcellate_data = pe.MapNode(
-        CiftiParcellate(direction="COLUMN"),
-        mem_gb=mem_gb,
-        name="parcellate_data",
-        n_procs=omp_nthreads,
-        iterfield=["atlas_label"],
-    )
-
-    correlate_data = pe.MapNode(
-        CiftiCorrelation(),
+    # A single node reads the dense time series once for all of the atlases
+    cifti_connect = pe.Node(
+        CiftiConnect(precision=precision),
         mem_gb=mem_gb,
-        name="correlate_data",
-        n_procs=omp_nthreads,
-        iterfield=["in_file"],
+        name="cifti_connect",
     )
 
     # Create a node to plot the matrixes
@@ -266,16 +296,16 @@ the Connectome Workbench.
     )
 
     workflow.connect([
-        (inputnode, parcellate_data, [("clean_bold", "in_file")]),
+        (inputnode, cifti_connect, [("clean_bold", "filtered_file")]),
         (inputnode, matrix_plot, [("clean_bold", "in_file")]),
         (atlas_name_grabber, outputnode, [("atlas_names", "atlas_names")]),
         (atlas_name_grabber, atlas_file_grabber, [("atlas_names", "atlas_name")]),
         (atlas_name_grabber, matrix_plot, [["atlas_names", "atlas_names"]]),
-        (atlas_file_grabber, parcellate_data, [("atlas_file", "atlas_label")]),
-        (parcellate_data, correlate_data, [("out_file", "in_file")]),
-        (parcellate_data, outputnode, [("out_file", "timeseries")]),
-        (correlate_data, outputnode, [("out_file", "correlations")]),
-        (parcellate_data, matrix_plot, [("out_file", "time_series_tsv")]),
+        (atlas_name_grabber, cifti_connect, [("atlas_names", "atlas_names")]),
+        (atlas_file_grabber, cifti_connect, [("atlas_file", "atlases")]),
+        (cifti_connect, outputnode, [("timeseries", "timeseries"),
+                                     ("correlations", "correlations")]),
+        (cifti_connect, matrix_plot, [("timeseries", "time_series_tsv")]),
         (matrix_plot, outputnode, [("connectplot", "connectplot")]),
     ])
 
@@ -13,7 +13,7 @@ from niworkflows.engine.workflows import LiterateWorkflow as Workflow
 from templateflow.api import get as get_template
 
 from xcp_d.interfaces.bids import DerivativesDataSink
-from xcp_d.interfaces.connectivity import ApplyTransformsx
+from xcp_d.interfaces.connectivity import ApplyTransformsx, ComposeTransforms
 from xcp_d.interfaces.surfplotting import (
     BrainPlotx,
     PlotImage,
@@ -153,6 +153,7 @@ def init_execsummary_wf(omp_nthreads,
                         TR,
                         mem_gb,
                         layout,
+                        precision="float64",
                         name='execsummary_wf'):
     """Generate an executive summary.
 
@@ -164,13 +165,13 @@ def init_execsummary_wf(omp_nthreads,
     TR
     %(mem_gb)s
     layout
+    %(precision)s
     %(name)s
 
     Inputs
     ------
     t1w
     t1seg
-    regressed_data
     residual_data
     filtered_motion
     rawdata
@@ -182,7 +183,6 @@ def init_execsummary_wf(omp_nthreads,
     inputnode = pe.Node(niu.IdentityInterface(fields=[
         't1w',
         't1seg',
-        'regressed_data',
         'residual_data',
         'filtered_motion',
         'rawdata',
@@ -234,6 +234,13 @@ def init_execsummary_wf(omp_nthreads,
     get_std2native_transform.inputs.bold_file = bold_file
     get_std2native_transform.inputs.t1w_to_native = t1_to_native(bold_file)
 
+    # Compose the transforms into a single displacement field
+    compose_transforms = pe.Node(
+        ComposeTransforms(dimension=3, reference_image=bold_reference_file),
+        name='compose_std2native_transform',
+        n_procs=omp_nthreads,
+        mem_gb=mem_gb)
+
     # Transform the file to native space
     resample_parc = pe.Node(ApplyTransformsx(
         dimension=3,
@@ -244,13 +251,14 @@ def init_execsummary_wf(omp_nthreads,
                          suffix='dseg',
                          extension=['.nii', '.nii.gz'])),
         interpolation='MultiLabel',
-        reference_image=bold_reference_file),
+        reference_image=bold_reference_file,
+        cache_output=True),
         name='resample_parc',
         n_procs=omp_nthreads,
         mem_gb=mem_gb * 3 * omp_nthreads)
 
     # Plot the SVG files
-    plot_svgx_wf = pe.Node(PlotSVGData(TR=TR, rawdata=bold_file),
+    plot_svgx_wf = pe.Node(PlotSVGData(TR=TR, rawdata=bold_file, precision=precision),
                            name='plot_svgx_wf',
                            mem_gb=mem_gb,
                            n_procs=omp_nthreads)
@@ -291,11 +299,11 @@ def init_execsummary_wf(omp_nthreads,
     workflow.connect([
         (plotrefbold_wf, ds_plot_bold_reference_file_wf, [('out_file', 'in_file')]),
         (inputnode, plot_svgx_wf, [('filtered_motion', 'filtered_motion'),
-                                   ('regressed_data', 'regressed_data'),
                                    ('residual_data', 'residual_data'), ('mask', 'mask'),
                                    ('bold_file', 'rawdata')]),
         (inputnode, get_std2native_transform, [('mni_to_t1w', 'mni_to_t1w')]),
-        (get_std2native_transform, resample_parc, [('transform_list', 'transforms')]),
+        (get_std2native_transform, compose_transforms, [('transform_list', 'transforms')]),
+        (compose_transforms, resample_parc, [('output_image', 'transforms')]),
         (resample_parc, plot_svgx_wf, [('output_image', 'seg_data')]),
         (plot_svgx_wf, ds_plot_svg_before_wf, [('before_process', 'in_file')]),
         (plot_svgx_wf, ds_plot_svg_after_wf, [('after_process', 'in_file')]),
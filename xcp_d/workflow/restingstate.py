@@ -23,6 +23,8 @@ def init_compute_alff_wf(
     smoothing,
     cifti,
     omp_nthreads,
+    work_format="nii.gz",
+    precision="float64",
     name="compute_alff_wf",
 ):
     """Compute alff for both nifti and cifti.
@@ -41,6 +43,8 @@ def init_compute_alff_wf(
                 smoothing=6,
                 cifti=False,
                 omp_nthreads=1,
+                work_format="nii.gz",
+                precision="float64",
                 name="compute_alff_wf",
             )
 
@@ -56,6 +60,8 @@ def init_compute_alff_wf(
     %(smoothing)s
     %(cifti)s
     %(omp_nthreads)s
+    %(work_format)s
+    %(precision)s
     %(name)s
         Default is "compute_alff_wf".
 
@@ -93,7 +99,9 @@ calculated at each voxel to yield voxel-wise ALFF measures.
 
     # compute alff
     alff_compt = pe.Node(ComputeALFF(TR=TR, lowpass=lowpass,
-                                     highpass=highpass),
+                                     highpass=highpass,
+                                     work_format=work_format,
+                                     precision=precision),
                          mem_gb=mem_gb,
                          name='alff_compt',
                          n_procs=omp_nthreads)
@@ -251,6 +259,7 @@ vertices to yield ReHo.
 def init_3d_reho_wf(
     mem_gb,
     omp_nthreads,
+    precision="float64",
     name="afni_reho_wf",
 ):
     """Compute ReHo on volumetric (NIFTI) data.
@@ -264,6 +273,7 @@ def init_3d_reho_wf(
             wf = init_3d_reho_wf(
                 mem_gb=0.1,
                 omp_nthreads=1,
+                precision="float64",
                 name="afni_reho_wf",
             )
 
@@ -271,6 +281,7 @@ def init_3d_reho_wf(
     ----------
     %(mem_gb)s
     %(omp_nthreads)s
+    %(precision)s
     %(name)s
         Default is "afni_reho_wf".
 
@@ -288,7 +299,8 @@ def init_3d_reho_wf(
     """
     workflow = Workflow(name=name)
     workflow.__desc__ = """
-Regional homogeneity (ReHo) was computed with neighborhood voxels using *3dReHo* in AFNI [@afni].
+Regional homogeneity (ReHo) was computed as Kendall's coefficient of concordance between
+each voxel's time series and those of its 26 neighboring voxels, as in AFNI's *3dReHo* [@afni].
 """
 
     inputnode = pe.Node(
@@ -297,10 +309,10 @@ Regional homogeneity (ReHo) was computed with neighborhood voxels using *3dReHo*
     outputnode = pe.Node(
         niu.IdentityInterface(fields=['reho_out', 'rehohtml']),
         name='outputnode')
-    from xcp_d.interfaces.resting_state import ReHoNamePatch
+    from xcp_d.interfaces.resting_state import NiftiReHo
 
-    # Run AFNI'S 3DReHo on the data
-    compute_reho = pe.Node(ReHoNamePatch(neighborhood='vertices'),
+    # Compute ReHo over 27-voxel neighborhoods
+    compute_reho = pe.Node(NiftiReHo(neighborhood='vertices', precision=precision),
                            name="reho_3d",
                            mem_gb=mem_gb,
                            n_procs=omp_nthreads)